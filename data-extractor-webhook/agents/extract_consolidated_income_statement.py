@@ -30,15 +30,41 @@
         >>> extract_consolidated_income_statement(report_data)
         {'page_numbers': [3, 5, 7], 'status': 'relevant', 'company_name': 'ABC Corp'}
     """
-from openai import OpenAI
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+import os
+import json
+import logging
+
+from agents.runtime import OPENAI_TPM, runtime
+from utils.page_chunker import chunk_pages
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the prompt or response schema changes, to invalidate cached selections
+PROMPT_VERSION = "2"
+
+# Maximum tokens of one page-selection prompt in budgeted mode; by default half of the
+# tokens-per-minute limit, so a prompt never has to wait for more than the limit refills
+PAGE_SELECTION_TOKEN_BUDGET = int(os.getenv("PAGE_SELECTION_TOKEN_BUDGET", str(OPENAI_TPM // 2)))
+PAGE_SELECTION_CHUNK_WORKERS = int(os.getenv("PAGE_SELECTION_CHUNK_WORKERS", "4"))
+# Tokens of the instructions wrapped around the document
+PROMPT_OVERHEAD_TOKENS = 800
+
+if OPENAI_TPM > 0 and PAGE_SELECTION_TOKEN_BUDGET > OPENAI_TPM:
+    logger.warning("PAGE_SELECTION_TOKEN_BUDGET (%d) exceeds OPENAI_TPM (%d); each "
+                   "page-selection prompt will drain the whole token limit",
+                   PAGE_SELECTION_TOKEN_BUDGET, OPENAI_TPM)
 
 def extract_consolidated_income_statement(cse_report):
     """
     agent: extract consolidate income statement
     """
 
-    client = OpenAI()
-    completion = client.chat.completions.create(
+    completion = runtime.create_chat_completion(
+    "extract_consolidated_income_statement",
     model="gpt-4o",
     messages=[
         {"role": "system", "content": """You are an AI assistant specialized in
@@ -122,3 +148,76 @@ def extract_consolidated_income_statement(cse_report):
     )
 
     return completion.choices[0].message.content
+
+def extract_consolidated_income_statement_budgeted(
+    cse_report: Dict[str, Any],
+    token_budget: int = PAGE_SELECTION_TOKEN_BUDGET,
+    workers: int = PAGE_SELECTION_CHUNK_WORKERS
+) -> str:
+    """
+    Select the consolidated income statement pages of a report of any size.
+
+    Pages are serialized compactly and split into chunks under the token budget. The
+    chunks are queried in parallel (map), and when different chunks found different
+    candidates the agent chooses among only those candidate pages (reduce).
+
+    Args:
+        cse_report (Dict[str, Any]): Output of extract_pdf_text_from_url
+        token_budget (int): Maximum tokens of a single prompt
+        workers (int): Maximum number of chunks queried at the same time
+
+    Returns:
+        str: JSON with "page_numbers", "status" and "company_name", as returned by
+            extract_consolidated_income_statement
+    """
+    pages = cse_report.get("data") or []
+    document_budget = max(1, token_budget - PROMPT_OVERHEAD_TOKENS)
+    chunks = chunk_pages(pages, document_budget)
+    if len(chunks) <= 1:
+        return extract_consolidated_income_statement(chunks[0][1] if chunks else "[]")
+
+    logger.info("Selecting pages from %d pages in %d chunks", len(pages), len(chunks))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as executor:
+        selections = list(executor.map(
+            lambda chunk: json.loads(extract_consolidated_income_statement(chunk[1])), chunks
+        ))
+
+    relevant = [selection for selection in selections if selection.get("status") == "relevant"]
+    merged = _merge_selections(relevant or selections)
+    candidate_numbers = set(merged["page_numbers"])
+    # Chunks sharing an overlap page both find a statement printed on it; only candidates
+    # that no single chunk found together need to be compared
+    if len(relevant) <= 1 or any(
+        set(_page_numbers(selection)) >= candidate_numbers for selection in relevant
+    ):
+        return json.dumps(merged)
+
+    # Candidates from several chunks: let the agent compare them side by side
+    candidates = [page for page in pages if page["page_number"] in candidate_numbers]
+    reduce_chunks = chunk_pages(candidates, document_budget, overlap=0)
+    if len(reduce_chunks) == 1:
+        final = json.loads(extract_consolidated_income_statement(reduce_chunks[0][1]))
+        final_pages = [page for page in _page_numbers(final) if page in candidate_numbers]
+        if final.get("status") == "relevant" and final_pages:
+            merged = {
+                "page_numbers": final_pages,
+                "status": "relevant",
+                "company_name": final.get("company_name") or merged["company_name"],
+            }
+    return json.dumps(merged)
+
+def _page_numbers(selection: Dict[str, Any]) -> List[int]:
+    return sorted({int(page) for page in selection.get("page_numbers") or []})
+
+def _merge_selections(selections: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine chunk selections into one, taking the most frequent company name."""
+    page_numbers = sorted({page for selection in selections for page in _page_numbers(selection)})
+    names = Counter(selection["company_name"] for selection in selections
+                    if selection.get("company_name"))
+    return {
+        "page_numbers": page_numbers,
+        "status": "relevant" if any(
+            selection.get("status") == "relevant" for selection in selections
+        ) else "not relevant",
+        "company_name": names.most_common(1)[0][0] if names else "",
+    }
@@ -6,7 +6,10 @@ documents using OpenAI's GPT-4 Vision model. It processes both images and text
 to generate structured financial data in JSON format.
 """
 
-from openai import OpenAI
+from agents.runtime import runtime
+
+# Bump whenever the prompt or response schema changes, to invalidate cached extractions
+PROMPT_VERSION = "1"
 
 
 def pnl_data_extractor(base64_images, input_pdf_pages):
@@ -36,12 +39,11 @@ def pnl_data_extractor(base64_images, input_pdf_pages):
   4. Format data dynamically
   5. Assign extracted values accurately
   Note:
-    - Requires OpenAI API client
+    - Requires OpenAI API client (shared through agents.runtime)
     - Uses GPT-4 model for processing
     - Handles both image and text inputs for comprehensive extraction
     """
 
-    client = OpenAI()
     messages = [
         {"role": "system", "content":
          """
@@ -213,7 +215,8 @@ Process the given financial document and extract key financial metrics specifica
 
         }
     # Send the request
-    response = client.chat.completions.create(
+    response = runtime.create_chat_completion(
+        "pnl_data_extractor",
         model="gpt-4o",
         messages=messages,
         response_format=response_format,
@@ -0,0 +1,118 @@
+"""
+Financial Section Re-extraction Agent
+
+This module contains an AI agent that reads a single section of a Profit and Loss
+statement again, after local validation found that its figures do not add up. It sends
+only the failed section, the checks it failed and a crop of the statement down to that
+section, instead of repeating the full multi-image extraction.
+"""
+
+import json
+
+from agents.runtime import runtime
+
+# Bump whenever the prompt or response schema changes, to invalidate cached validations
+PROMPT_VERSION = "1"
+
+
+def pnl_section_extractor(base64_images, page_text, section, period, failed_checks):
+    """
+    Re-extracts one section of a Profit and Loss statement.
+
+    Args:
+        base64_images (list): Base64 encoded JPEG crops of the statement down to the section
+        page_text (str): Extracted text of the page holding the section
+        section (dict): The section as first extracted, with "title" and "fields"
+        period (str): Reporting period and year of the column to read, e.g.
+            "3 months ended 30 September 2024"
+        failed_checks (list): Validation checks that failed, with "check", "label" and,
+            for identities, "expected" and "actual"
+
+    Returns:
+        str: JSON formatted string of the corrected section, with:
+            - title (str): Section name
+            - fields (list): Array of financial entries with label, value and bold
+    """
+
+    messages = [
+        {"role": "system", "content":
+         """
+You are an expert in financial data extraction. A section of a Profit and Loss statement
+was extracted, but its figures do not add up. Read the section again from the document
+and return it corrected:
+- Use only the column of the given reporting period.
+- Keep every row of the section, in the order of the document, with its exact label.
+- Give costs, expenses and losses as negative numbers when the document shows them in
+  parentheses, and keep subtotals as printed.
+- Mark the rows printed in bold.
+"""
+        },
+        {"role": "user", "content": [{"type": "text", "text": f"""
+Reporting period: {period}
+
+Section as extracted:
+{json.dumps(section, indent=1)}
+
+Failed checks:
+{json.dumps(failed_checks, indent=1)}
+
+Extracted page text: {page_text}
+"""}]
+        }
+    ]
+    for base64_image in base64_images:
+        messages.append({
+            "role": "user",
+            "content": [{"type": "image_url", "image_url":
+            {"url": f"data:image/jpeg;base64,{base64_image}"}}]
+        })
+
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "financial_section",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "title": {
+                        "type": "string",
+                        "description": "The title of the section."
+                    },
+                    "fields": {
+                        "type": "array",
+                        "description": "The fields within the section.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "label": {
+                                    "type": "string",
+                                    "description": "The label for the field."
+                                },
+                                "value": {
+                                    "type": "number",
+                                    "description": "The value associated with the label."
+                                },
+                                "bold": {
+                                    "type": "boolean",
+                                    "description": "Indicates if the field is printed in bold."
+                                }
+                            },
+                            "required": ["label", "value", "bold"],
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["title", "fields"],
+                "additionalProperties": False
+            },
+            "strict": True
+        }
+    }
+    response = runtime.create_chat_completion(
+        "pnl_section_extractor",
+        model="gpt-4o",
+        messages=messages,
+        response_format=response_format,
+        max_tokens=600,
+    )
+    return response.choices[0].message.content
@@ -0,0 +1,241 @@
+"""
+Agent Runtime
+
+This module provides the shared runtime used by every AI agent to call the OpenAI API:
+- One pooled OpenAI client per process, so HTTP connections are reused across calls
+- Jittered exponential backoff on rate limits (429), server errors (5xx) and timeouts
+- Token-bucket limiting of requests and tokens per minute, plus a concurrency cap,
+  so several job workers do not hit the account rate limit together
+- Per-call latency and token-usage reporting
+
+The client honours OPENAI_BASE_URL, so agents can be exercised against a local stub
+server that implements the chat completions endpoint. The openai package is imported with
+the first call rather than at import, since it dominates the start-up time of a worker.
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+import os
+import time
+import random
+import logging
+import threading
+
+from utils.token_count import count_tokens
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+# Limits apply per server process; divide the account limits by the number of processes
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+# Leaves room for two of the largest prompts the agents send (PAGE_SELECTION_TOKEN_BUDGET)
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "120000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+
+# gpt-4o high-detail cost of a page image scaled to 768px on its short side (2x3 tiles)
+IMAGE_TOKEN_ESTIMATE = 1105
+
+UsageListener = Callable[[str, Dict[str, Any]], None]
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `per_minute` units per minute.
+
+    A request for more units than the bucket holds is allowed once the bucket is full,
+    so oversized calls are delayed rather than blocked forever.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        Block until `amount` units are available and take them.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(
+                    self.capacity, self._available + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._available >= amount:
+                    self._available -= amount
+                    return waited
+                delay = (amount - self._available) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def refund(self, amount: float) -> None:
+        """Return units that were reserved but not used."""
+        with self._lock:
+            self._available = min(self.capacity, self._available + amount)
+
+class AgentRuntime:
+    """Shared OpenAI client, retry policy, rate limiters and usage reporting."""
+
+    def __init__(self) -> None:
+        self._client: Optional["OpenAI"] = None
+        self._client_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.request_bucket = TokenBucket(OPENAI_RPM)
+        self.token_bucket = TokenBucket(OPENAI_TPM)
+        self._concurrency = threading.BoundedSemaphore(max(1, OPENAI_MAX_CONCURRENCY))
+        self._usage: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._listeners: List[UsageListener] = []
+
+    @property
+    def client(self) -> "OpenAI":
+        """Return the process-wide client, creating it after start-up or a fork."""
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                from openai import OpenAI  # pylint: disable=import-outside-toplevel
+                # Retries are handled here so that limiter waits and backoff stay in one place
+                self._client = OpenAI(max_retries=0, timeout=OPENAI_TIMEOUT)
+                self._client_pid = os.getpid()
+            return self._client
+
+    def add_usage_listener(self, listener: UsageListener) -> None:
+        """Register a callback invoked with (agent, call_report) after every call."""
+        self._listeners.append(listener)
+
+    def create_chat_completion(self, agent: str, **request: Any) -> Any:
+        """
+        Create a chat completion with rate limiting, retries and usage reporting.
+
+        Args:
+            agent (str): Name of the calling agent, used in reports
+            **request: Arguments for client.chat.completions.create
+
+        Returns:
+            The ChatCompletion returned by the API
+
+        Raises:
+            openai.OpenAIError: If the call fails permanently or retries are exhausted
+        """
+        import openai  # pylint: disable=import-outside-toplevel
+
+        estimated_tokens = _estimate_request_tokens(request)
+        started = time.monotonic()
+        waited = 0.0
+        attempt = 0
+
+        while True:
+            waited += self.request_bucket.acquire(1)
+            waited += self.token_bucket.acquire(estimated_tokens)
+            try:
+                with self._concurrency:
+                    completion = self.client.chat.completions.create(**request)
+                break
+            except retryable_errors() as e:
+                # A failed attempt is not billed, so only the call that succeeds spends tokens
+                self.token_bucket.refund(estimated_tokens)
+                attempt += 1
+                if attempt > OPENAI_MAX_RETRIES:
+                    self._report(agent, started, waited, attempt, None, error=e)
+                    raise
+                delay = _retry_delay(e, attempt)
+                logger.warning("%s call failed (%s), retrying in %.1fs (attempt %d/%d)",
+                               agent, type(e).__name__, delay, attempt, OPENAI_MAX_RETRIES)
+                time.sleep(delay)
+                waited += delay
+            except openai.OpenAIError as e:
+                self.token_bucket.refund(estimated_tokens)
+                self._report(agent, started, waited, attempt + 1, None, error=e)
+                raise
+
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            # Give back the part of the reservation the call did not use
+            self.token_bucket.refund(max(0, estimated_tokens - usage.total_tokens))
+        self._report(agent, started, waited, attempt + 1, usage)
+        return completion
+
+    def _report(self, agent: str, started: float, waited: float, attempts: int,
+                usage: Any, error: Optional[Exception] = None) -> None:
+        report = {
+            "latency": round(time.monotonic() - started, 3),
+            "limiter_wait": round(waited, 3),
+            "attempts": attempts,
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "error": type(error).__name__ if error else None,
+        }
+        with self._lock:
+            totals = self._usage[agent]
+            totals["calls"] += 1
+            totals["errors"] += 1 if error else 0
+            totals["retries"] += attempts - 1
+            totals["latency"] += report["latency"]
+            totals["prompt_tokens"] += report["prompt_tokens"]
+            totals["completion_tokens"] += report["completion_tokens"]
+
+        logger.info("%s call: %.2fs (%.2fs waiting), %d attempt(s), %d prompt + %d completion tokens",
+                    agent, report["latency"], report["limiter_wait"], attempts,
+                    report["prompt_tokens"], report["completion_tokens"])
+        for listener in self._listeners:
+            listener(agent, report)
+
+    def usage_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return accumulated calls, errors, retries, latency and tokens per agent."""
+        with self._lock:
+            return {agent: dict(totals) for agent, totals in self._usage.items()}
+
+@lru_cache(maxsize=1)
+def retryable_errors() -> Tuple[type, ...]:
+    """Return the retried OpenAI errors: rate limits, 5xx, connection errors and timeouts."""
+    import openai  # pylint: disable=import-outside-toplevel
+    return (
+        openai.RateLimitError,
+        openai.InternalServerError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+    )
+
+def _estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """Estimate the tokens a request will consume, for the tokens-per-minute limiter."""
+    tokens = 0
+    for message in request.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += count_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += count_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens + int(request.get("max_tokens") or 1000)
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Return the backoff before the next attempt, honouring Retry-After when present."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), OPENAI_BACKOFF_MAX)
+        except ValueError:
+            pass
+    # Full jitter: a random delay up to the exponential bound spreads out retrying workers
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+runtime = AgentRuntime()
@@ -0,0 +1,242 @@
+"""
+Bulk backfill of PnL statements for many CSE reports.
+
+Runs the report pipeline for every record read from a CSV/JSON Lines file or from the
+Supabase table, with several records in flight and a separate concurrency limit for the
+download, CPU-bound and LLM stages. Each finished record is appended to a checkpoint
+file, so an interrupted run resumes with the records that have not completed. Stage
+outputs are checkpointed in the job store, so a record that failed resumes at its first
+incomplete stage.
+
+Usage:
+    python backfill.py --input records.csv --checkpoint q3.checkpoint.jsonl
+    python backfill.py --from-supabase --status error --llm-concurrency 2
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from report_pipeline import ReportPipeline, update_record_status
+from utils.job_queue import JobStore
+# pylint: disable=import-error
+from utils.supabase_client import get_supabase
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Stages bounded by each concurrency limit
+STAGE_GROUPS = {
+    "download": ("download",),
+    "cpu": ("text_extraction", "layout_prediction", "page_ranking", "local_extraction",
+            "image_extraction", "report_generation", "page_indexing", "history_recording"),
+    "llm": ("page_selection", "data_extraction", "validation"),
+}
+
+# Checkpointed outcomes that are not processed again on resume
+COMPLETED_STATUSES = ("success", "not_relevant")
+
+SUPABASE_PAGE_SIZE = 1000
+
+Record = Tuple[str, str]
+
+def read_records_file(path: str) -> Iterator[Record]:
+    """
+    Read (record_id, cse_report_url) pairs from a file.
+
+    CSV files need `id` and `cse_report` columns; any other file is read as JSON Lines
+    with the same keys, which matches the webhook `record` payload.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        rows = csv.DictReader(file) if path.endswith(".csv") else (
+            json.loads(line) for line in file if line.strip()
+        )
+        for row in rows:
+            if row.get("id") and row.get("cse_report"):
+                yield str(row["id"]), row["cse_report"]
+            else:
+                logger.warning("Skipping row without id or cse_report: %s", row)
+
+def read_records_supabase(status: Optional[str] = None) -> Iterator[Record]:
+    """Read (record_id, cse_report_url) pairs from the Supabase table, page by page."""
+    supabase = get_supabase()
+    start = 0
+    while True:
+        query = supabase.table('table').select('id, cse_report')
+        if status:
+            query = query.eq('status', status)
+        rows = query.order('id').range(start, start + SUPABASE_PAGE_SIZE - 1).execute().data
+        for row in rows:
+            if row.get("cse_report"):
+                yield str(row["id"]), row["cse_report"]
+        if len(rows) < SUPABASE_PAGE_SIZE:
+            return
+        start += SUPABASE_PAGE_SIZE
+
+class Checkpoint:
+    """Append-only JSON Lines log of finished records, safe to write from several threads."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def completed(self) -> Set[str]:
+        """Return the ids of records whose latest checkpointed outcome is completed."""
+        latest: Dict[str, str] = {}
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by an interrupted run
+                    continue
+                latest[entry["record_id"]] = entry["status"]
+        return {record_id for record_id, status in latest.items()
+                if status in COMPLETED_STATUSES}
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        """Record the outcome of one record."""
+        line = json.dumps(entry) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+class Backfill:
+    """Runs the report pipeline for many records with per-stage concurrency limits."""
+
+    def __init__(self, checkpoint: Checkpoint, jobs: int, limits: Dict[str, int],
+                 stage_checkpoints: Optional[JobStore] = None) -> None:
+        self.checkpoint = checkpoint
+        self.stage_checkpoints = stage_checkpoints
+        self.jobs = jobs
+        self.stage_limits = {
+            stage: threading.BoundedSemaphore(max(1, limits[group]))
+            for group, stages in STAGE_GROUPS.items() for stage in stages
+        }
+        self.outcomes: Counter = Counter()
+        self.stage_seconds: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def process(self, record: Record) -> None:
+        """Run the pipeline for one record and checkpoint its outcome."""
+        record_id, cse_report_url = record
+        started_at: Dict[str, float] = {}
+
+        def on_stage(stage: str, state: str) -> None:
+            if state == "running":
+                started_at[stage] = time.monotonic()
+            elif stage in started_at:
+                with self._lock:
+                    self.stage_seconds[stage] += time.monotonic() - started_at.pop(stage)
+
+        started = time.monotonic()
+        error = None
+        validation = None
+        try:
+            result = ReportPipeline(
+                record_id, cse_report_url, on_stage, self.stage_limits, self.stage_checkpoints
+            ).run()
+            status = result["status"]
+            validation = result.get("validation")
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Backfill of record %s failed: %s", record_id, e)
+            update_record_status(record_id, 'error')
+            status, error = "error", str(e)
+
+        self.checkpoint.append({
+            "record_id": record_id,
+            "cse_report_url": cse_report_url,
+            "status": status,
+            "error": error,
+            "validation": validation,
+            "duration": round(time.monotonic() - started, 3),
+            "finished_at": time.time(),
+        })
+        with self._lock:
+            self.outcomes[status] += 1
+
+    def run(self, records: List[Record]) -> Dict[str, Any]:
+        """
+        Process the records and return a throughput summary.
+
+        Returns:
+            Dict[str, Any]: Record counts by outcome, elapsed time, throughput and
+                the total time spent in each stage
+        """
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs),
+                                thread_name_prefix="backfill") as executor:
+            for _ in executor.map(self.process, records):
+                pass
+        elapsed = time.monotonic() - started
+
+        processed = sum(self.outcomes.values())
+        return {
+            "processed": processed,
+            "outcomes": dict(self.outcomes),
+            "elapsed_seconds": round(elapsed, 1),
+            "records_per_minute": round(processed * 60 / elapsed, 2) if elapsed else 0.0,
+            "stage_seconds": {stage: round(seconds, 1)
+                              for stage, seconds in self.stage_seconds.items()},
+        }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the backfill from the command line."""
+    parser = argparse.ArgumentParser(description="Generate PnL statements for many CSE reports")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="CSV or JSON Lines file with id and cse_report")
+    source.add_argument("--from-supabase", action="store_true",
+                        help="Read the records from the Supabase table")
+    parser.add_argument("--status", help="With --from-supabase, only records with this status")
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.jsonl",
+                        help="Progress file used to resume an interrupted run")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Records in flight (default: sum of the stage limits)")
+    parser.add_argument("--download-concurrency", type=int, default=4)
+    parser.add_argument("--cpu-concurrency", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many records")
+    args = parser.parse_args(argv)
+
+    limits = {
+        "download": args.download_concurrency,
+        "cpu": args.cpu_concurrency,
+        "llm": args.llm_concurrency,
+    }
+    checkpoint = Checkpoint(args.checkpoint)
+    completed = checkpoint.completed()
+
+    records = read_records_file(args.input) if args.input else \
+        read_records_supabase(args.status)
+    pending, seen = [], set()
+    for record_id, cse_report_url in records:
+        if record_id in completed or record_id in seen:
+            continue
+        seen.add(record_id)
+        pending.append((record_id, cse_report_url))
+    if args.limit is not None:
+        pending = pending[:args.limit]
+
+    logger.info("Backfilling %d records (%d already completed in %s)",
+                len(pending), len(completed), args.checkpoint)
+    backfill = Backfill(checkpoint, args.jobs or sum(limits.values()), limits, JobStore())
+    summary = backfill.run(pending)
+    summary["skipped"] = len(completed)
+
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["outcomes"].get("error") else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
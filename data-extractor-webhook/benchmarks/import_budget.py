@@ -0,0 +1,119 @@
+"""
+Import-Time Budget Report
+
+Measures how long a fresh worker takes to import the webhook server, using Python's
+-X importtime, and reports the time per top-level package and any heavy dependency that
+is still imported eagerly. Each run uses a new interpreter, with the local SQLite
+stores in a temporary directory so nothing in the working tree is touched.
+
+Usage (from the data-extractor-webhook directory):
+    python -m benchmarks.import_budget
+    python -m benchmarks.import_budget --budget-ms 300 --output imports.json
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, List
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+from utils.startup import HEAVY_MODULES
+
+DEFAULT_MODULE = "webhook_listner"
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "300"))
+
+def _parse_importtime(stderr: str, module: str) -> List[Dict[str, Any]]:
+    """
+    Return the imports made while importing `module`, ending with `module` itself.
+
+    Imports made by the interpreter start-up (site and its dependencies) are excluded.
+    """
+    imports: List[Dict[str, Any]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entry = {"name": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us)}
+        if level == 0 and entry["name"] == module:
+            return imports + [entry]
+        imports = [] if level == 0 else imports + [entry]
+    raise RuntimeError(f"{module} was not imported; run this from the data-extractor-webhook "
+                       "directory")
+
+def measure_import(module: str) -> Dict[str, Any]:
+    """
+    Import a module in a new interpreter and break its import time down.
+
+    Returns:
+        Dict[str, Any]: The "total_ms", the self time of each top-level package under
+            "packages_ms" (slowest first) and the "eager_heavy_modules"
+    """
+    with tempfile.TemporaryDirectory(prefix="pnl-imports-") as work_dir:
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.getcwd(),
+            "JOB_DB_PATH": os.path.join(work_dir, "jobs.sqlite3"),
+            "LAYOUT_DB_PATH": os.path.join(work_dir, "layouts.sqlite3"),
+            "PAGE_INDEX_DB_PATH": os.path.join(work_dir, "pages.sqlite3"),
+            "PNL_HISTORY_DB_PATH": os.path.join(work_dir, "history.sqlite3"),
+        }
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            env=env, capture_output=True, text=True, check=False
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    imports = _parse_importtime(completed.stderr, module)
+    packages: Dict[str, int] = defaultdict(int)
+    for entry in imports:
+        packages[entry["name"].split(".")[0]] += entry["self_us"]
+    names = {entry["name"] for entry in imports}
+    return {
+        "total_ms": round(imports[-1]["cumulative_us"] / 1000, 1),
+        "packages_ms": {
+            package: round(self_us / 1000, 1)
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])
+        },
+        "eager_heavy_modules": [name for name in HEAVY_MODULES if name in names],
+    }
+
+def main() -> int:
+    """Run the import-time report from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--module", default=DEFAULT_MODULE, help="Module a worker imports")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Imports to measure; the fastest is kept")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Exit with 1 when the import takes longer than this")
+    parser.add_argument("--top", type=int, default=10, help="Packages listed in the report")
+    parser.add_argument("--output", help="Write the result as JSON to this file")
+    args = parser.parse_args()
+
+    # The first import also compiles bytecode, which a deployed worker does not pay for
+    measure_import(args.module)
+    result = min((measure_import(args.module) for _ in range(max(1, args.repeat))),
+                 key=lambda run: run["total_ms"])
+    result.update({"module": args.module, "budget_ms": args.budget_ms,
+                   "within_budget": result["total_ms"] <= args.budget_ms})
+
+    print(f"import {args.module}: {result['total_ms']:.1f} ms "
+          f"(budget {args.budget_ms:.0f} ms)", file=sys.stderr)
+    for package, elapsed in list(result["packages_ms"].items())[:args.top]:
+        print(f"  {package:<24} {elapsed:8.1f} ms", file=sys.stderr)
+    if result["eager_heavy_modules"]:
+        print(f"  imported eagerly: {', '.join(result['eager_heavy_modules'])}",
+              file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(json.dumps(result, indent=2) + "\n")
+    return 0 if result["within_budget"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
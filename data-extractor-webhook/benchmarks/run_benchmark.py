@@ -0,0 +1,276 @@
+"""
+Offline Pipeline Benchmark
+
+Generates synthetic CSE-style reports, runs every pipeline stage against local stubs for
+the PDF host, OpenAI and Supabase, and records wall time, CPU time and peak RSS per stage
+as JSON. The bytes of the images sent to the vision agent are measured next to those of the
+first statement page rendered the way the pipeline originally sent it. A previous result file can be passed as a baseline to compare runs.
+
+Usage (from the data-extractor-webhook directory):
+    python -m benchmarks.run_benchmark --output bench.json
+    python -m benchmarks.run_benchmark --baseline bench.json --output bench-new.json
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+import threading
+from contextlib import contextmanager
+
+from pdf2image import convert_from_path
+
+# The stubs must be in place before the pipeline modules are imported
+from benchmarks.stubs import install_supabase_stub, start_file_server, start_openai_stub
+from benchmarks.synthetic_reports import build_report
+
+install_supabase_stub()
+
+# pylint: disable=wrong-import-position
+from utils.pdf_document import PDFDocument, fetch_pdf_document
+from utils.extract_pdf_text_from_url import extract_pdf_text_from_url
+from utils.page_ranker import prefilter_pdf_text
+from utils.extract_page_images_from_pdf import extract_page_images_with_stats
+from utils.local_pnl_extractor import extract_pnl_locally
+from utils.create_pnl_pdf_report import create_pnl_pdf_report
+from agents.extract_consolidated_income_statement import extract_consolidated_income_statement
+from agents.pnl_data_extractor import pnl_data_extractor
+
+# (name, kind, pages, pnl_page)
+DEFAULT_SCENARIOS: List[Tuple[str, str, int, int]] = [
+    ("interim-10", "interim", 10, 3),
+    ("interim-40", "interim", 40, 6),
+    ("annual-150", "annual", 150, 92),
+    ("annual-500", "annual", 500, 311),
+]
+
+# The pipeline originally sent every statement page in full, in color, at 800 DPI
+ORIGINAL_IMAGE_DPI = 800
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def _current_rss() -> int:
+    """Return the resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # ru_maxrss is the lifetime peak in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class RSSSampler:
+    """Background thread tracking the peak RSS between resets."""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        """Start sampling."""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling."""
+        self._stop.set()
+        self._thread.join()
+
+    def reset(self) -> None:
+        """Start a new peak measurement from the current RSS."""
+        self.peak = _current_rss()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _current_rss())
+            time.sleep(self.interval)
+
+@contextmanager
+def measure(stages: Dict[str, Dict[str, Any]], name: str, sampler: RSSSampler):
+    """Record wall time, CPU time (own and child processes) and peak RSS of a stage."""
+    sampler.reset()
+    children_before = os.times()
+    started_wall, started_cpu = time.perf_counter(), time.process_time()
+    yield
+    wall = time.perf_counter() - started_wall
+    cpu = time.process_time() - started_cpu
+    children_after = os.times()
+    children_cpu = (children_after.children_user - children_before.children_user
+                    + children_after.children_system - children_before.children_system)
+    stages[name] = {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "children_cpu_s": round(children_cpu, 4),
+        "peak_rss_mb": round(max(sampler.peak, _current_rss()) / (1024 * 1024), 1),
+    }
+
+def original_page_bytes(document: PDFDocument, page_number: int) -> int:
+    """Return the JPEG size of a page rendered the way the pipeline originally sent it."""
+    image = convert_from_path(document.as_path(), dpi=ORIGINAL_IMAGE_DPI,
+                              first_page=page_number, last_page=page_number)[0]
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    image.close()
+    return len(buffer.getvalue())
+
+def run_scenario(base_url: str, file_name: str, sampler: RSSSampler) -> Dict[str, Any]:
+    """Run every pipeline stage on one served report and return per-stage measurements."""
+    stages: Dict[str, Dict[str, Any]] = {}
+
+    with measure(stages, "download", sampler):
+        document = fetch_pdf_document(f"{base_url}/{file_name}")
+
+    with document:
+        with measure(stages, "text_extraction", sampler):
+            pdf_text_result = extract_pdf_text_from_url(document)
+
+        with measure(stages, "page_ranking", sampler):
+            candidate_pages, prefilter_stats = prefilter_pdf_text(pdf_text_result)
+
+        with measure(stages, "page_selection", sampler):
+            relevant_pages = json.loads(extract_consolidated_income_statement(candidate_pages))
+        page_numbers = relevant_pages["page_numbers"]
+
+        with measure(stages, "local_extraction", sampler):
+            local_result = extract_pnl_locally(document, page_numbers)
+
+        images: List[str] = []
+        image_bytes: Optional[Dict[str, Any]] = None
+        if shutil.which("pdftoppm"):
+            with measure(stages, "image_extraction", sampler):
+                images, image_stats = extract_page_images_with_stats(document, page_numbers)
+            # Measured outside the stage, as the original render is much slower
+            image_bytes = {
+                "page": page_numbers[0],
+                "prepared": image_stats[0]["prepared_bytes"],
+                "original": original_page_bytes(document, page_numbers[0]),
+            }
+        else:
+            stages["image_extraction"] = {"skipped": "pdftoppm not found"}
+
+    extracted_content = [
+        item["content"] for item in pdf_text_result["data"]
+        if item["page_number"] in page_numbers
+    ]
+    with measure(stages, "data_extraction", sampler):
+        final_data = json.loads(pnl_data_extractor(images, extracted_content))
+
+    with measure(stages, "report_generation", sampler):
+        create_pnl_pdf_report(final_data, company_name=relevant_pages["company_name"])
+
+    return {
+        "pages": len(pdf_text_result["data"]),
+        "selected_pages": page_numbers,
+        "prefilter": prefilter_stats,
+        "local_confidence": local_result["confidence"],
+        "image_bytes": image_bytes,
+        "stages": stages,
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the wall-time ratio against the baseline for every common scenario stage."""
+    rows = []
+    for scenario, result in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        for stage, measured in result["stages"].items():
+            reference = base["stages"].get(stage, {})
+            if "wall_s" not in measured or not reference.get("wall_s"):
+                continue
+            rows.append({
+                "scenario": scenario,
+                "stage": stage,
+                "baseline_s": reference["wall_s"],
+                "current_s": measured["wall_s"],
+                "ratio": round(measured["wall_s"] / reference["wall_s"], 3),
+            })
+    return rows
+
+def _parse_scenarios(values: Optional[List[str]]) -> List[Tuple[str, str, int, int]]:
+    if not values:
+        return DEFAULT_SCENARIOS
+    scenarios = []
+    for value in values:
+        kind, pages, pnl_page = value.split(":")
+        scenarios.append((f"{kind}-{pages}", kind, int(pages), int(pnl_page)))
+    return scenarios
+
+def main() -> int:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--scenario", action="append", metavar="KIND:PAGES:PNL_PAGE",
+                        help="Report to generate, e.g. annual:300:180 (repeatable)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per scenario; the fastest run is kept")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="Seconds the OpenAI stub waits before answering")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a previous results file")
+    parser.add_argument("--fail-threshold", type=float, default=None,
+                        help="Exit with 1 when any stage is slower than baseline by this ratio")
+    args = parser.parse_args()
+
+    start_openai_stub(args.llm_latency)
+    sampler = RSSSampler()
+    sampler.start()
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "llm_latency_s": args.llm_latency,
+        },
+        "scenarios": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="pnl-bench-") as report_dir:
+        file_server, base_url = start_file_server(report_dir)
+        try:
+            for name, kind, pages, pnl_page in _parse_scenarios(args.scenario):
+                file_name = f"{name}.pdf"
+                with open(os.path.join(report_dir, file_name), "wb") as report:
+                    report.write(build_report(pages, pnl_page, kind))
+
+                runs = [run_scenario(base_url, file_name, sampler) for _ in range(args.repeat)]
+                best = min(runs, key=lambda run: sum(
+                    stage.get("wall_s", 0) for stage in run["stages"].values()))
+                results["scenarios"][name] = best
+                total = sum(stage.get("wall_s", 0) for stage in best["stages"].values())
+                print(f"{name:<14} {pages:>4} pages  {total:8.3f}s total", file=sys.stderr)
+        finally:
+            file_server.shutdown()
+    sampler.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        rows = compare(results, json.load(file))
+    for row in rows:
+        print(f"{row['scenario']:<14} {row['stage']:<18} {row['baseline_s']:>9.3f}s "
+              f"-> {row['current_s']:>9.3f}s  x{row['ratio']:.2f}", file=sys.stderr)
+    if args.fail_threshold is not None and any(
+            row["ratio"] > 1 + args.fail_threshold for row in rows):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
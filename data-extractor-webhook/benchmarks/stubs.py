@@ -0,0 +1,194 @@
+"""
+Local Service Stubs
+
+This module provides offline stand-ins for the external services used by the pipeline:
+- A local HTTP server that serves files from a directory, for PDF downloads
+- A local OpenAI-compatible chat completions server, answering each agent's schema
+  with deterministic content derived from the prompt
+- An in-memory Supabase client, installed in place of utils.supabase_client
+"""
+
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+import os
+import re
+import sys
+import json
+import time
+import types
+import functools
+import threading
+
+from benchmarks.synthetic_reports import PNL_ROWS
+
+GROUP_PNL_MARKER = "CONSOLIDATED STATEMENT OF PROFIT OR LOSS"
+# A page in the prompt, serialized either as a Python dict or as compact JSON
+PAGE_PATTERN = re.compile(r"['\"]page_number['\"]: ?(\d+), ?['\"]content['\"]: ?(.{0,300})")
+
+def _start_server(handler: Any) -> Tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+class _QuietFileHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args: Any) -> None:
+        pass
+
+def start_file_server(directory: str) -> Tuple[ThreadingHTTPServer, str]:
+    """Serve the files in a directory over HTTP and return (server, base_url)."""
+    return _start_server(functools.partial(_QuietFileHandler, directory=directory))
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content or [])
+    return "\n".join(parts)
+
+def _page_selection_response(prompt: str) -> Dict[str, Any]:
+    pages = [
+        int(match.group(1))
+        for match in PAGE_PATTERN.finditer(prompt)
+        if GROUP_PNL_MARKER in match.group(2)
+    ]
+    return {
+        "page_numbers": pages,
+        "status": "relevant" if pages else "not relevant",
+        "company_name": "Synthetic Holdings PLC",
+    }
+
+def _financial_report_response() -> Dict[str, Any]:
+    revenue = 10_000_000
+    return {
+        "period": "3 months ended 30 September",
+        "year": "2024",
+        "currency": "LKR '000",
+        "sections": [{
+            "title": "Statement of Profit or Loss",
+            "fields": [
+                {"label": label, "value": round(revenue * share), "bold": bold}
+                for label, bold, share in PNL_ROWS
+            ],
+        }],
+    }
+
+def make_openai_handler(latency: float = 0.0) -> type:
+    """
+    Build a request handler for a stub of the chat completions endpoint.
+
+    Args:
+        latency (float): Seconds to sleep before answering, to simulate the API
+
+    Returns:
+        type: A BaseHTTPRequestHandler subclass
+    """
+    class OpenAIStubHandler(BaseHTTPRequestHandler):
+        """Answers chat completions according to the requested JSON schema."""
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            """Handle POST /v1/chat/completions."""
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt = _prompt_text(body.get("messages", []))
+            schema = (body.get("response_format") or {}).get("json_schema", {}).get("name")
+
+            if schema == "page_numbers_status":
+                content = _page_selection_response(prompt)
+            elif schema == "financial_report":
+                content = _financial_report_response()
+            elif schema == "financial_section":
+                content = _financial_report_response()["sections"][0]
+            else:
+                content = {}
+
+            time.sleep(latency)
+            prompt_tokens = len(prompt) // 4
+            payload = json.dumps({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": json.dumps(content)},
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": 200,
+                    "total_tokens": prompt_tokens + 200,
+                },
+            }).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return OpenAIStubHandler
+
+def start_openai_stub(latency: float = 0.0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Start the chat completions stub and point the OpenAI client at it.
+
+    Returns:
+        Tuple[ThreadingHTTPServer, str]: The server and its /v1 base URL
+    """
+    server, base_url = _start_server(make_openai_handler(latency))
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub-key")
+    return server, f"{base_url}/v1"
+
+class _StubQuery:
+    """Accepts any chained Supabase query builder call."""
+
+    def __getattr__(self, name: str) -> Any:
+        return lambda *args, **kwargs: self
+
+    def execute(self) -> Any:
+        """Return an empty response."""
+        return types.SimpleNamespace(data=[])
+
+class _StubBucket:
+    def __init__(self, uploads: Dict[str, bytes]) -> None:
+        self._uploads = uploads
+
+    def upload(self, file: Any, path: str, file_options: Dict[str, str] = None) -> Any:
+        """Keep the uploaded content in memory."""
+        self._uploads[path] = file if isinstance(file, bytes) else file.read()
+        return types.SimpleNamespace(path=path)
+
+    def get_public_url(self, path: str) -> str:
+        """Return a fake public URL."""
+        return f"https://supabase.stub/storage/{path}"
+
+class StubSupabase:
+    """In-memory replacement for the Supabase client used by the pipeline."""
+
+    def __init__(self) -> None:
+        self.uploads: Dict[str, bytes] = {}
+        self.storage = types.SimpleNamespace(from_=lambda bucket: _StubBucket(self.uploads))
+
+    def table(self, name: str) -> _StubQuery:
+        """Return a query builder that accepts any call."""
+        return _StubQuery()
+
+def install_supabase_stub() -> StubSupabase:
+    """
+    Install StubSupabase as utils.supabase_client, before the pipeline is imported.
+
+    Returns:
+        StubSupabase: The installed client, exposing the uploaded files
+    """
+    client = StubSupabase()
+    module = types.ModuleType("utils.supabase_client")
+    module.get_supabase = lambda: client
+    sys.modules["utils.supabase_client"] = module
+    os.environ.setdefault("BUCKET_NAME", "stub-bucket")
+    return client
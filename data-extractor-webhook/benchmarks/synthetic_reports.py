@@ -0,0 +1,172 @@
+"""
+Synthetic CSE Report Generator
+
+This module builds CSE-style interim and annual reports with reportlab, for benchmarking
+the extraction pipeline without network access or real filings. Each report has a cover
+page, narrative pages, the other primary statements, notes with numeric tables and
+shareholder information, with the consolidated statement of profit or loss placed on a
+chosen page.
+"""
+
+from typing import Dict, List, Tuple
+import io
+import random
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+
+# (label, bold, share of revenue) rows of the consolidated statement of profit or loss
+PNL_ROWS: List[Tuple[str, bool, float]] = [
+    ("Revenue", False, 1.0),
+    ("Cost of sales", False, -0.62),
+    ("Gross profit", True, 0.38),
+    ("Other operating income", False, 0.02),
+    ("Distribution expenses", False, -0.07),
+    ("Administrative expenses", False, -0.11),
+    ("Results from operating activities", True, 0.22),
+    ("Finance income", False, 0.01),
+    ("Finance costs", False, -0.04),
+    ("Net finance costs", True, -0.03),
+    ("Share of profit of equity accounted investees (net of tax)", False, 0.02),
+    ("Profit before tax", True, 0.21),
+    ("Income tax expense", False, -0.06),
+    ("Profit for the period", True, 0.15),
+]
+
+NARRATIVE = (
+    "The Group continued to deliver resilient performance during the period despite "
+    "challenging macroeconomic conditions, with revenue growth driven by volume expansion "
+    "and improved pricing across core segments. Management remains focused on cost "
+    "discipline, working capital efficiency and prudent capital allocation."
+)
+
+def _format_amount(value: float) -> str:
+    amount = f"{abs(round(value)):,}"
+    return f"({amount})" if value < 0 else amount
+
+def _draw_lines(pdf: canvas.Canvas, lines: List[str], top: float = 780, step: float = 14) -> None:
+    y = top
+    for line in lines:
+        pdf.drawString(50, y, line)
+        y -= step
+
+def _draw_header(pdf: canvas.Canvas, company: str, title: str) -> None:
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(50, 800, company.upper())
+    pdf.drawString(50, 784, title)
+    pdf.setFont("Helvetica", 9)
+
+def _draw_pnl(pdf: canvas.Canvas, company: str, revenue: float, group: bool, period: str) -> None:
+    title = "CONSOLIDATED STATEMENT OF PROFIT OR LOSS" if group else \
+        "COMPANY STATEMENT OF PROFIT OR LOSS"
+    _draw_header(pdf, company, title)
+    pdf.drawString(300, 760, "Group" if group else "Company")
+    pdf.drawString(300, 746, f"3 months ended {period}")
+    pdf.drawString(300, 732, "2024")
+    pdf.drawString(380, 732, "2023")
+    pdf.drawString(460, 732, "Change %")
+    pdf.drawString(50, 732, "(All amounts in Sri Lankan Rupees thousands)")
+
+    y = 712
+    for label, bold, share in PNL_ROWS:
+        pdf.setFont("Helvetica-Bold" if bold else "Helvetica", 9)
+        current, previous = revenue * share, revenue * share * 0.91
+        pdf.drawString(50, y, label)
+        pdf.drawRightString(350, y, _format_amount(current))
+        pdf.drawRightString(430, y, _format_amount(previous))
+        pdf.drawRightString(510, y, f"{9.9:.1f}")
+        y -= 15
+
+    pdf.setFont("Helvetica", 9)
+    pdf.drawString(50, y - 10, "Earnings per share (Rs.)")
+    pdf.drawRightString(350, y - 10, f"{revenue * 0.15 / 1_000_000:.2f}")
+    pdf.drawRightString(430, y - 10, f"{revenue * 0.14 / 1_000_000:.2f}")
+
+def _draw_numeric_table(pdf: canvas.Canvas, company: str, title: str, rng: random.Random,
+                        rows: int = 30) -> None:
+    _draw_header(pdf, company, title)
+    y = 750
+    for index in range(rows):
+        pdf.drawString(50, y, f"Line item {index + 1}")
+        pdf.drawRightString(350, y, _format_amount(rng.uniform(-5e6, 5e7)))
+        pdf.drawRightString(430, y, _format_amount(rng.uniform(-5e6, 5e7)))
+        y -= 15
+
+def _draw_narrative(pdf: canvas.Canvas, company: str, title: str, rng: random.Random) -> None:
+    _draw_header(pdf, company, title)
+    words = NARRATIVE.split()
+    lines, line = [], []
+    for _ in range(360):
+        line.append(rng.choice(words))
+        if len(line) == 14:
+            lines.append(" ".join(line))
+            line = []
+    _draw_lines(pdf, lines, top=760)
+
+def build_report(pages: int, pnl_page: int, kind: str = "interim",
+                 company: str = "Synthetic Holdings PLC", seed: int = 0) -> bytes:
+    """
+    Build a synthetic CSE-style report.
+
+    Args:
+        pages (int): Total number of pages (at least 4)
+        pnl_page (int): 1-based page holding the consolidated statement of profit or loss
+        kind (str): 'interim' or 'annual'; annual reports are mostly narrative and notes
+        company (str): Company name printed on every page
+        seed (int): Seed for the generated numbers and text
+
+    Returns:
+        bytes: The PDF content
+    """
+    if pages < 4 or not 2 <= pnl_page < pages:
+        raise ValueError("Reports need at least 4 pages and the P&L between the first and last")
+
+    rng = random.Random(seed)
+    revenue = rng.uniform(1e6, 5e7)
+    period = "30 September 2024"
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+
+    # Fixed pages: statements right after the consolidated P&L, shareholders at the end
+    layout: Dict[int, str] = {1: "cover", pnl_page: "group_pnl", pages: "shareholders"}
+    for offset, page_type in enumerate(("company_pnl", "financial_position", "cash_flow"), 1):
+        if pnl_page + offset < pages:
+            layout.setdefault(pnl_page + offset, page_type)
+
+    for page_number in range(1, pages + 1):
+        page_type = layout.get(page_number)
+        if page_type is None:
+            narrative_share = 0.7 if kind == "annual" else 0.3
+            page_type = "narrative" if rng.random() < narrative_share else "notes"
+
+        if page_type == "cover":
+            pdf.setFont("Helvetica-Bold", 20)
+            pdf.drawString(50, 700, company)
+            title = "Annual Report 2023/24" if kind == "annual" else \
+                f"Interim Financial Statements for the period ended {period}"
+            pdf.setFont("Helvetica", 12)
+            pdf.drawString(50, 670, title)
+        elif page_type == "group_pnl":
+            _draw_pnl(pdf, company, revenue, True, period)
+        elif page_type == "company_pnl":
+            _draw_pnl(pdf, company, revenue * 0.6, False, period)
+        elif page_type == "financial_position":
+            _draw_numeric_table(pdf, company, "STATEMENT OF FINANCIAL POSITION", rng)
+        elif page_type == "cash_flow":
+            _draw_numeric_table(pdf, company, "STATEMENT OF CASH FLOWS", rng)
+        elif page_type == "shareholders":
+            _draw_numeric_table(pdf, company, "SHAREHOLDER INFORMATION - TWENTY LARGEST SHAREHOLDERS",
+                                rng, rows=20)
+        elif page_type == "notes":
+            _draw_numeric_table(pdf, company, "NOTES TO THE FINANCIAL STATEMENTS", rng)
+        else:
+            _draw_narrative(pdf, company, "CHAIRMAN'S REVIEW", rng)
+
+        pdf.setFont("Helvetica", 8)
+        pdf.drawCentredString(PAGE_WIDTH / 2, 30, str(page_number))
+        pdf.showPage()
+
+    pdf.save()
+    return buffer.getvalue()
@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration for the webhook server.
+The app is imported once in the master process and its heavy dependencies are preloaded
+there, so forked workers share them and a new or replaced worker starts in a fork rather
+than a full import. Set GUNICORN_PRELOAD=false to import the app in every worker instead,
+e.g. to pick up code changes with a graceful reload.
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Preload the heavy dependencies in the master, before any worker is forked."""
+    if preload_app:
+        # pylint: disable=import-outside-toplevel
+        from utils.startup import preload_heavy_modules
+        preload_heavy_modules()
+
+def post_worker_init(worker):  # pylint: disable=unused-argument
+    """Take over the queued and running jobs of workers that died, e.g. before a restart."""
+    # pylint: disable=import-outside-toplevel
+    from webhook_listner import recover_jobs
+    recover_jobs()
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drop the live gauges of a worker that exited from the multiprocess metrics."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,697 @@
+"""
+Report pipeline for turning a CSE report into a PnL statement.
+This module runs the processing stages for a single record (download, text extraction,
+page selection, local extraction, image extraction, data extraction, validation and
+report generation) and reports the progress of each stage, so it can be driven by the
+webhook or by background workers. Image and data extraction only run when the local
+extractor is not confident about the statement it read from the page text, and
+validation reads the sections that do not add up again before the report is generated.
+Stage outputs are stored in the artifact cache under the SHA-256 of the PDF, so a filing
+that is processed again reuses the work already done for it. When a job store is given,
+they are also checkpointed per record, so a retry after a failure or a restart resumes at
+the first incomplete stage.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.pdf_document import PDFDocument, fetch_pdf_document
+from utils.artifact_cache import artifact_cache
+from utils.extract_pdf_text_from_url import EXTRACTOR_VERSION, extract_pdf_text_from_url
+from utils.page_ranker import (
+    PREFILTER_ENABLED, PREFILTER_MIN_SCORE, PREFILTER_NEIGHBOURS, PREFILTER_TOP_K,
+    SCAN_LOOKAHEAD, prefilter_pdf_text, rank_pages
+)
+from utils.extract_page_images_from_pdf import (
+    CROP_TO_TABLE, RENDER_VERSION, VISION_MAX_SIDE_PX, VISION_SHORT_SIDE_PX,
+    PDFProcessingError, extract_page_images_with_stats
+)
+from utils.job_queue import JOB_CHECKPOINTS_ENABLED, JobStore
+from utils.layout_memory import LAYOUT_MEMORY_ENABLED, get_layout_memory
+from utils.page_index import PAGE_INDEX_ENABLED, get_page_index
+from utils.pnl_history import PNL_HISTORY_ENABLED, get_pnl_history
+from utils.resource_governor import AdmissionTimeout
+from utils.local_pnl_extractor import (
+    LOCAL_EXTRACTION_ENABLED, LOCAL_EXTRACTION_MIN_CONFIDENCE, LOCAL_EXTRACTOR_VERSION,
+    extract_pnl_locally
+)
+from utils.pnl_validator import (
+    PNL_VALIDATION_ENABLED, PNL_VALIDATION_MAX_REQUERIES, VALIDATOR_VERSION, failed_checks,
+    replace_section_fields, validate_pnl
+)
+from utils.create_pnl_pdf_report import REPORT_VERSION, create_pnl_pdf_report
+from utils.single_flight import single_flight
+from utils.token_count import count_tokens
+from utils.metrics import (
+    JOBS_IN_FLIGHT, JOBS_TOTAL, LAYOUT_PREDICTIONS, LOCAL_EXTRACTIONS,
+    PAGES_SCANNED, SPECULATIVE_PAGES, STAGE_CACHE_HITS, STAGE_DURATION, STAGE_FAILURES,
+    STAGE_RESUMES, VALIDATIONS, WORKER_MEMORY, current_rss, record_agent_call, record_images
+)
+# pylint: disable=import-error
+from utils.supabase_client import get_supabase
+
+from agents.runtime import runtime
+from agents.extract_consolidated_income_statement import (
+    PAGE_SELECTION_TOKEN_BUDGET, PROMPT_VERSION as PAGE_SELECTION_PROMPT_VERSION,
+    extract_consolidated_income_statement, extract_consolidated_income_statement_budgeted
+)
+from agents.pnl_data_extractor import (
+    PROMPT_VERSION as DATA_EXTRACTION_PROMPT_VERSION, pnl_data_extractor
+)
+from agents.pnl_section_extractor import (
+    PROMPT_VERSION as SECTION_PROMPT_VERSION, pnl_section_extractor
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    "download",
+    "text_extraction",
+    "layout_prediction",
+    "page_ranking",
+    "page_selection",
+    "local_extraction",
+    "image_extraction",
+    "data_extraction",
+    "validation",
+    "report_generation",
+    "page_indexing",
+    "history_recording",
+)
+
+
+class AgentError(ConnectionError):
+    """Raised when an agent call fails permanently or runs out of retries."""
+
+
+# Errors that mark a record as failed instead of crashing the caller
+PIPELINE_ERRORS = (json.JSONDecodeError, ValueError, IOError, ConnectionError, AgentError)
+
+StageCallback = Callable[[str, str], None]
+
+# 'full' extracts every page, 'early_stop' stops once the income statement has been found
+TEXT_SCAN_MODE = os.getenv("TEXT_SCAN_MODE", "full")
+
+# 'single' sends the pages in one prompt, 'budgeted' always uses token-budgeted chunks,
+# 'auto' uses chunks only when the pages exceed PAGE_SELECTION_TOKEN_BUDGET
+PAGE_SELECTION_MODE = os.getenv("PAGE_SELECTION_MODE", "auto")
+
+# Best-ranked pages rendered while the page-selection agent runs, unless the local extractor
+# reads them confidently; 0 renders afterwards only
+SPECULATIVE_RENDER_PAGES = int(os.getenv("SPECULATIVE_RENDER_PAGES", "2"))
+
+runtime.add_usage_listener(record_agent_call)
+
+def _locally_accepted(result: Dict[str, Any]) -> bool:
+    """Return whether a local extraction is confident enough to skip the vision agent."""
+    return result["data"] is not None and result["confidence"] >= LOCAL_EXTRACTION_MIN_CONFIDENCE
+
+def update_record_status(record_id: str, status: str, pl_report_url: str = None) -> None:
+    """
+    Update the status and PL report URL in the database.
+
+    Args:
+        record_id (str): The record identifier
+        status (str): Status to update ('success' or 'error')
+        pl_report_url (str, optional): URL of the generated PL report
+    """
+    try:
+        update_data = {'status': status}
+        if pl_report_url:
+            update_data['pl_report'] = pl_report_url
+
+        get_supabase().table('table').update(update_data).eq('id', record_id).execute()
+    except (ValueError, TypeError, ConnectionError) as e:
+        logger.error("Failed to update record status: %s", e)
+
+class ReportPipeline:
+    """
+    Runs the stages for one CSE report and reports the progress of each stage.
+
+    Stage states passed to the callback are 'running', 'done', 'failed', 'cached' when
+    the output was taken from the artifact cache, and 'resumed' when it was taken from
+    the record's checkpoint in `checkpoints`.
+
+    Pipelines running side by side can share semaphores in `stage_limits`, keyed by stage
+    name, to bound how many of them run a stage at the same time.
+    """
+
+    def __init__(self, record_id: str, cse_report_url: str,
+                 on_stage: Optional[StageCallback] = None,
+                 stage_limits: Optional[Dict[str, threading.Semaphore]] = None,
+                 checkpoints: Optional[JobStore] = None) -> None:
+        self.record_id = record_id
+        self.cse_report_url = cse_report_url
+        self.on_stage = on_stage
+        self.stage_limits = stage_limits or {}
+        self.checkpoints = checkpoints if JOB_CHECKPOINTS_ENABLED else None
+        self.document: Optional[PDFDocument] = None
+        self.prefilter_stats: Optional[Dict[str, Any]] = None
+        self.selection_stats: Optional[Dict[str, Any]] = None
+        self.image_stats: Dict[int, Dict[str, Any]] = {}
+        self.extraction_stats: Optional[Dict[str, Any]] = None
+        self.validation: Optional[Dict[str, Any]] = None
+        self._speculative_pages: List[int] = []
+        self._speculative_render: Optional[Future] = None
+        # Local extractions of single pages made while deciding what to render ahead
+        self._local_probes: Dict[int, Dict[str, Any]] = {}
+
+    def _notify(self, stage: str, state: str) -> None:
+        if self.on_stage:
+            self.on_stage(stage, state)
+
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        """Report the start and outcome of a pipeline stage to the callback and metrics."""
+        with self.stage_limits.get(name) or nullcontext():
+            self._notify(name, "running")
+            started = time.perf_counter()
+            try:
+                yield
+            except Exception:
+                STAGE_FAILURES.labels(name).inc()
+                self._notify(name, "failed")
+                raise
+            finally:
+                STAGE_DURATION.labels(name).observe(time.perf_counter() - started)
+                WORKER_MEMORY.set(current_rss())
+            self._notify(name, "done")
+
+    def _cached_stage(self, name: str, version: str, params: Optional[Dict[str, Any]],
+                      compute: Callable[[], Any],
+                      cacheable: Callable[[Any], bool] = lambda value: True) -> Any:
+        """Return a stage output from the record's checkpoint or the cache, or compute it."""
+        input_key = hashlib.sha256(
+            json.dumps([self.document.sha256, version, params], sort_keys=True,
+                       default=str).encode('utf-8')
+        ).hexdigest()
+        resumed = self._load_checkpoint(name, input_key)
+        if resumed is not None:
+            STAGE_RESUMES.labels(name).inc()
+            self._notify(name, "resumed")
+            return resumed
+
+        cached = artifact_cache.get(self.document.sha256, name, version, params)
+        if cached is not None:
+            STAGE_CACHE_HITS.labels(name).inc()
+            self._notify(name, "cached")
+            return cached
+
+        with self._stage(name):
+            value = compute()
+        if cacheable(value):
+            artifact_cache.put(self.document.sha256, name, version, value, params)
+            self._save_checkpoint(name, input_key, value)
+        return value
+
+    def _load_checkpoint(self, stage: str, input_key: str) -> Optional[Any]:
+        if self.checkpoints is None:
+            return None
+        try:
+            return self.checkpoints.load_checkpoint(self.record_id, stage, input_key)
+        except sqlite3.Error as e:
+            logger.warning("Failed to read the %s checkpoint of record %s: %s",
+                           stage, self.record_id, e)
+            return None
+
+    def _save_checkpoint(self, stage: str, input_key: str, value: Any) -> None:
+        if self.checkpoints is None:
+            return
+        try:
+            self.checkpoints.save_checkpoint(self.record_id, stage, input_key, value)
+        except sqlite3.Error as e:
+            logger.warning("Failed to checkpoint %s for record %s: %s",
+                           stage, self.record_id, e)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run every stage and update the record with the outcome.
+
+        Returns:
+            Dict[str, Any]: The outcome with a "status" of 'success' or 'not_relevant',
+                the page prefilter statistics under "prefilter", plus "pl_report_url",
+                "company_name", how the pages were selected under "page_selection",
+                the byte sizes of the rendered pages under "images",
+                the extraction method and confidence under "extraction" and the
+                arithmetic validation verdict under "validation" on success
+
+        Raises:
+            Any error raised by a stage; PIPELINE_ERRORS are the expected failure modes,
+            and failed agent calls are raised as AgentError.
+        """
+        with JOBS_IN_FLIGHT.track_inprogress():
+            try:
+                result = self._run()
+            except Exception as e:
+                JOBS_TOTAL.labels("error").inc()
+                # openai is only imported by the first agent call, see agents/runtime.py
+                import openai  # pylint: disable=import-outside-toplevel
+                if isinstance(e, openai.OpenAIError):
+                    raise AgentError(f"Agent call failed: {e}") from e
+                raise
+        JOBS_TOTAL.labels(result["status"]).inc()
+
+        # Checkpoints are only kept for records that may be retried
+        if self.checkpoints is not None:
+            try:
+                self.checkpoints.clear_checkpoints(self.record_id)
+            except sqlite3.Error as e:
+                logger.warning("Failed to clear the checkpoints of record %s: %s",
+                               self.record_id, e)
+        return result
+
+    def _run(self) -> Dict[str, Any]:
+        logger.info("Processing CSE report for record ID: %s", self.record_id)
+
+        # Downloads of one URL are serialized, so that its content hash is resolved once
+        with single_flight.lock(f"url:{self.cse_report_url}"):
+            # Download the report once and share it between the text and image stages
+            with self._stage("download"):
+                self.document = fetch_pdf_document(self.cse_report_url)
+
+        # Duplicates of a report (same URL, or same content under another URL) wait here
+        # for the first one; the artifact cache then serves all of their stages
+        with self.document, single_flight.lock(f"pdf:{self.document.sha256}"), \
+                self._speculation_scope():
+            pdf_text_result = self._extract_text()
+            relevant_pages = self._select_pages(pdf_text_result)
+
+            if not relevant_pages or relevant_pages.get("status") != "relevant":
+                logger.info("No relevant pages found for record ID: %s", self.record_id)
+                self._index_pages(pdf_text_result)
+                update_record_status(self.record_id, 'error')
+                return {"status": "not_relevant", "prefilter": self.prefilter_stats}
+
+            page_numbers = relevant_pages.get("page_numbers")
+            company_name = relevant_pages.get("company_name")
+
+            # The vision agent only reads statements the local extractor is unsure of
+            final_data = local_data = self._extract_locally(page_numbers)
+            if final_data is None:
+                consolidate_statement_snapshots = self._extract_images(page_numbers)
+                final_data = self._extract_data(
+                    pdf_text_result, page_numbers, consolidate_statement_snapshots
+                )
+            final_data = self._validate(final_data, pdf_text_result, page_numbers)
+            uploaded_url = self._generate_report(final_data, company_name)
+            self._remember_layout(pdf_text_result, page_numbers, company_name, final_data)
+            self._index_pages(pdf_text_result, company_name, final_data)
+            self._record_history(company_name, final_data)
+
+        # Update record with success status
+        update_record_status(self.record_id, 'success', uploaded_url)
+
+        return {
+            "status": "success",
+            "pl_report_url": uploaded_url,
+            "company_name": company_name,
+            "prefilter": self.prefilter_stats,
+            "page_selection": self.selection_stats,
+            # Pages rendered speculatively for a local extraction were never sent
+            "images": [self.image_stats[page] for page in page_numbers
+                       if page in self.image_stats and local_data is None],
+            "extraction": self.extraction_stats,
+            "validation": self.validation
+        }
+
+    def _extract_text(self) -> Dict[str, Any]:
+        """Extract PDF text, optionally stopping once the income statement is found."""
+        stop_after_statement = TEXT_SCAN_MODE == "early_stop"
+        params = {"lookahead": SCAN_LOOKAHEAD} if stop_after_statement else None
+
+        def extract() -> Dict[str, Any]:
+            result = extract_pdf_text_from_url(
+                self.document, stop_after_statement=stop_after_statement
+            )
+            PAGES_SCANNED.inc(len(result.get("data") or []))
+            return result
+
+        return self._cached_stage(
+            "text_extraction", EXTRACTOR_VERSION, params, extract,
+            cacheable=lambda result: result.get("success", False)
+        )
+
+    def _select_pages(self, pdf_text_result: Dict[str, Any]) -> Dict[str, Any]:
+        """Process consolidated income statement on the locally ranked candidate pages."""
+        # Repeat filers keep their layout; the agent is only asked when it does not verify
+        predicted = self._predict_pages(pdf_text_result)
+        if predicted is not None:
+            return predicted
+        self.selection_stats = {"method": "agent"}
+
+        params = {
+            "prefilter": PREFILTER_ENABLED,
+            "top_k": PREFILTER_TOP_K,
+            "min_score": PREFILTER_MIN_SCORE,
+            "neighbours": PREFILTER_NEIGHBOURS,
+            "mode": PAGE_SELECTION_MODE,
+            "token_budget": PAGE_SELECTION_TOKEN_BUDGET,
+        }
+
+        candidate_pages = pdf_text_result
+        if PREFILTER_ENABLED:
+            # Rank pages locally so only likely statement pages reach the agent
+            with self._stage("page_ranking"):
+                candidate_pages, self.prefilter_stats = prefilter_pdf_text(pdf_text_result)
+
+        def select() -> Dict[str, Any]:
+            # Render the likeliest pages while waiting for the agent
+            self._start_speculative_render(candidate_pages)
+            budgeted = PAGE_SELECTION_MODE == "budgeted" or (
+                PAGE_SELECTION_MODE == "auto"
+                and count_tokens(str(candidate_pages)) > PAGE_SELECTION_TOKEN_BUDGET
+            )
+            if budgeted:
+                return json.loads(extract_consolidated_income_statement_budgeted(candidate_pages))
+            return json.loads(extract_consolidated_income_statement(candidate_pages))
+
+        # Only relevant selections are cached so that a retry can still succeed
+        return self._cached_stage(
+            "page_selection", PAGE_SELECTION_PROMPT_VERSION, params, select,
+            cacheable=lambda result: result.get("status") == "relevant"
+        )
+
+    def _predict_pages(self, pdf_text_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the statement pages predicted from the company's remembered layout."""
+        if not LAYOUT_MEMORY_ENABLED or not pdf_text_result.get("data"):
+            return None
+        with self._stage("layout_prediction"):
+            try:
+                predicted = get_layout_memory().predict(
+                    pdf_text_result["data"], scanned_to_end=TEXT_SCAN_MODE == "full"
+                )
+            except sqlite3.Error as e:
+                logger.warning("Failed to read remembered layouts: %s", e)
+                predicted = None
+
+        LAYOUT_PREDICTIONS.labels("hit" if predicted else "miss").inc()
+        if predicted is None:
+            return None
+        logger.info("Selected pages %s from the remembered layout of %s",
+                    predicted["page_numbers"], predicted["company_name"])
+        self.selection_stats = {"method": "layout", "score": predicted["score"]}
+        return predicted
+
+    def _index_pages(self, pdf_text_result: Dict[str, Any], company_name: Optional[str] = None,
+                     final_data: Optional[Dict[str, Any]] = None) -> None:
+        """Add the extracted pages to the full-text page index."""
+        if not PAGE_INDEX_ENABLED or not pdf_text_result.get("data"):
+            return
+        final_data = final_data or {}
+        try:
+            with self._stage("page_indexing"):
+                get_page_index().index_report(
+                    self.record_id, pdf_text_result["data"], company_name=company_name,
+                    period=final_data.get("period"), year=final_data.get("year"),
+                    pdf_sha256=self.document.sha256, cse_report_url=self.cse_report_url
+                )
+        except sqlite3.Error as e:
+            # Search is a convenience; the report itself was produced
+            logger.warning("Failed to index the pages of record %s: %s", self.record_id, e)
+
+    def _record_history(self, company_name: str, final_data: Dict[str, Any]) -> None:
+        """Add the extracted line items to the P&L history, if the data adds up."""
+        if not PNL_HISTORY_ENABLED or (self.validation and not self.validation["valid"]):
+            return
+        try:
+            with self._stage("history_recording"):
+                get_pnl_history().record(self.record_id, company_name, final_data)
+        except sqlite3.Error as e:
+            # The history is a convenience; the report itself was produced
+            logger.warning("Failed to record the history of record %s: %s", self.record_id, e)
+
+    def _remember_layout(self, pdf_text_result: Dict[str, Any], page_numbers: List[int],
+                         company_name: str, final_data: Dict[str, Any]) -> None:
+        """Learn the statement layout from a run whose data adds up."""
+        if not LAYOUT_MEMORY_ENABLED or (self.validation and not self.validation["valid"]):
+            return
+        try:
+            get_layout_memory().remember(
+                company_name, pdf_text_result.get("data") or [], page_numbers, final_data,
+                scanned_to_end=TEXT_SCAN_MODE == "full"
+            )
+        except sqlite3.Error as e:
+            logger.warning("Failed to remember the layout of %s: %s", company_name, e)
+
+    def _start_speculative_render(self, candidate_pages: Dict[str, Any]) -> None:
+        """Start rendering the best-ranked candidate pages in the background."""
+        if SPECULATIVE_RENDER_PAGES <= 0 or self._speculative_render is not None:
+            return
+        ranking = rank_pages(candidate_pages.get("data") or [])
+        self._speculative_pages = [
+            page_number for page_number, score in ranking[:SPECULATIVE_RENDER_PAGES]
+            if score >= PREFILTER_MIN_SCORE / 2
+        ]
+        if not self._speculative_pages:
+            return
+
+        logger.info("Speculatively rendering pages %s", self._speculative_pages)
+        pages = list(self._speculative_pages)
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative-render")
+        self._speculative_render = executor.submit(self._speculate, pages)
+        executor.shutdown(wait=False)
+
+    def _speculate(self, page_numbers: List[int]) -> Dict[int, str]:
+        """Render the pages the local extractor cannot read confidently on its own."""
+        if LOCAL_EXTRACTION_ENABLED:
+            for page in page_numbers:
+                self._local_probes[page] = extract_pnl_locally(self.document, [page], 0)
+            # Pages the local extractor reads would only be rendered to be thrown away
+            page_numbers = [page for page in page_numbers
+                            if not _locally_accepted(self._local_probes[page])]
+            if not page_numbers:
+                logger.info("Skipped speculative rendering: the pages read locally")
+                return {}
+        # Speculation only uses memory that is free right now, and never queues for it
+        return self._render_pages(page_numbers, 0)
+
+    def _take_speculative_render(self) -> Dict[int, str]:
+        """Return the speculatively rendered images by page, waiting for them if needed."""
+        future, self._speculative_render = self._speculative_render, None
+        if future is None:
+            return {}
+        try:
+            return future.result()
+        except AdmissionTimeout:
+            logger.info("Skipped speculative rendering: the memory budget is in use")
+            return {}
+        except Exception as e:  # pylint: disable=broad-except
+            # Speculation is only an optimization; the pages are rendered again if needed
+            logger.warning("Speculative rendering failed: %s", e)
+            return {}
+
+    @contextmanager
+    def _speculation_scope(self) -> Iterator[None]:
+        """Wait for unused speculative rendering before the document is closed."""
+        try:
+            yield
+        finally:
+            unused = self._take_speculative_render()
+            SPECULATIVE_PAGES.labels("wasted").inc(len(unused))
+
+    def _render_pages(self, page_numbers: List[int],
+                      admission_timeout: Optional[float] = None) -> Dict[int, str]:
+        """Render pages and return their base64 images by page number."""
+        images, stats = extract_page_images_with_stats(
+            self.document, page_numbers, admission_timeout=admission_timeout
+        )
+        record_images(images)
+        self.image_stats.update((page["page"], page) for page in stats)
+        return dict(zip(page_numbers, images))
+
+    def _extract_images(self, page_numbers: List[int]) -> List[str]:
+        """Extract images from relevant pages."""
+        params = {
+            "pages": page_numbers,
+            "short_side_px": VISION_SHORT_SIDE_PX,
+            "max_side_px": VISION_MAX_SIDE_PX,
+            "crop_to_table": CROP_TO_TABLE,
+        }
+
+        def render() -> List[str]:
+            # Pages the speculation did not cover are rendered now, alongside it
+            images: Dict[int, str] = {}
+            missing = [page for page in dict.fromkeys(page_numbers)
+                       if page not in self._speculative_pages]
+            if missing:
+                images.update(self._render_pages(missing))
+
+            speculative = self._take_speculative_render()
+            used = {page: image for page, image in speculative.items() if page in page_numbers}
+            SPECULATIVE_PAGES.labels("used").inc(len(used))
+            SPECULATIVE_PAGES.labels("wasted").inc(len(speculative) - len(used))
+            images.update(used)
+            if speculative:
+                logger.info("Reused %d speculatively rendered page(s) of %d",
+                            len(used), len(speculative))
+
+            # Speculative pages that failed to render
+            unrendered = [page for page in dict.fromkeys(page_numbers) if page not in images]
+            if unrendered:
+                images.update(self._render_pages(unrendered))
+            return [images[page] for page in page_numbers]
+
+        return self._cached_stage("image_extraction", RENDER_VERSION, params, render)
+
+    def _extract_locally(self, page_numbers: List[int]) -> Optional[Dict[str, Any]]:
+        """Read the P&L from the page text, or return None to fall back to the agent."""
+        if not LOCAL_EXTRACTION_ENABLED:
+            self.extraction_stats = {"method": "vision", "confidence": None}
+            return None
+
+        def extract() -> Dict[str, Any]:
+            # A single page was usually read already while deciding what to render ahead
+            if len(page_numbers) == 1 and page_numbers[0] in self._local_probes:
+                return self._local_probes[page_numbers[0]]
+            return extract_pnl_locally(self.document, page_numbers)
+
+        result = self._cached_stage(
+            "local_extraction", LOCAL_EXTRACTOR_VERSION, {"pages": page_numbers}, extract
+        )
+        accepted = _locally_accepted(result)
+        LOCAL_EXTRACTIONS.labels("accepted" if accepted else "fallback").inc()
+        self.extraction_stats = {
+            "method": "local" if accepted else "vision",
+            "confidence": result["confidence"],
+            "checks": result["checks"],
+        }
+        if not accepted:
+            logger.info("Local extraction confidence %.2f is below %.2f, using the vision agent",
+                        result["confidence"], LOCAL_EXTRACTION_MIN_CONFIDENCE)
+            return None
+        return result["data"]
+
+    def _extract_data(self, pdf_text_result: Dict[str, Any], page_numbers: List[int],
+                      consolidate_statement_snapshots: List[str]) -> Dict[str, Any]:
+        """Extract the structured P&L data from the statement images and text."""
+        # Extract relevant content
+        extracted_content = [
+            item["content"] for item in pdf_text_result['data']
+            if item["page_number"] in page_numbers
+        ]
+        return self._cached_stage(
+            "data_extraction", DATA_EXTRACTION_PROMPT_VERSION, {"pages": page_numbers},
+            lambda: json.loads(pnl_data_extractor(
+                consolidate_statement_snapshots,
+                extracted_content
+            ))
+        )
+
+    def _validate(self, final_data: Dict[str, Any], pdf_text_result: Dict[str, Any],
+                  page_numbers: List[int]) -> Dict[str, Any]:
+        """Check the P&L arithmetic and read the sections that do not add up again."""
+        if not PNL_VALIDATION_ENABLED:
+            return final_data
+
+        def validate() -> Dict[str, Any]:
+            data = final_data
+            verdict = validate_pnl(data)
+            requeried = []
+            for title in verdict["failed_sections"][:PNL_VALIDATION_MAX_REQUERIES]:
+                fields = self._requery_section(data, title, verdict, pdf_text_result, page_numbers)
+                candidate = replace_section_fields(data, title, fields) if fields else None
+                candidate_verdict = validate_pnl(candidate) if candidate else None
+                # Keep the new reading only if it removes failures
+                accepted = candidate_verdict is not None and \
+                    len(failed_checks(candidate_verdict)) < len(failed_checks(verdict))
+                requeried.append({"section": title, "accepted": accepted})
+                if accepted:
+                    data, verdict = candidate, candidate_verdict
+            return {"data": data, "verdict": {**verdict, "requeried": requeried}}
+
+        result = self._cached_stage(
+            "validation", f"{VALIDATOR_VERSION}.{SECTION_PROMPT_VERSION}",
+            {"pages": page_numbers, "data": final_data}, validate
+        )
+        self.validation = result["verdict"]
+        if not self.validation["valid"]:
+            outcome = "invalid"
+            logger.warning("P&L of record ID %s does not add up in sections %s",
+                           self.record_id, self.validation["failed_sections"])
+        else:
+            outcome = "corrected" if self.validation["requeried"] else "valid"
+        VALIDATIONS.labels(outcome).inc()
+        return result["data"]
+
+    def _requery_section(self, data: Dict[str, Any], title: str, verdict: Dict[str, Any],
+                         pdf_text_result: Dict[str, Any],
+                         page_numbers: List[int]) -> Optional[List[Dict[str, Any]]]:
+        """Read one section again from a crop of its page, returning its new fields."""
+        section = next(
+            (section for section in data["sections"] if section.get("title") == title), None
+        )
+        if section is None:
+            logger.warning("Section %r of record ID %s is missing, not reading it again",
+                           title, self.record_id)
+            return None
+        labels = [str(field.get("label", "")) for field in section.get("fields") or []]
+        page_texts = {
+            item["page_number"]: item["content"] for item in pdf_text_result["data"]
+            if item["page_number"] in page_numbers
+        }
+        # The selected page on which most of the section's labels appear
+        page = max(page_numbers, key=lambda number: sum(
+            1 for label in labels if label and label.lower() in page_texts.get(number, "").lower()
+        ))
+
+        try:
+            images, _ = extract_page_images_with_stats(
+                self.document, [page], section_labels=labels
+            )
+            record_images(images)
+        except (PDFProcessingError, AdmissionTimeout) as e:
+            # The text alone still lets the agent correct most misread figures
+            logger.warning("Failed to render page %d for section %s: %s", page, title, e)
+            images = []
+
+        logger.info("Reading section %r of record ID %s again from page %d",
+                    title, self.record_id, page)
+        response = json.loads(pnl_section_extractor(
+            images, page_texts.get(page, ""), section,
+            f"{data.get('period', '')} {data.get('year', '')}".strip(),
+            failed_checks(verdict, title) or failed_checks(verdict)
+        ))
+        fields = response.get("fields")
+        if not isinstance(fields, list) or not fields:
+            return None
+        return fields
+
+    def _generate_report(self, final_data: Dict[str, Any], company_name: str) -> str:
+        """Generate the final report in memory and upload it."""
+        return self._cached_stage(
+            "report_generation", REPORT_VERSION,
+            {"data": final_data, "company_name": company_name},
+            lambda: create_pnl_pdf_report(final_data, company_name=company_name)
+        )
+
+def run_report_pipeline(
+    record_id: str,
+    cse_report_url: str,
+    on_stage: Optional[StageCallback] = None,
+    checkpoints: Optional[JobStore] = None
+) -> Dict[str, Any]:
+    """
+    Run every stage for a CSE report and update the record with the outcome.
+
+    Args:
+        record_id (str): The record identifier
+        cse_report_url (str): URL of the uploaded CSE report
+        on_stage (Optional[StageCallback]): Called with (stage, state) where state is
+            'running', 'done', 'failed', 'cached' or 'resumed'
+        checkpoints (Optional[JobStore]): Store of per-stage checkpoints to resume from
+            and write to
+
+    Returns:
+        Dict[str, Any]: See ReportPipeline.run
+    """
+    return ReportPipeline(record_id, cse_report_url, on_stage, checkpoints=checkpoints).run()
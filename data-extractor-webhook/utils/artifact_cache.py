@@ -0,0 +1,190 @@
+"""
+Artifact Cache Module
+This module provides a content-addressed, on-disk cache for the outputs of every pipeline
+stage. Entries are keyed by the SHA-256 of the PDF bytes, the stage name, the stage's
+prompt/schema version and any stage parameters, so a filing that is uploaded again skips
+the work already done for it.
+The cache is bounded in size: when it grows beyond its limit the least recently used
+entries are evicted. The total size is kept in a file in the cache directory, guarded by
+an fcntl lock, so the limit holds for every gunicorn worker sharing the cache. Hit and miss
+counters are kept per stage.
+Example:
+    cached = artifact_cache.get(pdf_sha256, "text_extraction", "1")
+    if cached is None:
+        cached = extract_pdf_text_from_url(document)
+        artifact_cache.put(pdf_sha256, "text_extraction", "1", cached)
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, Optional
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ARTIFACT_CACHE_ENABLED = os.getenv("ARTIFACT_CACHE_ENABLED", "true").lower() == "true"
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", ".artifact-cache")
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+# Eviction frees space down to this fraction of the limit so it does not run on every write
+EVICTION_LOW_WATER = 0.9
+# Holds the total size of the entries, shared by every process using the cache
+SIZE_FILE_NAME = "size"
+
+class ArtifactCache:
+    """
+    Size-bounded LRU cache of JSON-serializable stage outputs on local disk.
+
+    Entries live at <cache_dir>/<sha[:2]>/<sha>/<stage>-<digest>.json, where the digest
+    covers the stage version and parameters. Reads refresh the entry's modification time,
+    which is what eviction orders by, so the store can be shared between processes.
+    """
+
+    def __init__(self, cache_dir: str = ARTIFACT_CACHE_DIR,
+                 max_bytes: int = ARTIFACT_CACHE_MAX_BYTES,
+                 enabled: bool = ARTIFACT_CACHE_ENABLED) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._hits: Dict[str, int] = defaultdict(int)
+        self._misses: Dict[str, int] = defaultdict(int)
+        self._size_path = os.path.join(cache_dir, SIZE_FILE_NAME)
+
+    def _entry_path(self, pdf_sha256: str, stage: str, version: str,
+                    params: Optional[Dict[str, Any]]) -> str:
+        digest = hashlib.sha256(
+            json.dumps([version, params], sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()[:16]
+        return os.path.join(self.cache_dir, pdf_sha256[:2], pdf_sha256, f"{stage}-{digest}.json")
+
+    def get(self, pdf_sha256: str, stage: str, version: str,
+            params: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """
+        Return a cached stage output, or None on a miss.
+
+        Args:
+            pdf_sha256 (str): SHA-256 of the PDF bytes
+            stage (str): Pipeline stage name
+            version (str): Prompt/schema version of the stage
+            params (Optional[Dict[str, Any]]): Parameters the output depends on
+
+        Returns:
+            Optional[Any]: The cached value, or None
+        """
+        if not self.enabled:
+            return None
+        path = self._entry_path(pdf_sha256, stage, version, params)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                value = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self._misses[stage] += 1
+            return None
+
+        with self._lock:
+            self._hits[stage] += 1
+        logger.info("Artifact cache hit for %s (%s)", stage, pdf_sha256[:12])
+        return value
+
+    def put(self, pdf_sha256: str, stage: str, version: str, value: Any,
+            params: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Store a stage output, evicting least recently used entries when over the limit.
+
+        The entry is written to a temporary file and renamed into place, so concurrent
+        readers never observe a partial entry.
+        """
+        if not self.enabled:
+            return
+        path = self._entry_path(pdf_sha256, stage, version, params)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(handle, 'w', encoding='utf-8') as file:
+                json.dump(value, file)
+            size = os.path.getsize(tmp_path)
+            # An entry that is written again replaces the old file and its size
+            replaced_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Failed to write artifact cache entry for %s: %s", stage, e)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        try:
+            self._add_size(size - replaced_size)
+        except OSError as e:
+            logger.warning("Failed to update the artifact cache size: %s", e)
+
+    def _add_size(self, delta: int) -> None:
+        """
+        Add delta to the shared total size under the cross-process lock, measuring the
+        cache and evicting entries when the total is unknown or over the limit.
+        """
+        handle = os.open(self._size_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            content = os.read(handle, 32).decode('ascii').strip()
+            size = int(content) + delta if content.isdigit() else None
+            if size is None or size > self.max_bytes:
+                size = self._evict()
+            os.lseek(handle, 0, os.SEEK_SET)
+            os.ftruncate(handle, 0)
+            os.write(handle, str(max(size, 0)).encode('ascii'))
+        finally:
+            os.close(handle)
+
+    def _evict(self) -> int:
+        """
+        Measure the cache and, when it is over its limit, remove least recently used
+        entries until it is back under its low-water mark. Returns the size left.
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if path == self._size_path:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * EVICTION_LOW_WATER) if total > self.max_bytes else total
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit and miss counters, in total and per stage, for this process."""
+        with self._lock:
+            hits, misses = dict(self._hits), dict(self._misses)
+        return {
+            "enabled": self.enabled,
+            "hits": sum(hits.values()),
+            "misses": sum(misses.values()),
+            "stages": {
+                stage: {"hits": hits.get(stage, 0), "misses": misses.get(stage, 0)}
+                for stage in sorted(set(hits) | set(misses))
+            },
+        }
+
+artifact_cache = ArtifactCache()
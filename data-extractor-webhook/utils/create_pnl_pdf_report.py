@@ -1,35 +1,45 @@
 """
 Module for generating and handling Profit & Loss (P&L) statement reports in PDF format.
+Reports are rendered into an in-memory buffer and uploaded straight from it, so concurrent
+jobs never share a file on disk. Document and table styles are built once per process.
 """
 
+import io
 import os
 import uuid
 import logging
-from typing import Dict, Any
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Any, Optional
 
 from dotenv import load_dotenv
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 
+from utils.metrics import STAGE_DURATION
 # pylint: disable=import-error
-from utils.supabase_client import supabase
+from utils.supabase_client import get_supabase
+
+# reportlab is imported on first use, so server workers start without loading it
+if TYPE_CHECKING:
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import Table, TableStyle
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump whenever the report layout changes, to invalidate cached report URLs
+REPORT_VERSION = "1"
+
 def create_pnl_pdf_report(
     financial_data: Dict[str, Any],
-    pdf_path: str,
+    pdf_path: Optional[str] = None,
     company_name: str = "XYZ Ltd.") -> str:
     """
     Generate a PDF report for Profit & Loss statement and upload it to Supabase storage.
 
     Args:
         financial_data (Dict[str, Any]): JSON data containing P&L statement information
-        pdf_path (str): Path where the PDF file should be saved
+        pdf_path (Optional[str]): Path where a copy of the PDF file should also be saved.
+            When None (the default) the report only exists in memory.
         company_name (str, optional): Name of the company. Defaults to "XYZ Ltd."
 
     Returns:
@@ -39,10 +49,15 @@ def create_pnl_pdf_report(
         ValueError: If required environment variables are missing
         Exception: If file upload fails
     """
+    # pylint: disable=import-outside-toplevel
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate
+
     try:
-        # Initialize PDF document
+        # Initialize PDF document in memory
+        pdf_buffer = io.BytesIO()
         doc = SimpleDocTemplate(
-            pdf_path,
+            pdf_buffer,
             pagesize=A4,
             rightMargin=30,
             leftMargin=30,
@@ -61,16 +76,28 @@ def create_pnl_pdf_report(
 
         # Generate PDF
         doc.build(elements)
+        pdf_bytes = pdf_buffer.getvalue()
+
+        if pdf_path:
+            with open(pdf_path, 'wb') as f:
+                f.write(pdf_bytes)
 
         # Upload to Supabase
-        return _upload_pdf_to_supabase(pdf_path)
+        # Timed on its own so that slow storage is not mistaken for slow rendering
+        with STAGE_DURATION.labels("report_upload").time():
+            return _upload_pdf_to_supabase(pdf_bytes)
 
     except Exception as e:
         logger.error("Failed to generate P&L report: %s", str(e))
         raise
 
-def _create_document_styles() -> Dict[str, ParagraphStyle]:
-    """Create and return document styles for the PDF report."""
+@lru_cache(maxsize=1)
+def _create_document_styles() -> Dict[str, "ParagraphStyle"]:
+    """Create and return document styles for the PDF report, once per process."""
+    # pylint: disable=import-outside-toplevel
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
     styles = getSampleStyleSheet()
     return {
         'title': ParagraphStyle(
@@ -104,8 +131,10 @@ def _create_document_styles() -> Dict[str, ParagraphStyle]:
 def _add_document_header(elements: list,
         company_name: str,
         financial_data: Dict[str, Any],
-        styles: Dict[str, ParagraphStyle]) -> None:
+        styles: Dict[str, "ParagraphStyle"]) -> None:
     """Add header information to the document elements."""
+    from reportlab.platypus import Paragraph, Spacer  # pylint: disable=import-outside-toplevel
+
     elements.append(Paragraph(f"<b>{company_name}</b>", styles['title']))
     elements.append(Spacer(1, 15))
 
@@ -116,8 +145,10 @@ def _add_document_header(elements: list,
 
 def _add_financial_sections(elements: list,
         financial_data: Dict[str, Any],
-        styles: Dict[str, ParagraphStyle]) -> None:
+        styles: Dict[str, "ParagraphStyle"]) -> None:
     """Add financial sections to the document elements."""
+    from reportlab.platypus import Paragraph, Spacer  # pylint: disable=import-outside-toplevel
+
     for section in financial_data["sections"]:
         elements.append(Paragraph(f"<b>{section['title']}</b>", styles['bold']))
         elements.append(Spacer(1, 5))
@@ -128,8 +159,10 @@ def _add_financial_sections(elements: list,
         elements.append(table)
         elements.append(Spacer(1, 10))
 
-def _prepare_table_data(fields: list, styles: Dict[str, ParagraphStyle]) -> list:
+def _prepare_table_data(fields: list, styles: Dict[str, "ParagraphStyle"]) -> list:
     """Prepare and format table data."""
+    from reportlab.platypus import Paragraph  # pylint: disable=import-outside-toplevel
+
     table_data = []
     for field in fields:
         style = styles['bold'] if field.get("bold", False) else styles['normal']
@@ -146,23 +179,34 @@ def _format_numeric_value(value: float) -> str:
         return f"({abs(value):,})" if value < 0 else f"{value:,}"
     return str(value)
 
-def _create_formatted_table(data: list) -> Table:
-    """Create and style a table with the provided data."""
-    table = Table(data, colWidths=[320, 120])
-    table.setStyle(TableStyle([
+@lru_cache(maxsize=1)
+def _create_table_style() -> "TableStyle":
+    """Create and return the table style for financial sections, once per process."""
+    # pylint: disable=import-outside-toplevel
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    return TableStyle([
         ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
         ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
         ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
         ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.whitesmoke, colors.lightgrey])
-    ]))
+    ])
+
+def _create_formatted_table(data: list) -> "Table":
+    """Create and style a table with the provided data."""
+    from reportlab.platypus import Table  # pylint: disable=import-outside-toplevel
+
+    table = Table(data, colWidths=[320, 120])
+    table.setStyle(_create_table_style())
     return table
 
-def _upload_pdf_to_supabase(file_path: str) -> str:
+def _upload_pdf_to_supabase(pdf_bytes: bytes) -> str:
     """
-    Upload PDF file to Supabase storage.
+    Upload PDF content to Supabase storage.
     
     Args:
-        file_path (str): Path to the PDF file
+        pdf_bytes (bytes): Content of the generated PDF
         
     Returns:
         str: Public URL of the uploaded file
@@ -177,16 +221,16 @@ def _upload_pdf_to_supabase(file_path: str) -> str:
         raise ValueError("BUCKET_NAME environment variable is not set")
 
     try:
-        with open(file_path, 'rb') as f:
-            unique_filename = f"pl_reports/{uuid.uuid4()}.pdf"
-            response = supabase.storage.from_(bucket_name).upload(
-                file=f,
-                path=unique_filename,
-                file_options={"cache-control": "3600",
-                            "upsert": "false",
-                            "Content-Type": "application/pdf"
-                            }
-            )
+        unique_filename = f"pl_reports/{uuid.uuid4()}.pdf"
+        supabase = get_supabase()
+        response = supabase.storage.from_(bucket_name).upload(
+            file=pdf_bytes,
+            path=unique_filename,
+            file_options={"cache-control": "3600",
+                        "upsert": "false",
+                        "Content-Type": "application/pdf"
+                        }
+        )
 
         public_url = supabase.storage.from_(bucket_name).get_public_url(response.path)
         if not public_url:
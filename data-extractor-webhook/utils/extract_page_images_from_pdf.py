@@ -1,127 +1,374 @@
 """
 Module for extracting and converting pages from PDF files into base64 encoded images.
 This module provides functionality to:
-- Download PDFs from URLs
-- Convert specific PDF pages to high-quality images
-- Save extracted images locally
+- Download PDFs from URLs, or reuse an already downloaded PDFDocument
+- Rasterize only the requested PDF pages, straight to JPEG with pdftoppm
+- Pick the render DPI from the pixel budget the vision model actually consumes
+- Render only the statement table of a page, in grayscale, sized to the vision tile grid,
+  straight to JPEG with pdftoppm's crop options
+- Wait for the memory budget of the resource governor before locating tables and rendering
 - Convert images to base64 encoded strings
 The main functionality is provided through the extract_page_images_from_pdf function,
 which handles the entire workflow from PDF download to image extraction and encoding.
 Functions:
-    extract_page_images_from_pdf: Extracts specified pages from a PDF and 
+    extract_page_images_from_pdf: Extracts specified pages from a PDF and
     converts them to base64 encoded images
+    extract_page_images_with_stats: Same, also returning per-page byte sizes
+    resolve_render_dpi: Computes the DPI that fits a page into the vision pixel budget
 Classes:
     PDFProcessingError: Custom exception for handling PDF processing failures
 Dependencies:
-    - pdf2image: For PDF to image conversion
+    - pdf2image: For driving pdftoppm on whole pages
+    - subprocess: For driving pdftoppm on cropped regions, which pdf2image cannot pass
+    - pdfplumber: For reading page counts and page sizes
     - requests: For downloading PDFs from URLs
-    - pathlib: For file system operations
+    - utils.pdf_document: For sharing a single download between stages
+    - utils.statement_image: For locating statement tables and planning their renders
+    - utils.resource_governor: For admitting renders against the memory budget
+    - pathlib: For reading rendered files
     - base64: For image encoding
     - logging: For operation logging
 """
 
-from typing import List, Optional
-import io
+from typing import Any, Dict, List, Optional, Tuple, Union
+import os
 import base64
+import subprocess
 import logging
+import tempfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path
 from requests.exceptions import RequestException
 
+from utils.pdf_document import PDFDocument, resolve_pdf_document
+from utils.resource_governor import (
+    AdmissionTimeout, estimate_render_bytes, estimate_text_bytes, resource_governor
+)
+from utils.statement_image import (
+    VISION_JPEG_QUALITY, find_section_bbox, find_statement_bbox, plan_statement_render
+)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# gpt-4o (detail "high") fits images into a 2048px square and then scales the
+# shortest side down to 768px, so pixels beyond that only cost render time and bytes.
+VISION_SHORT_SIDE_PX = int(os.getenv("VISION_SHORT_SIDE_PX", "768"))
+VISION_MAX_SIDE_PX = int(os.getenv("VISION_MAX_SIDE_PX", "2048"))
+MIN_RENDER_DPI = 72
+MAX_RENDER_DPI = 800
+
+# Bump when rendering or encoding changes, to invalidate cached images
+RENDER_VERSION = "3"
+# Crop pages to the statement table and send them in grayscale
+CROP_TO_TABLE = os.getenv("VISION_CROP_TO_TABLE", "true").lower() == "true"
+RENDER_THREADS = int(os.getenv("PDF_RENDER_THREADS", str(os.cpu_count() or 1)))
+JPEG_OPTIONS = {"quality": 85, "progressive": True, "optimize": True}
+STATEMENT_JPEG_OPTIONS = f"quality={VISION_JPEG_QUALITY},progressive=y,optimize=y"
+
 class PDFProcessingError(Exception):
     """Custom exception for PDF processing errors."""
 
+def resolve_render_dpi(
+    width_pt: float,
+    height_pt: float,
+    short_side_px: int = VISION_SHORT_SIDE_PX,
+    max_side_px: int = VISION_MAX_SIDE_PX
+) -> int:
+    """
+    Compute the DPI at which a page fills the vision model's pixel budget.
+
+    Args:
+        width_pt (float): Page width in PDF points (1/72 inch)
+        height_pt (float): Page height in PDF points (1/72 inch)
+        short_side_px (int): Target size of the shortest image side in pixels
+        max_side_px (int): Upper bound for the longest image side in pixels
+
+    Returns:
+        int: DPI clamped to [MIN_RENDER_DPI, MAX_RENDER_DPI]
+    """
+    short_side_in = min(width_pt, height_pt) / 72
+    long_side_in = max(width_pt, height_pt) / 72
+    if short_side_in <= 0:
+        return MIN_RENDER_DPI
+
+    dpi = min(short_side_px / short_side_in, max_side_px / long_side_in)
+    return int(max(MIN_RENDER_DPI, min(MAX_RENDER_DPI, dpi)))
+
+def _group_page_runs(page_dpis: Dict[int, int]) -> List[Tuple[int, int, int]]:
+    """Group pages into contiguous (first, last, dpi) runs rendered by one pdftoppm call."""
+    runs: List[Tuple[int, int, int]] = []
+    for page_num in sorted(page_dpis):
+        dpi = page_dpis[page_num]
+        if runs and runs[-1][1] == page_num - 1 and runs[-1][2] == dpi:
+            runs[-1] = (runs[-1][0], page_num, dpi)
+        else:
+            runs.append((page_num, page_num, dpi))
+    return runs
+
+def _render_pages(
+    pdf_path: str,
+    page_dpis: Dict[int, int],
+    render_threads: int
+) -> Dict[int, bytes]:
+    """Render the given pages with pdftoppm directly to JPEG files and return their bytes."""
+    rendered: Dict[int, bytes] = {}
+    with tempfile.TemporaryDirectory(prefix="pdf-render-") as render_dir:
+        for first_page, last_page, dpi in _group_page_runs(page_dpis):
+            logger.info("Rendering pages %d-%d at %d DPI", first_page, last_page, dpi)
+            image_paths = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                first_page=first_page,
+                last_page=last_page,
+                fmt='jpeg',
+                jpegopt=JPEG_OPTIONS,
+                thread_count=max(1, min(render_threads, last_page - first_page + 1)),
+                output_folder=render_dir,
+                paths_only=True,
+            )
+            for page_num, image_path in zip(range(first_page, last_page + 1), image_paths):
+                rendered[page_num] = Path(image_path).read_bytes()
+    return rendered
+
+def _render_statement_region(pdf_path: str, page_num: int, plan: Dict[str, Any]) -> bytes:
+    """Render the planned region of a page with pdftoppm directly to a grayscale JPEG."""
+    resolution_x, resolution_y = plan["resolution"]
+    x, y, width, height = plan["region"]
+    with tempfile.TemporaryDirectory(prefix="pdf-render-") as render_dir:
+        output_root = os.path.join(render_dir, "page")
+        subprocess.run(
+            [
+                "pdftoppm", "-f", str(page_num), "-l", str(page_num),
+                "-rx", f"{resolution_x:.4f}", "-ry", f"{resolution_y:.4f}",
+                "-x", str(x), "-y", str(y), "-W", str(width), "-H", str(height),
+                "-gray", "-jpeg", "-jpegopt", STATEMENT_JPEG_OPTIONS, "-singlefile",
+                pdf_path, output_root,
+            ],
+            check=True, capture_output=True,
+        )
+        return Path(f"{output_root}.jpg").read_bytes()
+
+def _render_statement_regions(
+    pdf_path: str,
+    plans: Dict[int, Dict[str, Any]],
+    render_threads: int
+) -> Dict[int, bytes]:
+    """Render the planned regions of the given pages, in parallel pdftoppm processes."""
+    for page_num in sorted(plans):
+        logger.info("Rendering the statement region of page %d at %.0f DPI", page_num,
+                    plans[page_num]["resolution"][0])
+    workers = max(1, min(render_threads, len(plans)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-render") as executor:
+        futures = {
+            page_num: executor.submit(_render_statement_region, pdf_path, page_num, plan)
+            for page_num, plan in plans.items()
+        }
+        return {page_num: future.result() for page_num, future in futures.items()}
+
+def _read_page_layout(
+    document: PDFDocument,
+    target_pages: List[int],
+    crop_to_table: bool,
+    section_labels: Optional[List[str]],
+    admission_timeout: Optional[float]
+) -> Tuple[Dict[int, Tuple[float, float]], Dict[int, Any]]:
+    """
+    Validate the page numbers and read the size and, when cropping, the table of each page.
+
+    pdfplumber parses the pages once their memory fits in the resource governor's budget.
+
+    Returns:
+        Tuple[Dict[int, Tuple[float, float]], Dict[int, Any]]: Width and height in points,
+            and the table bounding box (empty unless crop_to_table), by page number
+
+    Raises:
+        ValueError: If provided page numbers are invalid
+        AdmissionTimeout: If the memory for parsing did not become available in time
+    """
+    import pdfplumber  # pylint: disable=import-outside-toplevel
+    page_sizes: Dict[int, Tuple[float, float]] = {}
+    table_bboxes: Dict[int, Any] = {}
+    with document.open() as pdf_stream, pdfplumber.open(pdf_stream) as pdf:
+        max_pages = len(pdf.pages)
+        invalid_pages = [p for p in target_pages if p < 1 or p > max_pages]
+        if invalid_pages:
+            raise ValueError(
+                f"Invalid page numbers: {invalid_pages}. "
+                f"PDF has {max_pages} pages"
+            )
+
+        for page_num in set(target_pages):
+            page = pdf.pages[page_num - 1]
+            page_sizes[page_num] = (float(page.width), float(page.height))
+        if not crop_to_table:
+            return page_sizes, table_bboxes
+
+        estimated_bytes = estimate_text_bytes(list(page_sizes.values()), document.size)
+        with resource_governor.admit("page_layout", estimated_bytes, admission_timeout):
+            for page_num in page_sizes:
+                page = pdf.pages[page_num - 1]
+                table_bboxes[page_num] = find_section_bbox(page, section_labels) \
+                    if section_labels else find_statement_bbox(page)
+                page.close()
+    return page_sizes, table_bboxes
+
+def _render_cropped_pages(
+    document: PDFDocument,
+    page_sizes: Dict[int, Tuple[float, float]],
+    page_dpis: Dict[int, int],
+    table_bboxes: Dict[int, Any]
+) -> Tuple[Dict[int, bytes], Dict[int, Dict[str, Any]]]:
+    """Render the statement region of each page, returning the JPEGs and their statistics."""
+    plans = {
+        page_num: plan_statement_render(
+            table_bboxes[page_num], page_sizes[page_num], dpi,
+            VISION_SHORT_SIDE_PX, VISION_MAX_SIDE_PX
+        )
+        for page_num, dpi in page_dpis.items()
+    }
+    encoded_pages = _render_statement_regions(document.as_path(), plans, RENDER_THREADS)
+    page_stats = {
+        page_num: {**plan["stats"], "prepared_bytes": len(encoded_pages[page_num])}
+        for page_num, plan in plans.items()
+    }
+    return encoded_pages, page_stats
+
+def _render_full_pages(
+    document: PDFDocument,
+    page_dpis: Dict[int, int]
+) -> Tuple[Dict[int, bytes], Dict[int, Dict[str, Any]]]:
+    """Render whole pages, returning the JPEGs and their statistics."""
+    encoded_pages = _render_pages(document.as_path(), page_dpis, RENDER_THREADS)
+    page_stats = {
+        page_num: {"prepared_bytes": len(content)}
+        for page_num, content in encoded_pages.items()
+    }
+    return encoded_pages, page_stats
+
+def _encode_pages(
+    target_pages: List[int],
+    encoded_pages: Dict[int, bytes],
+    page_stats: Dict[int, Dict[str, Any]]
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Return the base64 images and statistics of the requested pages, in request order."""
+    base64_encoded_images = []
+    stats = []
+    for page_num in target_pages:
+        logger.info("Processing page %d (%d bytes)", page_num,
+                    page_stats[page_num]["prepared_bytes"])
+
+        # Convert to base64
+        base64_image = base64.b64encode(encoded_pages[page_num]).decode('utf-8')
+        base64_encoded_images.append(base64_image)
+        stats.append({"page": page_num, **page_stats[page_num]})
+
+    logger.info("Successfully processed %d pages", len(target_pages))
+    return base64_encoded_images, stats
+
 def extract_page_images_from_pdf(
-    pdf_url: str,
+    pdf_url: Union[str, PDFDocument],
     target_pages: List[int],
-    output_dir: str = './extracted_images',
-    image_dpi: int = 800
+    image_dpi: Optional[int] = None,
+    crop_to_table: bool = CROP_TO_TABLE
 ) -> Optional[List[str]]:
     """
     Extract and convert specific pages from a PDF into base64 encoded images.
-    
+
     This function performs the following steps:
-    1. Downloads a PDF from the provided URL
-    2. Converts specified pages to high-quality images
-    3. Saves the images locally
+    1. Downloads a PDF from the provided URL (skipped for a shared PDFDocument)
+    2. Rasterizes only the specified pages
+    3. Crops each page to its statement table in grayscale, unless disabled
     4. Returns base64 encoded strings of the images
-    
+
     Args:
-        pdf_url (str): The URL of the PDF file to process
+        pdf_url (Union[str, PDFDocument]): The URL of the PDF file to process,
+            or a document that has already been downloaded
         target_pages (List[int]): List of page numbers to extract (1-based indexing)
-        output_dir (str): Directory path to save the extracted images
-        image_dpi (int): DPI resolution for the extracted images
-    
+        image_dpi (Optional[int]): Fixed DPI for the extracted images. When None, the DPI
+            is derived per page from the vision model pixel budget
+        crop_to_table (bool): Crop pages to the statement table, in grayscale
+
     Returns:
         Optional[List[str]]: List of base64 encoded strings of the page images
                             Returns None if processing fails
-    
+
     Raises:
         PDFProcessingError: If there's an error during PDF processing
         ValueError: If provided page numbers are invalid
     """
+    images, _ = extract_page_images_with_stats(pdf_url, target_pages, image_dpi, crop_to_table)
+    return images
+
+def extract_page_images_with_stats(  # pylint: disable=too-many-arguments
+    pdf_url: Union[str, PDFDocument],
+    target_pages: List[int],
+    image_dpi: Optional[int] = None,
+    crop_to_table: bool = CROP_TO_TABLE,
+    *,
+    section_labels: Optional[List[str]] = None,
+    admission_timeout: Optional[float] = None
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Extract page images like extract_page_images_from_pdf, with per-page statistics.
+
+    With crop_to_table and section_labels, pages are cropped from the column headings
+    down to the last row with one of the labels, for reading a single section again.
+    Rendering waits until its estimated memory fits in the resource governor's budget,
+    for at most admission_timeout seconds (the governor's timeout when None).
+
+    Returns:
+        Tuple[List[str], List[Dict[str, Any]]]: The base64 encoded images, and for each
+            requested page its number and "prepared_bytes" (the image that is sent), plus
+            the crop and tile statistics of cropped pages
+
+    Raises:
+        PDFProcessingError: If there's an error during PDF processing
+        ValueError: If provided page numbers are invalid
+        AdmissionTimeout: If the memory for rendering did not become available in time
+    """
+    document = None
     try:
         # Validate input parameters
         if not target_pages:
             raise ValueError("No target pages provided")
         if not pdf_url:
             raise ValueError("PDF URL cannot be empty")
+        target_pages = [int(page_num) for page_num in target_pages]
 
-        # Create output directory using pathlib
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
+        # Download PDF unless a shared document was provided
+        document = resolve_pdf_document(pdf_url)
 
-        # Download PDF
-        logger.info("Downloading PDF from: %s", pdf_url)
-        response = requests.get(pdf_url, timeout=30)
-        response.raise_for_status()
-
-        # Convert PDF to images
-        logger.info("Converting PDF pages to images")
-        pdf_images = convert_from_bytes(
-            response.content,
-            dpi=image_dpi,
+        # Validate page numbers, read page sizes and locate tables without rendering
+        page_sizes, table_bboxes = _read_page_layout(
+            document, target_pages, crop_to_table, section_labels, admission_timeout
         )
+        page_dpis = {
+            page_num: image_dpi or resolve_render_dpi(*page_size)
+            for page_num, page_size in page_sizes.items()
+        }
 
-        # Validate page numbers
-        max_pages = len(pdf_images)
-        invalid_pages = [p for p in target_pages if p < 1 or p > max_pages]
-        if invalid_pages:
-            raise ValueError(
-                f"Invalid page numbers: {invalid_pages}. "
-                f"PDF has {max_pages} pages"
-            )
-
-        # Process each requested page
-        base64_encoded_images = []
-        for page_num in target_pages:
-            logger.info("Processing page %d", page_num)
-
-            # Get image for the current page (convert 1-based to 0-based index)
-            current_image = pdf_images[page_num - 1]
-
-            # Convert image to bytes
-            image_buffer = io.BytesIO()
-            current_image.save(image_buffer, format='JPEG')
-            image_bytes = image_buffer.getvalue()
-
-            # # Save image to file
-            # image_path = output_path / f'page_{page_num}.jpg'
-            # image_path.write_bytes(image_bytes)
-
-            # Convert to base64
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-            base64_encoded_images.append(base64_image)
+        # Convert only the requested pages to images, once their memory fits in the budget
+        estimated_bytes = estimate_render_bytes(
+            [(*page_sizes[page_num], dpi) for page_num, dpi in page_dpis.items()],
+            RENDER_THREADS
+        )
+        with resource_governor.admit("image_extraction", estimated_bytes, admission_timeout):
+            logger.info("Converting %d PDF pages to images", len(page_dpis))
+            if crop_to_table:
+                encoded_pages, page_stats = _render_cropped_pages(
+                    document, page_sizes, page_dpis, table_bboxes
+                )
+            else:
+                encoded_pages, page_stats = _render_full_pages(document, page_dpis)
 
-        logger.info("Successfully processed %d pages", len(target_pages))
-        return base64_encoded_images
+        return _encode_pages(target_pages, encoded_pages, page_stats)
 
+    except AdmissionTimeout:
+        raise
     except RequestException as e:
         logger.error("Failed to download PDF: %s", e)
         raise PDFProcessingError(f"PDF download failed: {str(e)}") from e
@@ -131,3 +378,7 @@ def extract_page_images_from_pdf(
     except Exception as e:
         logger.error("Unexpected error during PDF processing: %s", e)
         raise PDFProcessingError(f"PDF processing failed: {str(e)}") from e
+    finally:
+        # Only release documents this function downloaded itself
+        if document is not None and document is not pdf_url:
+            document.close()
@@ -8,9 +8,17 @@ text extraction may not be possible (e.g., scanned documents).
 Dependencies:
     - requests: For downloading PDF files from URLs
     - pdfplumber: For extracting text from PDF files
-    - io: For handling byte streams
+    - utils.pdf_document: For sharing a single download between stages
     - logging: For error and operation logging
     - typing: For type hints
+The source may be either a URL or an already downloaded PDFDocument, so the pipeline can share
+a single download between stages.
+Long documents can be split into page ranges that are extracted in parallel by a process pool,
+with each worker opening the shared document from disk independently.
+Each page's layout cache is released once its text is extracted, and extraction waits until
+its estimated memory fits in the resource governor's budget.
+iter_pdf_pages yields pages lazily instead, and with stop_after_statement=True the extraction
+stops reading the document once the consolidated statement and its continuation pages are found.
 Example:
     result = extract_pdf_text_from_url("https://example.com/sample.pdf")
     if result["success"]:
@@ -19,25 +27,154 @@ Example:
 
 """
 
-from typing import Dict, Union, List
-import io
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, Optional, Union, List
+import os
 import logging
+import threading
+import multiprocessing
 import requests
-import pdfplumber
+
+from utils.pdf_document import PDFDocument, resolve_pdf_document
+from utils.page_ranker import SCAN_LOOKAHEAD, scan_for_statement
+from utils.resource_governor import AdmissionTimeout, estimate_text_bytes, resource_governor
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def extract_pdf_text_from_url(pdf_url: str) -> Dict[str, Union[bool, str, List[Dict[str, str]]]]:
+# Bump when the shape or content of the extracted text changes, to invalidate cached results
+EXTRACTOR_VERSION = "1"
+
+# A worker count of 1 extracts pages sequentially in the calling process
+TEXT_EXTRACTION_WORKERS = int(os.getenv("TEXT_EXTRACTION_WORKERS", "1"))
+TEXT_EXTRACTION_CHUNK_SIZE = int(os.getenv("TEXT_EXTRACTION_CHUNK_SIZE", "16"))
+
+_process_pool: Optional[ProcessPoolExecutor] = None  # pylint: disable=invalid-name
+_process_pool_workers = 0  # pylint: disable=invalid-name
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Return the shared extraction process pool, recreating it if the size changed.
+
+    Workers are spawned rather than forked because the server runs job threads, and
+    forking a multi-threaded process can deadlock the child.
+    """
+    global _process_pool, _process_pool_workers  # pylint: disable=global-statement
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            _process_pool_workers = workers
+        return _process_pool
+
+def _reset_process_pool() -> None:
+    global _process_pool  # pylint: disable=global-statement
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+        _process_pool = None
+
+def _extract_page_range(pdf_path: str, first_page: int, last_page: int) -> List[Dict[str, str]]:
+    """
+    Extract the text of pages first_page..last_page (1-based, inclusive).
+
+    Runs in a pool worker, so it opens the document from disk by itself.
+    """
+    import pdfplumber  # pylint: disable=import-outside-toplevel
+
+    extracted_pages = []
+    with pdfplumber.open(pdf_path, pages=list(range(first_page, last_page + 1))) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text()
+            page.close()
+            if text and text.strip():
+                extracted_pages.append({
+                    "page_number": page.page_number,
+                    "content": text.strip()
+                })
+    return extracted_pages
+
+def _extract_pages_in_parallel(document: PDFDocument, page_count: int,
+                               workers: int, chunk_size: int) -> List[Dict[str, str]]:
+    """Split the document into page ranges and extract them on the process pool, in order."""
+    pdf_path = document.as_path()
+    ranges = [
+        (first_page, min(first_page + chunk_size - 1, page_count))
+        for first_page in range(1, page_count + 1, chunk_size)
+    ]
+    logger.info("Extracting %d pages in %d chunks on %d workers",
+                page_count, len(ranges), workers)
+    try:
+        pool = _get_process_pool(workers)
+        futures = [
+            pool.submit(_extract_page_range, pdf_path, first_page, last_page)
+            for first_page, last_page in ranges
+        ]
+        return [page for future in futures for page in future.result()]
+    except BrokenProcessPool as e:
+        # A crashed worker must not fail the job; fall back to sequential extraction
+        logger.warning("Text extraction pool failed (%s), extracting sequentially", e)
+        _reset_process_pool()
+        return _extract_page_range(pdf_path, 1, page_count)
+
+def iter_pdf_pages(document: PDFDocument) -> Iterator[Dict[str, Union[int, str]]]:
+    """
+    Lazily yield the text of each page that has any, in page order.
+
+    Pages are only parsed when the consumer asks for them, and each page's layout
+    cache is released once its text has been yielded. Closing the generator closes
+    the underlying PDF.
+
+    Args:
+        document (PDFDocument): The downloaded document
+
+    Yields:
+        Dict[str, Union[int, str]]: Items with "page_number" and "content"
+    """
+    import pdfplumber  # pylint: disable=import-outside-toplevel
+
+    with document.open() as pdf_stream, pdfplumber.open(pdf_stream) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text()
+            page.close()
+            if text and text.strip():
+                yield {
+                    "page_number": page.page_number,
+                    "content": text.strip()
+                }
+
+def extract_pdf_text_from_url(
+    pdf_url: Union[str, PDFDocument],
+    workers: int = TEXT_EXTRACTION_WORKERS,
+    chunk_size: int = TEXT_EXTRACTION_CHUNK_SIZE,
+    stop_after_statement: bool = False,
+    lookahead: int = SCAN_LOOKAHEAD
+) -> Dict[str, Union[bool, str, List[Dict[str, str]]]]:
     """
     Extract text content from a PDF document accessible via URL.
 
-    This function downloads a PDF from the given URL and extracts text content
-    page by page using pdfplumber. It handles various exceptions that might
-    occur during the download and extraction process.
+    This function extracts text content page by page using pdfplumber from a
+    document that has already been downloaded, or from the PDF at the given URL,
+    which is downloaded first. It handles various exceptions that might occur
+    during the download and extraction process.
 
     Args:
-        pdf_url (str): The URL of the PDF document to process.
+        pdf_url (Union[str, PDFDocument]): The URL of the PDF document to process,
+            or a document that has already been downloaded.
+        workers (int): Number of processes extracting page ranges in parallel;
+            1 extracts sequentially in the calling process.
+        chunk_size (int): Number of pages per range handed to a worker.
+        stop_after_statement (bool): Read pages lazily and stop once the consolidated
+            statement header and its continuation pages are found. Only the pages read
+            so far are returned.
+        lookahead (int): Maximum number of pages read after the statement header page.
 
     Returns:
         Dict[str, Union[bool, str, List[Dict[str, str]]]]: A dictionary containing:
@@ -48,31 +185,59 @@ def extract_pdf_text_from_url(pdf_url: str) -> Dict[str, Union[bool, str, List[D
                 - content (str): Extracted text content
 
     Raises:
-        No exceptions are raised; all errors are handled and returned in the response dictionary.
+        AdmissionTimeout: If the memory for the extraction did not become available in time.
+            Other errors are handled and returned in the response dictionary.
     """
+    import pdfplumber  # pylint: disable=import-outside-toplevel
+
     response_template = {
         "success": False,
         "message": "",
         "data": []
     }
 
+    document = None
     try:
-        # Fetch PDF content from URL
-        response = requests.get(pdf_url, stream=True, timeout=30)
-        response.raise_for_status()
+        # Fetch PDF content from URL unless a shared document was provided
+        document = resolve_pdf_document(pdf_url)
 
         # Process PDF content
-        pdf_content = io.BytesIO(response.content)
         extracted_pages = []
+        success_message = "PDF text extraction completed successfully"
 
-        with pdfplumber.open(pdf_content) as pdf:
-            for page_num, page in enumerate(pdf.pages, start=1):
-                text = page.extract_text()
-                if text and text.strip():
-                    extracted_pages.append({
-                        "page_number": page_num,
-                        "content": text.strip()
-                    })
+        if stop_after_statement:
+            # Read pages lazily and stop once the statement and its continuation are found
+            with resource_governor.admit("text_extraction",
+                                         estimate_text_bytes([], document.size)), \
+                    closing(iter_pdf_pages(document)) as pages:
+                extracted_pages, scan_stats = scan_for_statement(pages, lookahead)
+            if scan_stats["found"]:
+                success_message = (
+                    "PDF text extraction stopped after the income statement "
+                    f"({scan_stats['pages_scanned']} pages scanned)"
+                )
+        else:
+            with document.open() as pdf_stream, pdfplumber.open(pdf_stream) as pdf:
+                page_count = len(pdf.pages)
+                parallel = workers > 1 and page_count > chunk_size
+                estimated_bytes = estimate_text_bytes(
+                    [(float(page.width), float(page.height)) for page in pdf.pages],
+                    document.size, min(workers, -(-page_count // chunk_size)) if parallel else 1
+                )
+                with resource_governor.admit("text_extraction", estimated_bytes):
+                    if parallel:
+                        extracted_pages = _extract_pages_in_parallel(
+                            document, page_count, workers, chunk_size
+                        )
+                    else:
+                        for page_num, page in enumerate(pdf.pages, start=1):
+                            text = page.extract_text()
+                            page.close()
+                            if text and text.strip():
+                                extracted_pages.append({
+                                    "page_number": page_num,
+                                    "content": text.strip()
+                                })
 
         # Handle case where no text was extracted
         if not extracted_pages:
@@ -84,7 +249,7 @@ def extract_pdf_text_from_url(pdf_url: str) -> Dict[str, Union[bool, str, List[D
         logger.info("Successfully extracted text from %d pages", len(extracted_pages))
         return {
             "success": True,
-            "message": "PDF text extraction completed successfully",
+            "message": success_message,
             "data": extracted_pages
         }
 
@@ -100,8 +265,16 @@ def extract_pdf_text_from_url(pdf_url: str) -> Dict[str, Union[bool, str, List[D
         response_template["message"] = error_message
         return response_template
 
+    except AdmissionTimeout:
+        raise
+
     except (ValueError, IOError, TypeError) as err:
         error_message = f"Error during PDF processing: {str(err)}"
         logger.error(error_message)
         response_template["message"] = error_message
         return response_template
+
+    finally:
+        # Only release documents this function downloaded itself
+        if document is not None and document is not pdf_url:
+            document.close()
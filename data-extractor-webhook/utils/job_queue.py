@@ -0,0 +1,438 @@
+"""
+Background Job Queue Module
+This module lets the webhook accept a report, return immediately and process it later
+on a pool of background worker threads, without any external broker.
+Job progress is kept in a local SQLite database so that every gunicorn worker process
+can answer status requests for jobs enqueued by any other process on the same host.
+The same database keeps a checkpoint of each stage's output per record, so a retried
+record resumes at its first incomplete stage. The database runs in WAL mode, each
+checkpoint is written in its own transaction, and old jobs and checkpoints are pruned
+according to a configurable retention policy.
+Each queued or running job records the process that owns it. A job whose owner died is
+treated as lost: a retried webhook queues it again at once, and a server process that
+starts claims the lost jobs of dead processes and runs them, resuming from their
+checkpoints.
+Classes:
+    JobStore: SQLite-backed record of job and per-stage progress and stage checkpoints
+    JobQueue: In-process queue served by a configurable pool of worker threads
+"""
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import os
+import json
+import time
+import queue
+import logging
+import sqlite3
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Active jobs of a live process not updated for this long are assumed hung
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "3600"))
+JOB_CHECKPOINTS_ENABLED = os.getenv("JOB_CHECKPOINTS_ENABLED", "true").lower() == "true"
+# NORMAL survives process crashes in WAL mode; FULL also survives power loss
+JOB_DB_SYNCHRONOUS = os.getenv("JOB_DB_SYNCHRONOUS", "NORMAL").upper()
+if JOB_DB_SYNCHRONOUS not in ("NORMAL", "FULL", "EXTRA"):
+    raise ValueError(f"JOB_DB_SYNCHRONOUS must be NORMAL, FULL or EXTRA, not {JOB_DB_SYNCHRONOUS}")
+# Finished jobs are deleted after this long, stage checkpoints of unfinished records sooner
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "30"))
+JOB_CHECKPOINT_RETENTION_HOURS = float(os.getenv("JOB_CHECKPOINT_RETENTION_HOURS", "72"))
+# Minimum time between two prunes by the same process
+PRUNE_INTERVAL_SECONDS = 3600
+
+JobHandler = Callable[[str, str, Callable[[str, str], None]], Dict[str, Any]]
+
+def _process_start_time(pid: int) -> Optional[str]:
+    """Return the start time of a process in clock ticks since boot, if /proc has it."""
+    try:
+        with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as stat:
+            # The command name may contain spaces, so fields are counted after it
+            return stat.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+def process_owner() -> str:
+    """
+    Return the identity of this process as a job owner.
+
+    The start time is part of it, so a process reusing the pid of a dead owner after a
+    restart is not mistaken for it.
+    """
+    pid = os.getpid()
+    return f"{pid}:{_process_start_time(pid) or ''}"
+
+def owner_alive(owner: Optional[str]) -> bool:
+    """Return whether the process identified by a job owner is still running."""
+    if not owner:
+        return False
+    pid_text, _, start_time = owner.partition(":")
+    try:
+        pid = int(pid_text)
+        os.kill(pid, 0)
+    except ValueError:
+        return False
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return not start_time or _process_start_time(pid) in (None, start_time)
+
+class JobStore:
+    """
+    SQLite-backed store of job status, per-stage progress and stage checkpoints.
+
+    A new connection is opened per operation so the store can be shared between
+    threads and processes.
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH) -> None:
+        self.db_path = db_path
+        self._pruned_at = 0.0
+        with self._connect() as connection:
+            # Readers do not block the writer, and a crash never leaves a partial write
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    record_id TEXT PRIMARY KEY,
+                    cse_report_url TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    current_stage TEXT,
+                    stages TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    validation TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            # Stores created before the validation verdict was recorded
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "validation" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN validation TEXT")
+            if "owner" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    record_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    input_key TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (record_id, stage)
+                )
+            """)
+        self.prune()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection for one transaction, committed on success and then closed."""
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            connection.row_factory = sqlite3.Row
+            connection.execute(f"PRAGMA synchronous={JOB_DB_SYNCHRONOUS}")
+            connection.create_function("owner_alive", 1, owner_alive)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create(self, record_id: str, cse_report_url: str) -> bool:
+        """
+        Register a queued job, resetting any previous attempt for the record.
+
+        The check and the insert are a single statement, so concurrent webhooks for the
+        same record in different server processes register only one job. The calling
+        process becomes the owner of the job.
+
+        Returns:
+            bool: False if a job for the record is already queued or running in a live
+                process and was updated within JOB_STALE_SECONDS
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO jobs "
+                "(record_id, cse_report_url, status, stages, owner, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', '{}', ?, ?, ?) "
+                "ON CONFLICT(record_id) DO UPDATE SET "
+                "cse_report_url = excluded.cse_report_url, status = 'queued', "
+                "current_stage = NULL, stages = '{}', result = NULL, validation = NULL, "
+                "error = NULL, owner = excluded.owner, created_at = excluded.created_at, "
+                "updated_at = excluded.updated_at "
+                "WHERE jobs.status NOT IN ('queued', 'running') OR jobs.updated_at < ? "
+                "OR NOT owner_alive(jobs.owner)",
+                (record_id, cse_report_url, process_owner(), now, now, now - JOB_STALE_SECONDS)
+            )
+        self._prune_if_due()
+        return cursor.rowcount > 0
+
+    def claim_orphans(self) -> List[Dict[str, str]]:
+        """
+        Take over the queued and running jobs whose owner process is dead.
+
+        Each job is claimed with a conditional update, so when several processes start
+        at once every lost job is claimed by exactly one of them.
+
+        Returns:
+            List[Dict[str, str]]: The claimed jobs, with "record_id" and "cse_report_url"
+        """
+        owner = process_owner()
+        claimed = []
+        with self._connect() as connection:
+            orphans = connection.execute(
+                "SELECT record_id, cse_report_url FROM jobs "
+                "WHERE status IN ('queued', 'running') AND NOT owner_alive(owner) "
+                "ORDER BY created_at"
+            ).fetchall()
+            for orphan in orphans:
+                cursor = connection.execute(
+                    "UPDATE jobs SET status = 'queued', current_stage = NULL, owner = ?, "
+                    "updated_at = ? WHERE record_id = ? AND status IN ('queued', 'running') "
+                    "AND NOT owner_alive(owner)",
+                    (owner, time.time(), orphan["record_id"])
+                )
+                if cursor.rowcount:
+                    claimed.append(dict(orphan))
+        return claimed
+
+    def update_stage(self, record_id: str, stage: str, state: str) -> None:
+        """Record the state of a single stage and mark the job as running."""
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT stages FROM jobs WHERE record_id = ?", (record_id,)
+            ).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["stages"])
+            stage_info = stages.setdefault(stage, {})
+            stage_info["state"] = state
+            if state == "running":
+                stage_info["started_at"] = now
+            else:
+                stage_info["finished_at"] = now
+                if "started_at" in stage_info:
+                    stage_info["duration"] = round(now - stage_info["started_at"], 3)
+            connection.execute(
+                "UPDATE jobs SET status = 'running', current_stage = ?, stages = ?, "
+                "updated_at = ? WHERE record_id = ?",
+                (stage, json.dumps(stages), now, record_id)
+            )
+
+    def finish(self, record_id: str, status: str,
+               result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        """Record the final status of a job, with the P&L validation verdict of its result."""
+        validation = (result or {}).get("validation")
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, validation = ?, error = ?, "
+                "updated_at = ? WHERE record_id = ?",
+                (status, json.dumps(result) if result is not None else None,
+                 json.dumps(validation) if validation is not None else None,
+                 error, time.time(), record_id)
+            )
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job as a dictionary, or None if it is unknown."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE record_id = ?", (record_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            stages = connection.execute(
+                "SELECT stage FROM checkpoints WHERE record_id = ? ORDER BY created_at",
+                (record_id,)
+            ).fetchall()
+        job = _row_to_job(row)
+        job["checkpoints"] = [stage["stage"] for stage in stages]
+        return job
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Return the most recently updated jobs, optionally filtered by status."""
+        query = "SELECT * FROM jobs"
+        params: List[Any] = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def save_checkpoint(self, record_id: str, stage: str, input_key: str, output: Any) -> None:
+        """
+        Store the output of a completed stage for a record, replacing any earlier one.
+
+        Args:
+            record_id (str): The record identifier
+            stage (str): Name of the stage
+            input_key (str): Digest of everything the output depends on
+            output (Any): JSON-serializable stage output
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO checkpoints "
+                "(record_id, stage, input_key, output, created_at) VALUES (?, ?, ?, ?, ?)",
+                (record_id, stage, input_key, json.dumps(output), time.time())
+            )
+
+    def load_checkpoint(self, record_id: str, stage: str, input_key: str) -> Optional[Any]:
+        """
+        Return the checkpointed output of a stage for a record.
+
+        Returns:
+            Optional[Any]: The output, or None if the stage has no checkpoint or it was
+                produced from different inputs
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT output FROM checkpoints "
+                "WHERE record_id = ? AND stage = ? AND input_key = ?",
+                (record_id, stage, input_key)
+            ).fetchone()
+        return json.loads(row["output"]) if row else None
+
+    def clear_checkpoints(self, record_id: str) -> None:
+        """Delete the stage checkpoints of a record that reached its final outcome."""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM checkpoints WHERE record_id = ?", (record_id,))
+
+    def prune(self) -> Dict[str, int]:
+        """
+        Apply the retention policy.
+
+        Returns:
+            Dict[str, int]: Number of deleted "jobs" and "checkpoints"
+        """
+        now = time.time()
+        self._pruned_at = now
+        with self._connect() as connection:
+            jobs = connection.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?",
+                (now - JOB_RETENTION_DAYS * 86400,)
+            ).rowcount
+            # A queued or running job, e.g. one recovered from a dead process, resumes from them
+            checkpoints = connection.execute(
+                "DELETE FROM checkpoints WHERE created_at < ? AND record_id NOT IN "
+                "(SELECT record_id FROM jobs WHERE status IN ('queued', 'running'))",
+                (now - JOB_CHECKPOINT_RETENTION_HOURS * 3600,)
+            ).rowcount
+        if jobs or checkpoints:
+            logger.info("Pruned %d jobs and %d stage checkpoints", jobs, checkpoints)
+        return {"jobs": jobs, "checkpoints": checkpoints}
+
+    def _prune_if_due(self) -> None:
+        if time.time() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+            self.prune()
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["stages"] = json.loads(job["stages"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["validation"] = json.loads(job["validation"]) if job["validation"] else None
+    return job
+
+class JobQueue:
+    """
+    In-process job queue served by a pool of background worker threads.
+
+    Worker threads are started lazily on the first enqueue so that importing the
+    module, or forking gunicorn workers, does not spawn threads.
+    """
+
+    def __init__(self, handler: JobHandler, store: JobStore, workers: int = JOB_WORKERS) -> None:
+        self.handler = handler
+        self.store = store
+        self.workers = max(1, workers)
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, record_id: str, cse_report_url: str) -> bool:
+        """
+        Register a job and hand it to the worker pool.
+
+        Returns:
+            bool: False if a job for the record was already queued or running
+        """
+        if not self.store.create(record_id, cse_report_url):
+            logger.info("Job for record ID %s is already in progress", record_id)
+            return False
+        self._ensure_workers()
+        self._queue.put((record_id, cse_report_url))
+        logger.info("Queued CSE report for record ID: %s", record_id)
+        return True
+
+    def recover(self) -> int:
+        """
+        Queue the jobs left behind by dead server processes in this process.
+
+        Call it once a server process is ready to run jobs, e.g. after a gunicorn worker
+        has started.
+
+        Returns:
+            int: Number of jobs recovered
+        """
+        orphans = self.store.claim_orphans()
+        if orphans:
+            self._ensure_workers()
+        for orphan in orphans:
+            logger.info("Recovered job for record ID %s from a dead process",
+                        orphan["record_id"])
+            self._queue.put((orphan["record_id"], orphan["cse_report_url"]))
+        return len(orphans)
+
+    def depth(self) -> int:
+        """Return the number of jobs waiting for a worker in this process."""
+        return self._queue.qsize()
+
+    def _ensure_workers(self) -> None:
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f"job-worker-{len(self._threads) + 1}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            record_id, cse_report_url = self._queue.get()
+            try:
+                self._run(record_id, cse_report_url)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, record_id: str, cse_report_url: str) -> None:
+        def on_stage(stage: str, state: str) -> None:
+            self.store.update_stage(record_id, stage, state)
+
+        try:
+            result = self.handler(record_id, cse_report_url, on_stage)
+            self.store.finish(record_id, result.get("status", "success"), result=result)
+        except Exception as e:  # pylint: disable=broad-except
+            # A failing job must never take the worker thread down with it
+            logger.error("Job for record ID %s failed: %s", record_id, e)
+            self.store.finish(record_id, "error", error=str(e))
+
+_job_store: Optional[JobStore] = None  # pylint: disable=invalid-name
+_job_store_lock = threading.Lock()
+
+def get_job_store() -> JobStore:
+    """Return the process-wide job store, creating its database on first use."""
+    global _job_store  # pylint: disable=global-statement
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
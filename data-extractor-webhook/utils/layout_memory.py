@@ -0,0 +1,268 @@
+"""
+Statement Layout Memory Module
+This module remembers where each listed company puts its consolidated statement of profit
+or loss, so the page-selection agent can be skipped for companies that file in the same
+layout every quarter.
+A layout profile is learned from every successful run and holds:
+- The statement page, counted from the start and from the last page with text
+- The offsets of its continuation pages
+- A fingerprint of the heading lines of the statement page
+- The row labels of the extracted statement
+For a new report, the company is recognized from a heading line of the first pages that
+holds its name alone, so a parent or subsidiary named in the text is not mistaken for it.
+The pages around the remembered position are then verified against the fingerprint and
+the row labels, so a changed layout falls back to the agent instead of selecting wrong
+pages.
+Profiles are kept in SQLite so every server process on the host shares them.
+Classes:
+    LayoutMemory: SQLite-backed store of per-company layout profiles
+"""
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set
+import os
+import re
+import json
+import time
+import logging
+import sqlite3
+import threading
+
+from utils.page_ranker import NUMBER_PATTERN
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LAYOUT_MEMORY_ENABLED = os.getenv("LAYOUT_MEMORY_ENABLED", "true").lower() == "true"
+LAYOUT_DB_PATH = os.getenv("LAYOUT_DB_PATH", "layouts.sqlite3")
+# Pages either side of the remembered position that are verified
+LAYOUT_SEARCH_RADIUS = int(os.getenv("LAYOUT_SEARCH_RADIUS", "2"))
+LAYOUT_MIN_HEADER_SIMILARITY = float(os.getenv("LAYOUT_MIN_HEADER_SIMILARITY", "0.6"))
+LAYOUT_MIN_LABEL_COVERAGE = float(os.getenv("LAYOUT_MIN_LABEL_COVERAGE", "0.7"))
+# Leading pages whose heading lines are searched for a known company name
+LAYOUT_NAME_PAGES = 3
+
+# Words that differ between filings of one company and say nothing about the layout
+VOLATILE_WORDS = {
+    "january", "february", "march", "april", "may", "june", "july", "august",
+    "september", "october", "november", "december",
+}
+# Headings telling the group statement from the company one, which is otherwise identical
+ENTITY_WORDS = {"group", "consolidated", "company"}
+COMPANY_SUFFIXES = {"plc", "limited", "ltd", "pvt", "private", "company", "co", "inc"}
+HEADER_LINES = 12
+LABEL_PREFIX = 24
+
+def normalize_text(text: str) -> str:
+    """Lowercase text and reduce it to words separated by single spaces."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower().replace("&", " and ")).split())
+
+def company_key(company_name: str) -> str:
+    """Return the key of a company, ignoring case, punctuation and legal suffixes."""
+    words = normalize_text(company_name).split()
+    while words and words[-1] in COMPANY_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+def header_tokens(content: str) -> Set[str]:
+    """
+    Fingerprint the heading lines of a statement page.
+
+    Returns:
+        Set[str]: Words of the lines before the first table row, without numbers and
+            month names, so the fingerprint is the same for every quarter
+    """
+    tokens: Set[str] = set()
+    lines = [line for line in content.splitlines() if line.strip()]
+    for line in lines[:HEADER_LINES]:
+        if len(NUMBER_PATTERN.findall(line)) >= 2:
+            break
+        tokens.update(word for word in normalize_text(line).split()
+                      if not word.isdigit() and word not in VOLATILE_WORDS)
+    return tokens
+
+def _label_key(label: str) -> str:
+    return normalize_text(label)[:LABEL_PREFIX]
+
+def _similarity(first: Set[str], second: Set[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+class LayoutMemory:
+    """
+    SQLite-backed store of per-company statement layout profiles.
+
+    A new connection is opened per operation so the store can be shared between
+    threads and processes.
+    """
+
+    def __init__(self, db_path: str = LAYOUT_DB_PATH) -> None:
+        self.db_path = db_path
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS layouts (
+                    company_key TEXT PRIMARY KEY,
+                    company_name TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    runs INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection for one transaction, committed on success and then closed."""
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            connection.row_factory = sqlite3.Row
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def remember(self, company_name: str, pages: List[Dict[str, Any]],
+                 page_numbers: List[int], final_data: Dict[str, Any],
+                 scanned_to_end: bool = True) -> None:
+        """
+        Learn the layout of a successfully processed report.
+
+        Args:
+            company_name (str): Company name returned by page selection
+            pages (List[Dict[str, Any]]): Every extracted page, with "page_number"
+                and "content"
+            page_numbers (List[int]): The statement pages
+            final_data (Dict[str, Any]): The extracted data in the financial_report schema
+            scanned_to_end (bool): Whether pages run to the end of the document, so the
+                position from the end can be learned
+        """
+        key = company_key(company_name or "")
+        contents = {page["page_number"]: page["content"] for page in pages}
+        first = min(page_numbers) if page_numbers else None
+        if not key or first not in contents:
+            return
+
+        labels = [
+            field["label"] for section in final_data.get("sections") or []
+            for field in section.get("fields") or [] if field.get("label")
+        ]
+        profile = {
+            "page_number": first,
+            "pages_from_end": max(contents) - first if scanned_to_end else None,
+            "page_offsets": sorted({page - first for page in page_numbers}),
+            "header_tokens": sorted(header_tokens(contents[first])),
+            "row_labels": list(dict.fromkeys(_label_key(label) for label in labels)),
+        }
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO layouts (company_key, company_name, profile, runs, updated_at) "
+                "VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT(company_key) DO UPDATE SET company_name = excluded.company_name, "
+                "profile = excluded.profile, runs = layouts.runs + 1, "
+                "updated_at = excluded.updated_at",
+                (key, company_name, json.dumps(profile), time.time())
+            )
+        logger.info("Remembered the statement layout of %s (page %d)", company_name, first)
+
+    def find_profile(self, pages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Return the profile of the known company whose name heads the first pages, if any.
+
+        Only heading lines that consist of the company name alone are matched, so a parent
+        or subsidiary mentioned in the text does not lend the report its layout.
+        """
+        heading_keys: List[str] = []
+        for page in pages[:LAYOUT_NAME_PAGES]:
+            lines = [line for line in page["content"].splitlines() if line.strip()]
+            for line in lines[:HEADER_LINES]:
+                key = company_key(line)
+                if key and key not in heading_keys:
+                    heading_keys.append(key)
+        if not heading_keys:
+            return None
+
+        placeholders = ", ".join("?" * len(heading_keys))
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT company_key, company_name, profile FROM layouts "
+                f"WHERE company_key IN ({placeholders})", heading_keys
+            ).fetchall()
+        if not rows:
+            return None
+        # The name printed first is the filer's, rather than one mentioned below it
+        row = min(rows, key=lambda row: heading_keys.index(row["company_key"]))
+        return {"company_key": row["company_key"], "company_name": row["company_name"],
+                **json.loads(row["profile"])}
+
+    def predict(self, pages: List[Dict[str, Any]],
+                scanned_to_end: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Predict and verify the statement pages of a report from a remembered layout.
+
+        Args:
+            pages (List[Dict[str, Any]]): Every extracted page, with "page_number"
+                and "content"
+            scanned_to_end (bool): Whether pages run to the end of the document, so the
+                remembered position from the end can be tried
+
+        Returns:
+            Optional[Dict[str, Any]]: "page_numbers", "status" and "company_name" like
+                the page-selection agent, plus the verification "score", or None when
+                no known company or no verified page was found
+        """
+        profile = self.find_profile(pages)
+        if profile is None:
+            return None
+
+        contents = {page["page_number"]: page["content"] for page in pages}
+        expected_tokens = set(profile["header_tokens"])
+        anchors = {profile["page_number"]}
+        # Statements move with the length of the front matter or of the notes, so
+        # both the position from the start and the one from the end are tried
+        if scanned_to_end and profile["pages_from_end"] is not None:
+            anchors.add(max(contents) - profile["pages_from_end"])
+        candidates = sorted(
+            {anchor + shift for anchor in anchors
+             for shift in range(-LAYOUT_SEARCH_RADIUS, LAYOUT_SEARCH_RADIUS + 1)},
+            key=lambda page: (min(abs(page - anchor) for anchor in anchors), page)
+        )
+
+        best: Optional[Dict[str, Any]] = None
+        for first in candidates:
+            page_numbers = [first + offset for offset in profile["page_offsets"]]
+            if any(page not in contents for page in page_numbers):
+                continue
+            tokens = header_tokens(contents[first])
+            if tokens & ENTITY_WORDS != expected_tokens & ENTITY_WORDS:
+                continue
+            similarity = _similarity(expected_tokens, tokens)
+            text = normalize_text(" ".join(contents[page] for page in page_numbers))
+            labels = profile["row_labels"]
+            coverage = sum(1 for label in labels if label in text) / max(1, len(labels))
+            if similarity < LAYOUT_MIN_HEADER_SIMILARITY or coverage < LAYOUT_MIN_LABEL_COVERAGE:
+                continue
+            # Candidates are ordered by distance, so ties keep the nearest page
+            score = round((similarity + coverage) / 2, 3)
+            if best is None or score > best["score"]:
+                best = {"page_numbers": page_numbers, "score": score}
+
+        if best is None:
+            logger.info("Remembered layout of %s did not verify", profile["company_name"])
+            return None
+        return {
+            "page_numbers": best["page_numbers"],
+            "status": "relevant",
+            "company_name": profile["company_name"],
+            "score": best["score"],
+        }
+
+_layout_memory: Optional[LayoutMemory] = None  # pylint: disable=invalid-name
+_layout_memory_lock = threading.Lock()
+
+def get_layout_memory() -> LayoutMemory:
+    """Return the process-wide layout memory, creating its database on first use."""
+    global _layout_memory  # pylint: disable=global-statement
+    with _layout_memory_lock:
+        if _layout_memory is None:
+            _layout_memory = LayoutMemory()
+        return _layout_memory
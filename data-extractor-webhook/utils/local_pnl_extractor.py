@@ -0,0 +1,461 @@
+"""
+Local P&L Extraction Module
+This module reads the consolidated statement of profit or loss straight from the word
+positions of born-digital PDF pages, without calling the vision agent:
+- Amounts are grouped into columns by their right edge
+- Years, "3 months ended ..." periods and "Group"/"Company" headings above the rows
+  are attached to the columns to find the latest-quarter group column
+- Rows are read from that column, with "(1,234)" as a negative amount, bold flags from
+  the font name and label-only lines as section titles
+The output follows the financial_report schema of the pnl_data_extractor agent. A
+confidence score between 0 and 1 is returned with it, built from how well the column was
+identified, how many rows have an amount in it, whether the usual P&L rows were found
+and whether the subtotals add up (see utils.pnl_validator), so callers can fall back to
+the agent when it is low. A column without a quarterly ("3 months" or "quarter ended")
+heading is never confident, since it may hold the year, nine months or another
+cumulative period.
+Example:
+    result = extract_pnl_locally(document, [5])
+    if result["confidence"] >= LOCAL_EXTRACTION_MIN_CONFIDENCE:
+        final_data = result["data"]
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+import logging
+
+from utils.pdf_document import PDFDocument
+from utils.resource_governor import estimate_text_bytes, resource_governor
+from utils.page_ranker import STATEMENT_HEADER_PATTERN
+from utils.pnl_validator import check_subtotals
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the extraction rules change, to invalidate cached local extractions
+LOCAL_EXTRACTOR_VERSION = "2"
+
+LOCAL_EXTRACTION_ENABLED = os.getenv("LOCAL_EXTRACTION_ENABLED", "true").lower() == "true"
+# Local results scoring below this fall back to the vision agent
+LOCAL_EXTRACTION_MIN_CONFIDENCE = float(os.getenv("LOCAL_EXTRACTION_MIN_CONFIDENCE", "0.85"))
+
+AMOUNT_PATTERN = re.compile(r"^\(?-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?\)?$")
+DASH_PATTERN = re.compile(r"^[-–—]$")
+YEAR_PATTERN = re.compile(r"(?:19|20)\d{2}")
+BARE_YEAR_PATTERN = re.compile(r"^(?:19|20)\d{2}$")
+# A year heading on its own, or as the end of a date such as "30.09.2024"
+YEAR_TOKEN_PATTERN = re.compile(r"^(?:\d{1,2}[./-]\d{1,2}[./-])?((?:19|20)\d{2})$")
+PERIOD_PATTERN = re.compile(
+    r"\b(?:(?P<months>\d{1,2}|three|six|nine|twelve)\s+months?|(?P<quarter>quarter)|year)"
+    r"\s+ended(?:\s+(?P<date>\d{1,2}(?:st|nd|rd|th)?\s+[a-z]+|[a-z]+\s+\d{1,2}"
+    r"|\d{1,2}[./-]\d{1,2}[./-]\d{2,4})(?:,?\s+(?:19|20)\d{2})?)?",
+    re.IGNORECASE
+)
+ENTITY_PATTERN = re.compile(r"^(group|consolidated|company)$", re.IGNORECASE)
+BOLD_FONT_PATTERN = re.compile(r"bold|black|heavy|semibold|demi", re.IGNORECASE)
+CURRENCY_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"\blkr\b|\brs\.?(?=\s|\)|$)|sri lankan rupees?|\brupees?\b", re.IGNORECASE),
+     "LKR"),
+    (re.compile(r"\busd\b|\bus\$|us dollars?", re.IGNORECASE), "USD"),
+]
+SCALE_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"['’]000|\bthousands?\b", re.IGNORECASE), "'000"),
+    (re.compile(r"\bmillions?\b|\bmn\b", re.IGNORECASE), "Mn"),
+]
+# Rows every P&L is expected to have; the share found feeds the confidence score
+KEY_ROW_PATTERNS: List[re.Pattern] = [
+    re.compile(r"\brevenue\b|\bturnover\b", re.IGNORECASE),
+    re.compile(r"\bprofit before (?:income )?tax|\bloss before (?:income )?tax", re.IGNORECASE),
+    re.compile(r"\bincome tax\b|\btax expense\b|\btaxation\b", re.IGNORECASE),
+    re.compile(r"\b(?:profit|loss)\b.*\bfor the (?:period|quarter|year)\b", re.IGNORECASE),
+]
+
+LINE_TOLERANCE_PT = 3
+COLUMN_TOLERANCE_PT = 10
+# A column must hold an amount in this share of the statement rows
+MIN_COLUMN_SHARE = 0.3
+MIN_ROWS = 5
+# Lines further apart than this do not belong to one wrapped label
+WRAP_GAP_PT = 14
+
+# Weights of the confidence components; they add up to 1
+IDENTIFICATION_WEIGHT = 0.25
+COVERAGE_WEIGHT = 0.25
+KEY_ROWS_WEIGHT = 0.2
+ARITHMETIC_WEIGHT = 0.3
+# Highest confidence of a column not confirmed as a quarter by its heading
+UNCONFIRMED_PERIOD_MAX_CONFIDENCE = 0.5
+
+Line = List[Dict[str, Any]]
+
+def _group_lines(words: List[Dict[str, Any]]) -> List[Line]:
+    """Group pdfplumber words into lines of words ordered left to right."""
+    lines: List[Line] = []
+    for word in sorted(words, key=lambda item: (item["top"], item["x0"])):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= LINE_TOLERANCE_PT:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda word: word["x0"]) for line in lines]
+
+def _is_amount(word: Dict[str, Any]) -> bool:
+    text = word["text"]
+    return bool(AMOUNT_PATTERN.match(text) or DASH_PATTERN.match(text)) and \
+        not BARE_YEAR_PATTERN.match(text) and not word.get("heading")
+
+def parse_amount(text: str) -> float:
+    """
+    Parse a statement amount.
+
+    Args:
+        text (str): An amount such as "1,234", "(1,234)", "-12.5" or "-" for nil
+
+    Returns:
+        float: The amount, negative when written in parentheses
+    """
+    if DASH_PATTERN.match(text):
+        return 0.0
+    negative = text.startswith("(") or text.startswith("-")
+    value = float(text.strip("()-").replace(",", ""))
+    return -value if negative else value
+
+def _center(item: Dict[str, Any]) -> float:
+    return (item["x0"] + item["x1"]) / 2
+
+def _find_columns(lines: List[Line]) -> List[Dict[str, Any]]:
+    """Cluster the right edges of amounts on statement rows into columns."""
+    rows = [line for line in lines if sum(_is_amount(word) for word in line) >= 2]
+    edges = sorted(
+        (word["x1"], word["x0"]) for line in rows for word in line if _is_amount(word)
+    )
+    clusters: List[Dict[str, Any]] = []
+    for x1, x0 in edges:
+        if clusters and x1 - clusters[-1]["edges"][-1] <= COLUMN_TOLERANCE_PT:
+            cluster = clusters[-1]
+            cluster["edges"].append(x1)
+            cluster["x0"] = min(cluster["x0"], x0)
+        else:
+            clusters.append({"edges": [x1], "x0": x0})
+
+    columns = []
+    for cluster in clusters:
+        if len(cluster["edges"]) >= max(2, MIN_COLUMN_SHARE * len(rows)):
+            x1 = sum(cluster["edges"]) / len(cluster["edges"])
+            columns.append({"x0": cluster["x0"], "x1": x1, "center": (cluster["x0"] + x1) / 2})
+    return columns
+
+def _column_of(word: Dict[str, Any], columns: List[Dict[str, Any]]) -> Optional[int]:
+    """Return the index of the column an amount is aligned to, if any."""
+    for index, column in enumerate(columns):
+        if abs(word["x1"] - column["x1"]) <= COLUMN_TOLERANCE_PT:
+            return index
+    return None
+
+def _nearest_column(x: float, columns: List[Dict[str, Any]]) -> int:
+    return min(range(len(columns)), key=lambda index: abs(columns[index]["center"] - x))
+
+def _line_text(line: Line) -> str:
+    return " ".join(word["text"] for word in line)
+
+def _periods(line: Line) -> List[Dict[str, Any]]:
+    """Find "3 months ended 30 September" style headings, their span and their words."""
+    offsets = []
+    position = 0
+    for word in line:
+        offsets.append((position, position + len(word["text"]), word))
+        position += len(word["text"]) + 1
+
+    periods = []
+    for match in PERIOD_PATTERN.finditer(_line_text(line)):
+        words = [word for start, end, word in offsets
+                 if start < match.end() and end > match.start()]
+        months = (match.group("months") or "").lower()
+        periods.append({
+            "text": match.group(0),
+            "quarter": bool(match.group("quarter")) or months in ("3", "three"),
+            "x0": words[0]["x0"],
+            "x1": words[-1]["x1"],
+            "words": words,
+        })
+    return periods
+
+def _nearest_heading(column: Dict[str, Any],
+                     headings: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Return the heading spanning a column, or else the one nearest to it."""
+    if not headings:
+        return None
+    spanning = [heading for heading in headings
+                if heading["x0"] - COLUMN_TOLERANCE_PT <= column["center"]
+                <= heading["x1"] + COLUMN_TOLERANCE_PT]
+    return min(spanning or headings, key=lambda heading: abs(_center(heading) - column["center"]))
+
+def _identify_columns(header: List[Line], columns: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Attach years, periods and Group/Company headings to the amount columns.
+
+    Only headings above the amounts area are considered, so statement titles and
+    notes on the left of the page are ignored.
+    """
+    left = min(column["x0"] for column in columns) - 4 * COLUMN_TOLERANCE_PT
+    right = max(column["x1"] for column in columns) + 4 * COLUMN_TOLERANCE_PT
+    years: Dict[int, int] = {}
+    periods: List[Dict[str, Any]] = []
+    entities: List[Dict[str, Any]] = []
+
+    for line in header:
+        line_periods = [period for period in _periods(line)
+                        if left <= _center(period) <= right]
+        periods.extend(line_periods)
+        # Years inside a period heading belong to the heading, not to one column
+        in_period = {id(word) for period in line_periods for word in period["words"]}
+        for word in line:
+            if id(word) in in_period or not left <= _center(word) <= right:
+                continue
+            year = YEAR_TOKEN_PATTERN.match(word["text"])
+            if year:
+                index = _nearest_column(_center(word), columns)
+                years[index] = max(years.get(index, 0), int(year.group(1)))
+            entity = ENTITY_PATTERN.match(word["text"])
+            if entity:
+                entities.append({**word, "entity": entity.group(1).lower()})
+
+    return {
+        "years": years,
+        "periods": {index: _nearest_heading(column, periods)
+                    for index, column in enumerate(columns) if periods},
+        "entities": {index: _nearest_heading(column, entities)["entity"]
+                     for index, column in enumerate(columns) if entities},
+    }
+
+def _choose_column(identified: Dict[str, Any]) -> Optional[int]:
+    """Pick the latest-year quarterly group column among the columns with a year."""
+    candidates = list(identified["years"])
+    if not candidates:
+        return None
+    group = [index for index in candidates
+             if identified["entities"].get(index) in ("group", "consolidated")]
+    candidates = group or candidates
+    quarterly = [index for index in candidates
+                 if (identified["periods"].get(index) or {}).get("quarter")]
+    candidates = quarterly or candidates
+    latest = max(identified["years"][index] for index in candidates)
+    return min(index for index in candidates if identified["years"][index] == latest)
+
+def _is_bold(words: Line) -> bool:
+    bold = sum(1 for word in words if BOLD_FONT_PATTERN.search(word.get("fontname") or ""))
+    return bool(words) and bold * 2 > len(words)
+
+def _metadata(lines: List[Line]) -> Dict[str, str]:
+    """Return the statement title and currency written anywhere on the page."""
+    text = "\n".join(_line_text(line) for line in lines)
+    title = next((_line_text(line) for line in lines
+                  if STATEMENT_HEADER_PATTERN.search(_line_text(line).lower())), "")
+    currency = next((code for pattern, code in CURRENCY_PATTERNS if pattern.search(text)), "")
+    scale = next((label for pattern, label in SCALE_PATTERNS if pattern.search(text)), "")
+    return {"title": title, "currency": f"{currency} {scale}".strip()}
+
+def _read_page(page: Any, previous: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Read the rows of the chosen column on one statement page.
+
+    A continuation page without column headings is read from the column at the same
+    position as the chosen column of the previous page.
+    """
+    words = page.extract_words(keep_blank_chars=False, use_text_flow=False,
+                               extra_attrs=["fontname"])
+    lines = _group_lines(words)
+    # The "3" of "3 months ended" is part of a heading, not an amount
+    for line in lines:
+        for period in _periods(line):
+            for word in period["words"]:
+                word["heading"] = True
+    columns = _find_columns(lines)
+    if not columns:
+        return None
+
+    aligned = [[_column_of(word, columns) if _is_amount(word) else None
+                for word in line] for line in lines]
+    row_indexes = [index for index, line_columns in enumerate(aligned)
+                   if any(column is not None for column in line_columns)]
+    first_row, last_row = row_indexes[0], row_indexes[-1]
+
+    identified = _identify_columns(lines[:first_row], columns)
+    chosen = _choose_column(identified)
+    if chosen is None and previous is not None:
+        chosen = _column_of(previous["column"], columns)
+    if chosen is None:
+        return None
+    label_limit = min(column["x1"] for column in columns)
+
+    rows: List[Dict[str, Any]] = []
+    pending: Optional[Dict[str, Any]] = None
+    for index in range(first_row, last_row + 1):
+        line, line_columns = lines[index], aligned[index]
+        label_words = [word for word, column in zip(line, line_columns)
+                       if column is None and word["x0"] < label_limit]
+        label = " ".join(word["text"] for word in label_words)
+        values = [word for word, column in zip(line, line_columns) if column == chosen]
+        wrapped = pending is not None and (not label or label[0].islower()) and \
+            line[0]["top"] - pending["bottom"] <= WRAP_GAP_PT
+
+        if wrapped:
+            # The label continues on this line
+            label = f"{pending['label']} {label}".strip()
+        elif pending is not None:
+            rows.append({"section": pending["label"]})
+        pending = None
+
+        if index not in row_indexes:
+            if label:
+                pending = {"label": label, "bottom": line[0]["bottom"]}
+            continue
+
+        rows.append({
+            "label": label,
+            "value": parse_amount(values[0]["text"]) if values else None,
+            "bold": _is_bold(label_words or values),
+        })
+
+    period = identified["periods"].get(chosen)
+    if period is None and previous is not None:
+        period = previous["period"]
+    return {
+        "rows": rows,
+        "year": identified["years"].get(chosen) or (previous or {}).get("year"),
+        "period": period,
+        "column": columns[chosen],
+        "entity": identified["entities"].get(chosen),
+        **_metadata(lines),
+    }
+
+def _score(fields: List[Dict[str, Any]], coverage: float, period: Optional[Dict[str, Any]],
+           currency: str) -> Tuple[float, Dict[str, Any]]:
+    """Combine the confidence components into one score."""
+    # The column has a year; a quarterly heading and a currency confirm it
+    identification = 0.5 + (0.3 if period and period["quarter"] else 0.0) + \
+        (0.2 if currency else 0.0)
+
+    labels = [field["label"] for field in fields]
+    key_rows = sum(1 for pattern in KEY_ROW_PATTERNS
+                   if any(pattern.search(label) for label in labels)) / len(KEY_ROW_PATTERNS)
+    subtotals = check_subtotals(fields)
+    checked = len(subtotals)
+    matched = sum(1 for subtotal in subtotals if subtotal["reconciled"])
+    arithmetic = matched / checked if checked else 0.0
+
+    confidence = (IDENTIFICATION_WEIGHT * identification + COVERAGE_WEIGHT * coverage
+                  + KEY_ROWS_WEIGHT * key_rows + ARITHMETIC_WEIGHT * arithmetic)
+    return confidence, {
+        "identification": round(identification, 3),
+        "coverage": round(coverage, 3),
+        "key_rows": round(key_rows, 3),
+        "subtotals_checked": checked,
+        "subtotals_reconciled": matched,
+    }
+
+def _title(text: str) -> str:
+    return text.capitalize() if text.isupper() else text
+
+def extract_pnl_from_pages(pages: List[Any]) -> Dict[str, Any]:
+    """
+    Extract the latest-quarter P&L from statement pages.
+
+    Args:
+        pages (List[pdfplumber.page.Page]): The selected statement pages, in order
+
+    Returns:
+        Dict[str, Any]: "data" in the financial_report schema (None when no statement
+            table was found), its "confidence" between 0 and 1 and the "checks" behind it
+    """
+    read: List[Dict[str, Any]] = []
+    for page in pages:
+        result = _read_page(page, read[-1] if read else None)
+        if result is None:
+            continue
+        if read and None not in (result["entity"], read[0]["entity"]) and \
+                (result["entity"] == "company") != (read[0]["entity"] == "company"):
+            # A company-only statement next to the group one is not part of it
+            continue
+        read.append(result)
+    if not read:
+        return {"data": None, "confidence": 0.0, "checks": {"pages_read": 0}}
+
+    first = read[0]
+    sections: List[Dict[str, Any]] = [
+        {"title": _title(first["title"]) or "Statement of profit or loss", "fields": []}
+    ]
+    fields: List[Dict[str, Any]] = []
+    rows = missing = 0
+    for page in read:
+        for row in page["rows"]:
+            if "section" in row:
+                sections.append({"title": row["section"], "fields": []})
+                continue
+            rows += 1
+            if row["value"] is None or not row["label"]:
+                missing += 1
+                continue
+            field = {"label": row["label"], "value": row["value"], "bold": row["bold"]}
+            sections[-1]["fields"].append(field)
+            fields.append(field)
+
+    if len(fields) < MIN_ROWS:
+        return {"data": None, "confidence": 0.0,
+                "checks": {"pages_read": len(read), "rows": rows}}
+
+    currency = next((page["currency"] for page in read if page["currency"]), "")
+    confidence, checks = _score(fields, 1 - missing / rows, first["period"], currency)
+    # Selected pages without a readable table may hold rows that were not extracted
+    confidence *= len(read) / len(pages)
+    quarterly = bool(first["period"] and first["period"]["quarter"])
+    if not quarterly:
+        confidence = min(confidence, UNCONFIRMED_PERIOD_MAX_CONFIDENCE)
+    checks.update({"pages_read": len(read), "rows": rows, "quarterly": quarterly})
+
+    period = YEAR_PATTERN.sub("", first["period"]["text"]) if first["period"] else "Period"
+    period = period.strip(" ,./-")
+    data = {
+        "period": period[:1].upper() + period[1:],
+        "year": str(first["year"]),
+        "currency": currency or "LKR",
+        "sections": [section for section in sections if section["fields"]],
+    }
+    return {"data": data, "confidence": round(confidence, 3), "checks": checks}
+
+def extract_pnl_locally(document: PDFDocument, page_numbers: List[int],
+                        admission_timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Extract the latest-quarter P&L from the selected pages of a document.
+
+    The pages are parsed once their memory fits in the resource governor's budget.
+
+    Args:
+        document (PDFDocument): The downloaded report
+        page_numbers (List[int]): 1-based numbers of the statement pages; values that
+            are not whole numbers are skipped
+        admission_timeout (Optional[float]): Seconds to wait for memory; the governor's
+            timeout when None, a single attempt when 0
+
+    Returns:
+        Dict[str, Any]: See extract_pnl_from_pages
+
+    Raises:
+        AdmissionTimeout: If the memory for parsing did not become available in time
+    """
+    import pdfplumber  # pylint: disable=import-outside-toplevel
+
+    # Page numbers chosen by the agent may arrive as floats such as 3.0
+    numbers = [int(number) for number in page_numbers
+               if isinstance(number, (int, float)) and float(number).is_integer()]
+    with document.open() as pdf_stream, pdfplumber.open(pdf_stream) as pdf:
+        pages = [pdf.pages[number - 1] for number in dict.fromkeys(numbers)
+                 if 1 <= number <= len(pdf.pages)]
+        estimated_bytes = estimate_text_bytes(
+            [(float(page.width), float(page.height)) for page in pages], document.size
+        )
+        with resource_governor.admit("local_extraction", estimated_bytes, admission_timeout):
+            result = extract_pnl_from_pages(pages)
+    logger.info("Local P&L extraction of pages %s: confidence %.2f",
+                page_numbers, result["confidence"])
+    return result
@@ -0,0 +1,148 @@
+"""
+Prometheus Metrics Module
+
+This module defines the metrics exported by the webhook server on /metrics:
+- Per-stage latency histograms, failures, artifact cache hits and checkpoint resumes
+- Pages scanned by pdfplumber, pages rendered by pdftoppm and rendered image bytes
+- Statement pages predicted from remembered layouts instead of the page-selection agent
+- Local P&L extractions used, or discarded for the vision agent
+- Outcomes of the arithmetic validation of extracted P&L data
+- OpenAI call latency, errors and prompt/completion tokens per agent
+- Jobs in flight and worker memory
+- Jobs queued for and admitted against the memory budget, and their estimated bytes
+
+Metric updates are plain counter increments and histogram observations, so recording
+them adds no measurable time to the pipeline. When the server runs under gunicorn with
+several workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory so that /metrics
+aggregates the values of every worker process.
+"""
+
+from typing import Any, Dict, List, Tuple
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    generate_latest, multiprocess
+)
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Stages range from milliseconds (page ranking) to minutes (large annual reports)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320)
+OPENAI_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+STAGE_DURATION = Histogram(
+    "pnl_stage_duration_seconds", "Duration of pipeline stages", ["stage"],
+    buckets=STAGE_BUCKETS
+)
+STAGE_FAILURES = Counter(
+    "pnl_stage_failures_total", "Pipeline stages that raised an error", ["stage"]
+)
+STAGE_CACHE_HITS = Counter(
+    "pnl_stage_cache_hits_total", "Pipeline stages served from the artifact cache", ["stage"]
+)
+STAGE_RESUMES = Counter(
+    "pnl_stage_resumes_total", "Pipeline stages resumed from a record's checkpoint", ["stage"]
+)
+PAGES_SCANNED = Counter("pnl_pages_scanned_total", "Pages whose text was extracted")
+PAGES_RENDERED = Counter("pnl_pages_rendered_total", "Pages rendered to images")
+IMAGE_BYTES = Counter("pnl_image_bytes_total", "Bytes of rendered page images")
+SPECULATIVE_PAGES = Counter(
+    "pnl_speculative_pages_total",
+    "Pages rendered ahead of page selection, by whether they were selected", ["outcome"]
+)
+LAYOUT_PREDICTIONS = Counter(
+    "pnl_layout_predictions_total",
+    "Statement pages predicted from remembered company layouts, by whether they verified",
+    ["outcome"]
+)
+LOCAL_EXTRACTIONS = Counter(
+    "pnl_local_extractions_total",
+    "Local P&L extractions, by whether they were used or fell back to the vision agent",
+    ["outcome"]
+)
+VALIDATIONS = Counter(
+    "pnl_validations_total",
+    "Arithmetic validations of extracted P&L data, by outcome "
+    "('valid', 'corrected' after reading sections again, or 'invalid')", ["outcome"]
+)
+JOBS_TOTAL = Counter("pnl_jobs_total", "Finished pipeline runs by outcome", ["status"])
+JOBS_IN_FLIGHT = Gauge(
+    "pnl_jobs_in_flight", "Pipeline runs in progress", multiprocess_mode="livesum"
+)
+ADMISSIONS = Counter(
+    "pnl_admissions_total",
+    "Memory-hungry jobs by stage and whether they were admitted immediately, after "
+    "queueing, or timed out", ["stage", "outcome"]
+)
+ADMISSION_WAIT = Histogram(
+    "pnl_admission_wait_seconds", "Time jobs waited for the memory budget", ["stage"],
+    buckets=STAGE_BUCKETS
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "pnl_admission_queue_depth", "Jobs waiting for the memory budget", ["stage"],
+    multiprocess_mode="livesum"
+)
+ADMITTED_BYTES = Gauge(
+    "pnl_admitted_bytes", "Estimated memory of the jobs admitted against the budget",
+    ["stage"], multiprocess_mode="livesum"
+)
+WORKER_MEMORY = Gauge(
+    "pnl_worker_memory_bytes", "Resident memory of the worker process",
+    multiprocess_mode="liveall"
+)
+
+OPENAI_DURATION = Histogram(
+    "pnl_openai_request_duration_seconds",
+    "Duration of OpenAI calls including retries and rate-limiter waits", ["agent"],
+    buckets=OPENAI_BUCKETS
+)
+OPENAI_LIMITER_WAIT = Counter(
+    "pnl_openai_limiter_wait_seconds_total",
+    "Time OpenAI calls spent waiting on rate limiters and backoff", ["agent"]
+)
+OPENAI_TOKENS = Counter(
+    "pnl_openai_tokens_total", "OpenAI tokens used", ["agent", "kind"]
+)
+OPENAI_ERRORS = Counter(
+    "pnl_openai_errors_total", "OpenAI calls that failed permanently", ["agent", "error"]
+)
+
+def current_rss() -> int:
+    """Return the resident set size of this process in bytes, or 0 if unknown."""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def record_images(images: List[str]) -> None:
+    """Count rendered pages and their decoded size from a list of base64 JPEGs."""
+    PAGES_RENDERED.inc(len(images))
+    # Decoded size from the base64 length, without decoding the images
+    IMAGE_BYTES.inc(sum(len(image) * 3 // 4 - image[-2:].count("=") for image in images))
+
+def record_agent_call(agent: str, report: Dict[str, Any]) -> None:
+    """Usage listener for the agent runtime, recording one OpenAI call."""
+    OPENAI_DURATION.labels(agent).observe(report["latency"])
+    OPENAI_LIMITER_WAIT.labels(agent).inc(report["limiter_wait"])
+    OPENAI_TOKENS.labels(agent, "prompt").inc(report["prompt_tokens"])
+    OPENAI_TOKENS.labels(agent, "completion").inc(report["completion_tokens"])
+    if report["error"]:
+        OPENAI_ERRORS.labels(agent, report["error"]).inc()
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Render every metric in the Prometheus text format.
+
+    Returns:
+        Tuple[bytes, str]: The exposition body and its content type
+    """
+    WORKER_MEMORY.set(current_rss())
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,103 @@
+"""
+Page Chunking Module
+This module serializes extracted report pages compactly and splits them into chunks
+that fit a token budget, for prompts that cannot hold a full annual report at once.
+Serialization collapses whitespace and normalizes numbers (thousands separators and
+accounting-style negative amounts), which removes a large share of the tokens of statement
+pages without changing what the model can read from them.
+"""
+
+from typing import Any, Dict, List, Tuple
+import re
+import json
+
+from utils.token_count import CHARS_PER_TOKEN, count_tokens
+
+HORIZONTAL_SPACE_PATTERN = re.compile(r"[ \t\u00a0]+")
+BLANK_LINES_PATTERN = re.compile(r"\n(?:[ \t]*\n)+")
+THOUSANDS_SEPARATOR_PATTERN = re.compile(r"(?<=\d),(?=\d{3}\b)")
+# Only amount-shaped numbers, with thousands separators or decimals, are negated, so note
+# references like "Revenue (12)" and years like "(2023)" are kept as they are
+NEGATIVE_AMOUNT_PATTERN = re.compile(r"\((\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+\.\d+)\)")
+
+def compact_page_text(content: str) -> str:
+    """
+    Normalize page text for prompts.
+
+    Args:
+        content (str): Text extracted from a page
+
+    Returns:
+        str: The text with runs of spaces and blank lines collapsed, thousands
+            separators removed and "(1,234)" written as "-1234"; "(12)" is kept
+    """
+    text = HORIZONTAL_SPACE_PATTERN.sub(" ", content or "")
+    text = "\n".join(line.strip() for line in text.splitlines())
+    text = BLANK_LINES_PATTERN.sub("\n", text)
+    text = NEGATIVE_AMOUNT_PATTERN.sub(r"-\1", text)
+    text = THOUSANDS_SEPARATOR_PATTERN.sub("", text)
+    return text.strip()
+
+def serialize_page(page: Dict[str, Any], max_tokens: int = 0) -> str:
+    """
+    Serialize a page as a compact JSON object.
+
+    Args:
+        page (Dict[str, Any]): Item with "page_number" and "content"
+        max_tokens (int): When positive, content is truncated to roughly this many tokens
+
+    Returns:
+        str: JSON of the page number and its compacted content
+    """
+    content = compact_page_text(page.get("content", ""))
+    if max_tokens > 0 and count_tokens(content) > max_tokens:
+        content = content[:max_tokens * CHARS_PER_TOKEN]
+    return json.dumps({"page_number": page["page_number"], "content": content},
+                      separators=(",", ":"), ensure_ascii=False)
+
+def serialize_pages(pages: List[Dict[str, Any]]) -> str:
+    """Serialize pages as a compact JSON array."""
+    return "[" + ",".join(serialize_page(page) for page in pages) + "]"
+
+def chunk_pages(pages: List[Dict[str, Any]], token_budget: int,
+                overlap: int = 1) -> List[Tuple[List[int], str]]:
+    """
+    Split pages into compact JSON arrays that each fit a token budget.
+
+    Consecutive chunks share `overlap` pages, so a statement that continues across a
+    chunk boundary is seen together with its first page. A single page larger than
+    the budget is truncated.
+
+    Args:
+        pages (List[Dict[str, Any]]): Items with "page_number" and "content"
+        token_budget (int): Maximum tokens of a chunk
+        overlap (int): Number of pages repeated at the start of the next chunk
+
+    Returns:
+        List[Tuple[List[int], str]]: The page numbers and serialized JSON of each chunk
+    """
+    serialized = [
+        (page["page_number"], text, count_tokens(text))
+        for page in pages
+        for text in [serialize_page(page, max_tokens=token_budget)]
+    ]
+
+    chunks: List[Tuple[List[int], str]] = []
+    current: List[Tuple[int, str, int]] = []
+    current_tokens = 0
+    for item in serialized:
+        if current and current_tokens + item[2] > token_budget:
+            chunks.append(([number for number, _, _ in current],
+                           "[" + ",".join(text for _, text, _ in current) + "]"))
+            # Carry the overlap over only while it leaves room for new pages
+            current = current[-overlap:] if overlap > 0 else []
+            current_tokens = sum(tokens for _, _, tokens in current)
+            while current and current_tokens + item[2] > token_budget:
+                current_tokens -= current.pop(0)[2]
+        current.append(item)
+        current_tokens += item[2]
+
+    if current:
+        chunks.append(([number for number, _, _ in current],
+                       "[" + ",".join(text for _, text, _ in current) + "]"))
+    return chunks
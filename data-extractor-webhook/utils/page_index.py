@@ -0,0 +1,218 @@
+"""
+Page Index Module
+This module keeps the text of every extracted report page in a local SQLite FTS5 index,
+so line items can be searched across all processed filings without downloading and
+parsing them again. Pages are stored per record with the company, period and year of
+the report, and search results are ranked by BM25 and come with a highlighted snippet.
+The page text is held in a plain table with an external-content FTS5 index on top, kept
+in sync by triggers, so re-indexing a record only touches that record's rows.
+Example:
+    page_index = get_page_index()
+    page_index.index_report("42", pages, company_name="ABC PLC", period="3 months ended
+        30 September", year="2024")
+    hits = page_index.search("share of profit of equity accounted investees")
+"""
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import os
+import re
+import html
+import time
+import logging
+import sqlite3
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PAGE_INDEX_ENABLED = os.getenv("PAGE_INDEX_ENABLED", "true").lower() == "true"
+PAGE_INDEX_DB_PATH = os.getenv("PAGE_INDEX_DB_PATH", "pages.sqlite3")
+MAX_SEARCH_RESULTS = 100
+# Words of context around the matched terms in a snippet
+SNIPPET_WORDS = 16
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Control characters marking matches in snippets until the text is HTML-escaped; they are
+# removed from page text when it is indexed, so they can only come from snippet()
+MATCH_START, MATCH_END = "\x02", "\x03"
+SENTINEL_PATTERN = re.compile(f"[{MATCH_START}{MATCH_END}]")
+
+def highlight_snippet(snippet: str) -> str:
+    """HTML-escape a snippet and wrap its sentinel-marked matches in <mark>."""
+    return (html.escape(snippet or "")
+            .replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>"))
+
+def build_match_query(query: str, phrase: bool = False) -> str:
+    """
+    Turn user input into an FTS5 match expression, so FTS5 operators in it are not interpreted.
+
+    Args:
+        query (str): Words to search for
+        phrase (bool): Match the words as one phrase instead of anywhere on the page
+
+    Returns:
+        str: The match expression, empty if the query has no words
+    """
+    words = WORD_PATTERN.findall(query.lower())
+    if phrase:
+        return f'"{" ".join(words)}"' if words else ""
+    return " ".join(f'"{word}"' for word in words)
+
+class PageIndex:
+    """
+    SQLite FTS5 index of extracted report pages.
+
+    A new connection is opened per operation so the index can be shared between
+    threads and processes.
+    """
+
+    def __init__(self, db_path: str = PAGE_INDEX_DB_PATH) -> None:
+        self.db_path = db_path
+        with self._connect() as connection:
+            # Searches keep running while a report is being indexed
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    record_id TEXT PRIMARY KEY,
+                    company_name TEXT,
+                    period TEXT,
+                    year TEXT,
+                    pdf_sha256 TEXT,
+                    cse_report_url TEXT,
+                    pages INTEGER NOT NULL,
+                    indexed_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS page_text (
+                    id INTEGER PRIMARY KEY,
+                    record_id TEXT NOT NULL,
+                    page_number INTEGER NOT NULL,
+                    content TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS page_text_record ON page_text (record_id);
+                CREATE VIRTUAL TABLE IF NOT EXISTS page_fts USING fts5(
+                    content, content='page_text', content_rowid='id',
+                    tokenize='porter unicode61'
+                );
+                CREATE TRIGGER IF NOT EXISTS page_text_insert AFTER INSERT ON page_text BEGIN
+                    INSERT INTO page_fts (rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS page_text_delete AFTER DELETE ON page_text BEGIN
+                    INSERT INTO page_fts (page_fts, rowid, content)
+                    VALUES ('delete', old.id, old.content);
+                END;
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection for one transaction, committed on success and then closed."""
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            connection.row_factory = sqlite3.Row
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def index_report(self, record_id: str, pages: List[Dict[str, Any]],
+                     company_name: Optional[str] = None, period: Optional[str] = None,
+                     year: Optional[str] = None, pdf_sha256: Optional[str] = None,
+                     cse_report_url: Optional[str] = None) -> int:
+        """
+        Index the pages of a report, replacing any earlier version of the record.
+
+        Args:
+            record_id (str): The record identifier
+            pages (List[Dict[str, Any]]): Extracted pages, with "page_number" and "content"
+            company_name (Optional[str]): Company that filed the report
+            period (Optional[str]): Reporting period, e.g. "3 months ended 30 September"
+            year (Optional[str]): Year of the reporting period
+            pdf_sha256 (Optional[str]): SHA-256 of the PDF
+            cse_report_url (Optional[str]): URL of the report
+
+        Returns:
+            int: Number of pages indexed
+        """
+        with self._connect() as connection:
+            connection.execute("DELETE FROM page_text WHERE record_id = ?", (record_id,))
+            connection.executemany(
+                "INSERT INTO page_text (record_id, page_number, content) VALUES (?, ?, ?)",
+                [(record_id, page["page_number"], SENTINEL_PATTERN.sub("", page["content"]))
+                 for page in pages]
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO reports (record_id, company_name, period, year, "
+                "pdf_sha256, cse_report_url, pages, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record_id, company_name, period, year, pdf_sha256, cse_report_url,
+                 len(pages), time.time())
+            )
+        logger.info("Indexed %d pages of record %s", len(pages), record_id)
+        return len(pages)
+
+    def search(self, query: str, company: Optional[str] = None, period: Optional[str] = None,
+               year: Optional[str] = None, phrase: bool = False,
+               limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Search the indexed pages.
+
+        Args:
+            query (str): Words to search for; every word must appear on the page
+            company (Optional[str]): Only reports whose company name contains this text
+            period (Optional[str]): Only reports whose period contains this text
+            year (Optional[str]): Only reports of this year
+            phrase (bool): Match the words as one phrase
+            limit (int): Maximum number of hits, capped at MAX_SEARCH_RESULTS
+
+        Returns:
+            List[Dict[str, Any]]: Hits, best first, with "record_id", "company_name",
+                "period", "year", "page_number", "snippet" (HTML-escaped, with matches
+                wrapped in <mark>) and "score" (higher is better)
+
+        Raises:
+            ValueError: If the query has no words to search for
+        """
+        match = build_match_query(query, phrase)
+        if not match:
+            raise ValueError("Search query must contain at least one word")
+
+        sql = (
+            "SELECT page_text.record_id, reports.company_name, reports.period, reports.year, "
+            "page_text.page_number, "
+            f"snippet(page_fts, 0, char(2), char(3), '…', {SNIPPET_WORDS}) AS snippet, "
+            "bm25(page_fts) AS rank "
+            "FROM page_fts "
+            "JOIN page_text ON page_text.id = page_fts.rowid "
+            "JOIN reports ON reports.record_id = page_text.record_id "
+            "WHERE page_fts MATCH ?"
+        )
+        params: List[Any] = [match]
+        for column, value in (("company_name", company), ("period", period)):
+            if value:
+                sql += f" AND reports.{column} LIKE ?"
+                params.append(f"%{value}%")
+        if year:
+            sql += " AND reports.year = ?"
+            params.append(str(year))
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(max(1, min(limit, MAX_SEARCH_RESULTS)))
+
+        with self._connect() as connection:
+            rows = connection.execute(sql, params).fetchall()
+        return [
+            {**{key: row[key] for key in row.keys() if key != "rank"},
+             "snippet": highlight_snippet(row["snippet"]),
+             "score": round(-row["rank"], 3)}
+            for row in rows
+        ]
+
+_page_index: Optional[PageIndex] = None  # pylint: disable=invalid-name
+_page_index_lock = threading.Lock()
+
+def get_page_index() -> PageIndex:
+    """Return the process-wide page index, creating its database on first use."""
+    global _page_index  # pylint: disable=global-statement
+    with _page_index_lock:
+        if _page_index is None:
+            _page_index = PageIndex()
+        return _page_index
@@ -0,0 +1,227 @@
+"""
+Page Ranking Module
+This module scores the pages of an extracted CSE report locally, so that only the pages
+most likely to hold the consolidated income statement are sent to the page-selection agent.
+Pages are scored on statement headers ("STATEMENT OF PROFIT OR LOSS", "Group",
+"Consolidated", "3 months ended", ...), typical P&L row labels and the density of numeric
+table rows. When the best page does not score high enough, the full document is used.
+scan_for_statement works on a lazy page iterator instead and stops reading once it has
+found the statement header page plus its continuation pages.
+Example:
+    filtered_result, stats = prefilter_pdf_text(pdf_text_result)
+    extract_consolidated_income_statement(filtered_result)
+"""
+
+from typing import Any, Dict, Iterable, List, Tuple
+import os
+import re
+import logging
+
+from utils.token_count import count_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PREFILTER_ENABLED = os.getenv("PAGE_PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_TOP_K = int(os.getenv("PAGE_PREFILTER_TOP_K", "4"))
+PREFILTER_MIN_SCORE = float(os.getenv("PAGE_PREFILTER_MIN_SCORE", "6"))
+PREFILTER_NEIGHBOURS = int(os.getenv("PAGE_PREFILTER_NEIGHBOURS", "1"))
+SCAN_LOOKAHEAD = int(os.getenv("PAGE_SCAN_LOOKAHEAD", "2"))
+
+# (pattern, weight) pairs matched case-insensitively against the page text
+HEADER_WEIGHTS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r"statements? of profit or loss"), 5.0),
+    (re.compile(r"income statements?"), 4.0),
+    (re.compile(r"\bconsolidated\b"), 2.0),
+    (re.compile(r"\bgroup\b"), 2.0),
+    (re.compile(r"\b(?:3|three) months? ended\b|\bquarter ended\b"), 2.0),
+    (re.compile(r"\bunaudited\b"), 0.5),
+]
+ROW_LABEL_WEIGHTS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r"\brevenue\b|\bturnover\b"), 0.5),
+    (re.compile(r"\bcost of sales\b"), 0.5),
+    (re.compile(r"\bgross profit\b"), 0.5),
+    (re.compile(r"\bfinance (?:cost|income|expense)s?\b"), 0.5),
+    (re.compile(r"\bprofit before (?:income )?tax"), 0.5),
+    (re.compile(r"\bincome tax\b|\btax expense\b"), 0.5),
+    (re.compile(r"\bearnings per share\b"), 0.5),
+]
+PENALTY_WEIGHTS: List[Tuple[re.Pattern, float]] = [
+    (re.compile(r"statements? of financial position|balance sheet"), -3.0),
+    (re.compile(r"cash flows?"), -3.0),
+    (re.compile(r"changes in equity"), -3.0),
+    (re.compile(r"notes to the (?:interim )?financial statements"), -3.0),
+    (re.compile(r"shareholder information|twenty largest shareholders"), -3.0),
+]
+NUMERIC_DENSITY_WEIGHT = 4.0
+
+STATEMENT_HEADER_PATTERN = re.compile(r"statements? of profit or loss|income statements?")
+# Minimum share of numeric table rows for a page to count as a statement continuation
+CONTINUATION_MIN_DENSITY = 0.3
+
+NUMBER_PATTERN = re.compile(r"\(?-?\d{1,3}(?:,\d{3})+(?:\.\d+)?\)?|\(?-?\d+\.\d+\)?")
+
+def _numeric_density(content: str) -> float:
+    """Return the share of non-empty lines that hold at least two numbers."""
+    lines = [line for line in content.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+    return sum(1 for line in lines if len(NUMBER_PATTERN.findall(line)) >= 2) / len(lines)
+
+def score_page(content: str) -> float:
+    """
+    Score how likely a page is to contain the consolidated income statement.
+
+    Args:
+        content (str): Extracted text of the page
+
+    Returns:
+        float: Higher scores indicate more likely statement pages
+    """
+    text = content.lower()
+    score = 0.0
+    for pattern, weight in HEADER_WEIGHTS + ROW_LABEL_WEIGHTS + PENALTY_WEIGHTS:
+        if pattern.search(text):
+            score += weight
+
+    return score + NUMERIC_DENSITY_WEIGHT * _numeric_density(content)
+
+def rank_pages(pages: List[Dict[str, Any]]) -> List[Tuple[int, float]]:
+    """
+    Rank extracted pages by score, best first.
+
+    Args:
+        pages (List[Dict[str, Any]]): Items with "page_number" and "content"
+
+    Returns:
+        List[Tuple[int, float]]: (page_number, score) pairs sorted by descending score
+    """
+    scored = [(page["page_number"], score_page(page["content"])) for page in pages]
+    return sorted(scored, key=lambda item: (-item[1], item[0]))
+
+def prefilter_pdf_text(
+    pdf_text_result: Dict[str, Any],
+    top_k: int = PREFILTER_TOP_K,
+    min_score: float = PREFILTER_MIN_SCORE,
+    neighbours: int = PREFILTER_NEIGHBOURS
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Keep only the top-ranked candidate pages of an extracted report.
+
+    The top_k pages scoring at least half of min_score are kept, together with up to
+    `neighbours` following pages each, since statements frequently continue on the next
+    page. When the best page scores below min_score the ranking is not trusted and the
+    full document is returned.
+
+    Args:
+        pdf_text_result (Dict[str, Any]): Output of extract_pdf_text_from_url
+        top_k (int): Number of best-scoring pages to keep
+        min_score (float): Minimum score of the best page to trust the ranking
+        neighbours (int): Number of following pages to keep for each candidate
+
+    Returns:
+        Tuple[Dict[str, Any], Dict[str, Any]]: The (possibly filtered) result in the same
+            shape as the input, and statistics including the estimated tokens saved
+    """
+    pages = pdf_text_result.get("data") or []
+    ranking = rank_pages(pages)
+    top_score = ranking[0][1] if ranking else 0.0
+    tokens_full = count_tokens(str(pdf_text_result))
+
+    stats = {
+        "pages_total": len(pages),
+        "pages_sent": len(pages),
+        "top_score": round(top_score, 2),
+        "tokens_full": tokens_full,
+        "tokens_sent": tokens_full,
+        "tokens_saved": 0,
+        "fallback": True,
+    }
+    if not pdf_text_result.get("success") or top_score < min_score:
+        logger.info("Page prefilter confidence too low (top score %.2f), sending full document",
+                    top_score)
+        return pdf_text_result, stats
+
+    available = {page["page_number"] for page in pages}
+    selected = set()
+    for page_number, score in ranking[:top_k]:
+        if score < min_score / 2:
+            break
+        selected.add(page_number)
+        selected.update(
+            page_number + offset for offset in range(1, neighbours + 1)
+            if page_number + offset in available
+        )
+
+    filtered_result = dict(pdf_text_result)
+    filtered_result["data"] = [page for page in pages if page["page_number"] in selected]
+    tokens_sent = count_tokens(str(filtered_result))
+
+    stats.update({
+        "pages_sent": len(filtered_result["data"]),
+        "tokens_sent": tokens_sent,
+        "tokens_saved": tokens_full - tokens_sent,
+        "fallback": False,
+    })
+    logger.info("Page prefilter kept %d of %d pages, saving ~%d of %d tokens",
+                stats["pages_sent"], stats["pages_total"], stats["tokens_saved"], tokens_full)
+    return filtered_result, stats
+
+def _is_continuation(content: str) -> bool:
+    """Return whether a page looks like the continuation of a statement table."""
+    text = content.lower()
+    if any(pattern.search(text) for pattern, _ in PENALTY_WEIGHTS):
+        return False
+    return _numeric_density(content) >= CONTINUATION_MIN_DENSITY
+
+def scan_for_statement(
+    pages: Iterable[Dict[str, Any]],
+    lookahead: int = SCAN_LOOKAHEAD,
+    min_score: float = PREFILTER_MIN_SCORE
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Read pages until the consolidated statement header and its continuation are found.
+
+    Pages are consumed lazily. Once a page with a statement header scores at least
+    min_score, up to `lookahead` following pages are read, and scanning stops at the
+    first one that does not look like a continuation of the table. If no header page is
+    found, every page is read.
+
+    Args:
+        pages (Iterable[Dict[str, Any]]): Items with "page_number" and "content",
+            typically from iter_pdf_pages
+        lookahead (int): Maximum number of pages to read after the header page
+        min_score (float): Minimum score of the header page
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Dict[str, Any]]: Every page read so far, and
+            statistics with the number of pages scanned and whether the header was found
+    """
+    scanned: List[Dict[str, Any]] = []
+    header_page = None
+    remaining = lookahead
+
+    for page in pages:
+        scanned.append(page)
+        if header_page is None:
+            content = page["content"]
+            if (STATEMENT_HEADER_PATTERN.search(content.lower())
+                    and score_page(content) >= min_score):
+                header_page = page["page_number"]
+                if remaining <= 0:
+                    break
+            continue
+
+        remaining -= 1
+        if not _is_continuation(page["content"]) or remaining <= 0:
+            break
+
+    stats = {
+        "pages_scanned": len(scanned),
+        "header_page": header_page,
+        "found": header_page is not None,
+    }
+    if header_page is not None:
+        logger.info("Found statement header on page %d after scanning %d pages",
+                    header_page, len(scanned))
+    return scanned, stats
@@ -0,0 +1,163 @@
+"""
+Shared PDF Document Module
+This module provides a single in-process representation of a downloaded PDF so that
+every pipeline stage (text extraction, page rendering, ...) works on the same bytes
+instead of downloading the report again.
+The document is streamed in chunks straight into a temporary file, with a configurable
+size limit and a SHA-256 computed while the bytes arrive, so the PDF is never held in
+memory as a whole. Readers get memory maps of that file (for pdfplumber) or its path
+(for pdftoppm and worker processes), so no stage makes its own copy of the content.
+Example:
+    with fetch_pdf_document("https://example.com/sample.pdf") as document:
+        text_result = extract_pdf_text_from_url(document)
+        images = extract_page_images_from_pdf(document, [3])
+"""
+
+from typing import Optional, Union
+import os
+import mmap
+import hashlib
+import logging
+import tempfile
+
+import requests
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+MAX_PDF_BYTES = int(os.getenv("PDF_MAX_DOWNLOAD_MB", "200")) * 1024 * 1024
+
+
+class PDFTooLargeError(ValueError):
+    """Raised when a PDF exceeds the configured download size limit."""
+
+
+class PDFDocument:
+    """
+    A PDF fetched once and shared across pipeline stages.
+
+    Attributes:
+        source_url (str): URL the document was downloaded from
+        size (int): Size of the document in bytes
+        sha256 (str): Hex SHA-256 of the document content
+    """
+
+    def __init__(self, path: str, size: int, sha256: str, source_url: str = "") -> None:
+        self._path: Optional[str] = path
+        self.size = size
+        self.sha256 = sha256
+        self.source_url = source_url
+
+    @classmethod
+    def from_bytes(cls, content: bytes, source_url: str = "") -> "PDFDocument":
+        """Wrap already downloaded PDF bytes in a shared document."""
+        handle, path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(content)
+        return cls(path, len(content), hashlib.sha256(content).hexdigest(), source_url)
+
+    def open(self) -> mmap.mmap:
+        """
+        Return an independent read-only memory map of the document.
+
+        Each call returns a new map with its own position, so concurrent stages do
+        not interfere. The pages are shared through the OS page cache rather than
+        copied into the process.
+        """
+        with open(self.as_path(), 'rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_bytes(self) -> bytes:
+        """Return the full document content."""
+        with open(self.as_path(), 'rb') as file:
+            return file.read()
+
+    def as_path(self) -> str:
+        """
+        Return the filesystem path of the document.
+
+        External tools such as pdftoppm and worker processes read the document
+        directly from this path.
+        """
+        if self._path is None:
+            raise ValueError("PDF document has been closed")
+        return self._path
+
+    def close(self) -> None:
+        """Remove the temporary file holding the document."""
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError as e:
+                logger.warning("Failed to remove temporary PDF %s: %s", self._path, e)
+            self._path = None
+
+    def __enter__(self) -> "PDFDocument":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def fetch_pdf_document(pdf_url: str, timeout: int = DOWNLOAD_TIMEOUT,
+                       max_bytes: int = MAX_PDF_BYTES) -> PDFDocument:
+    """
+    Stream a PDF to a temporary file once and return it as a shared document.
+
+    Args:
+        pdf_url (str): The URL of the PDF document
+        timeout (int): Request timeout in seconds
+        max_bytes (int): Maximum accepted size of the document in bytes
+
+    Returns:
+        PDFDocument: The downloaded document
+
+    Raises:
+        ValueError: If the URL is empty or the downloaded document is empty
+        PDFTooLargeError: If the document is larger than max_bytes
+        requests.exceptions.RequestException: If the download fails
+    """
+    if not pdf_url:
+        raise ValueError("PDF URL cannot be empty")
+
+    logger.info("Downloading PDF from: %s", pdf_url)
+    with requests.get(pdf_url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+
+        content_length = int(response.headers.get('Content-Length') or 0)
+        if content_length > max_bytes:
+            raise PDFTooLargeError(
+                f"PDF is {content_length} bytes, exceeding the {max_bytes} byte limit"
+            )
+
+        digest = hashlib.sha256()
+        size = 0
+        handle, path = tempfile.mkstemp(suffix='.pdf')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise PDFTooLargeError(
+                            f"PDF exceeds the {max_bytes} byte download limit"
+                        )
+                    digest.update(chunk)
+                    file.write(chunk)
+            if size == 0:
+                raise ValueError("Downloaded PDF is empty")
+        except BaseException:
+            os.remove(path)
+            raise
+
+    document = PDFDocument(path, size, digest.hexdigest(), pdf_url)
+    logger.info("Downloaded PDF (%d bytes, sha256 %s)", size, document.sha256[:12])
+    return document
+
+
+def resolve_pdf_document(pdf_source: Union[str, PDFDocument]) -> PDFDocument:
+    """Return the given document, or fetch it when a URL is passed."""
+    if isinstance(pdf_source, PDFDocument):
+        return pdf_source
+    return fetch_pdf_document(pdf_source)
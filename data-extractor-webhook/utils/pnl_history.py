@@ -0,0 +1,481 @@
+"""
+P&L History Module
+This module keeps the extracted P&L of every report as normalized line items, so the
+history of a company and of its peers can be queried without reading the reports again:
+- Row labels are normalized to canonical line items ("Turnover" and "Revenue" are both
+  `revenue`), other labels to a slug of their words
+- Amounts are scaled to currency units ("LKR '000" becomes LKR), except per-share figures
+- Periods are keyed by the month they end in and their length in months
+Filings are stored in SQLite, one row per line item, and shared by every server process
+on the host. For queries, each process holds the line items as NumPy columns (company,
+period, length, item, value), appending the filings recorded since its last query and
+dropping the line items of replaced filings. Time series, quarter-over-quarter changes
+and peer aggregates are computed with vectorized operations over those columns.
+Classes:
+    PnLHistory: SQLite-backed store of normalized P&L line items with columnar queries
+"""
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import os
+import re
+import time
+import logging
+import sqlite3
+import threading
+
+import numpy as np
+
+from utils.layout_memory import company_key
+from utils.local_pnl_extractor import CURRENCY_PATTERNS, PERIOD_PATTERN, SCALE_PATTERNS
+from utils.pnl_validator import PER_SHARE_PATTERN
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PNL_HISTORY_ENABLED = os.getenv("PNL_HISTORY_ENABLED", "true").lower() == "true"
+PNL_HISTORY_DB_PATH = os.getenv("PNL_HISTORY_DB_PATH", "history.sqlite3")
+
+MONTH_NAMES = ("jan", "feb", "mar", "apr", "may", "jun",
+               "jul", "aug", "sep", "oct", "nov", "dec")
+MONTH_WORDS = {"three": 3, "six": 6, "nine": 9, "twelve": 12}
+SCALES = {"'000": 1e3, "Mn": 1e6}
+DATE_PATTERN = re.compile(r"\b\d{1,2}[./-](\d{1,2})[./-](\d{2,4})\b")
+YEAR_PATTERN = re.compile(r"\b(?:19|20)\d{2}\b")
+
+# Canonical line items, tried in order; the first matching pattern names the item
+LINE_ITEMS: List[Tuple[str, re.Pattern]] = [
+    (name, re.compile(pattern)) for name, pattern in (
+        ("basic_eps", r"^basic .*per share|^earnings per share|^basic eps"),
+        ("diluted_eps", r"^diluted .*per share|^diluted eps"),
+        ("revenue", r"^(?:revenue|turnover|sales)\b(?! tax)"),
+        ("cost_of_sales", r"^cost of (?:sales|revenue)"),
+        ("gross_profit", r"^gross (?:profit|loss)"),
+        ("other_income", r"^other (?:operating )?income"),
+        ("distribution_expenses", r"^(?:selling and )?distribution (?:costs|expenses)"),
+        ("administrative_expenses", r"^administrative (?:costs|expenses)"),
+        ("other_expenses", r"^other (?:operating )?expenses"),
+        ("operating_profit", r"^(?:results? from operating activities|operating profit)"),
+        ("finance_income", r"^finance income"),
+        ("finance_costs", r"^finance (?:costs|expenses)"),
+        ("net_finance_costs", r"^net finance (?:costs|income|expenses)"),
+        ("share_of_equity_accounted_investees",
+         r"^share of (?:net )?(?:profits?|results?).*(?:equity accounted|associates|joint)"),
+        ("profit_before_tax", r"^(?:profit|loss)(?: loss)? before (?:income )?tax"),
+        ("income_tax", r"^(?:income tax|tax expense|taxation)"),
+        ("profit_for_the_period", r"^(?:profit|loss)(?: loss)? for the (?:period|quarter|year)"),
+    )
+]
+
+def normalize_label(label: str) -> str:
+    """
+    Return the canonical line item of a row label.
+
+    Args:
+        label (str): Row label as printed in the statement
+
+    Returns:
+        str: A canonical item such as "revenue", or the label's words joined by "_"
+    """
+    text = " ".join(re.sub(r"\(\s*loss\s*\)|/\s*\(?loss\)?", " loss ", label.lower())
+                    .replace("-", " ").replace("&", " and ").split())
+    text = " ".join(re.sub(r"[^a-z0-9 ]+", " ", text).split())
+    for name, pattern in LINE_ITEMS:
+        if pattern.search(text):
+            return name
+    return "_".join(text.split())[:64]
+
+def parse_period(period: str, year: Optional[str] = None) -> Optional[Tuple[int, int]]:
+    """
+    Parse a reporting period into the month it ends in and its length.
+
+    Args:
+        period (str): Period as extracted, e.g. "3 months ended 30 September"
+        year (Optional[str]): Year of the period, when not part of `period`
+
+    Returns:
+        Optional[Tuple[int, int]]: (year * 12 + month - 1, months), or None when the
+            end month or year cannot be read
+    """
+    text = f"{period or ''} {year or ''}"
+    match = PERIOD_PATTERN.search(text)
+    if match is None:
+        return None
+    months_text = (match.group("months") or "").lower()
+    if match.group("quarter"):
+        months = 3
+    elif months_text:
+        months = MONTH_WORDS.get(months_text) or int(months_text)
+    else:
+        months = 12
+
+    date = DATE_PATTERN.search(text)
+    if date:
+        month = int(date.group(1))
+        end_year = int(date.group(2)) + (2000 if len(date.group(2)) == 2 else 0)
+    else:
+        lowered = text.lower()
+        month = next((index + 1 for index, name in enumerate(MONTH_NAMES)
+                      if re.search(rf"\b{name}[a-z]*\b", lowered)), 0)
+        years = YEAR_PATTERN.findall(text)
+        end_year = int(years[0]) if years else 0
+    if not 1 <= month <= 12 or not end_year:
+        return None
+    return end_year * 12 + month - 1, months
+
+def format_period(period: int) -> str:
+    """Format a period index as "YYYY-MM"."""
+    return f"{period // 12:04d}-{period % 12 + 1:02d}"
+
+def _parse_period_key(value: str) -> int:
+    year, month = value.split("-")
+    if not 1 <= int(month) <= 12:
+        raise ValueError(f"Invalid month: {month}")
+    return int(year) * 12 + int(month) - 1
+
+class _Columns:
+    """Line items of every filing as NumPy columns, with the vocabularies they encode."""
+
+    def __init__(self) -> None:
+        self.last_id = 0
+        self.last_removal = 0
+        self.id = np.empty(0, dtype=np.int64)
+        self.company = np.empty(0, dtype=np.int32)
+        self.period = np.empty(0, dtype=np.int32)
+        self.months = np.empty(0, dtype=np.int8)
+        self.item = np.empty(0, dtype=np.int32)
+        self.value = np.empty(0, dtype=np.float64)
+        self.currency = np.empty(0, dtype=np.int16)
+        self.record = np.empty(0, dtype=object)
+        self.companies: Dict[str, int] = {}
+        self.company_names: Dict[int, str] = {}
+        self.items: Dict[str, int] = {}
+        self.currencies: Dict[str, int] = {}
+
+    @staticmethod
+    def _encode(vocabulary: Dict[str, int], keys: Tuple[str, ...]) -> List[int]:
+        return [vocabulary.setdefault(key, len(vocabulary)) for key in keys]
+
+    def append(self, rows: List[Tuple[Any, ...]]) -> None:
+        """Append line items read from the store, oldest first."""
+        if not rows:
+            return
+        ids, records, items, values, keys, names, periods, months, currencies = zip(*rows)
+        companies = self._encode(self.companies, keys)
+        self.company_names.update(zip(companies, names))
+        self.id = np.concatenate([self.id, np.array(ids, dtype=np.int64)])
+        self.company = np.concatenate([self.company, np.array(companies, dtype=np.int32)])
+        self.period = np.concatenate([self.period, np.array(periods, dtype=np.int32)])
+        self.months = np.concatenate([self.months, np.array(months, dtype=np.int8)])
+        self.item = np.concatenate(
+            [self.item, np.array(self._encode(self.items, items), dtype=np.int32)])
+        self.value = np.concatenate([self.value, np.array(values, dtype=np.float64)])
+        self.currency = np.concatenate([self.currency, np.array(
+            self._encode(self.currencies, currencies), dtype=np.int16)])
+        self.record = np.concatenate([self.record, np.array(records, dtype=object)])
+        self.last_id = ids[-1]
+
+    def remove(self, ranges: List[Tuple[int, int]]) -> None:
+        """Drop the line items whose ids fall in any of the (first, last) ranges."""
+        removed = np.zeros(self.id.size, dtype=bool)
+        for first, last in ranges:
+            removed |= (self.id >= first) & (self.id <= last)
+        if removed.any():
+            kept = ~removed
+            for name in ("id", "company", "period", "months", "item", "value", "currency",
+                         "record"):
+                setattr(self, name, getattr(self, name)[kept])
+
+class PnLHistory:
+    """
+    SQLite-backed store of normalized P&L line items, queried through NumPy columns.
+
+    A new connection is opened per operation so the store can be shared between
+    threads and processes.
+    """
+
+    def __init__(self, db_path: str = PNL_HISTORY_DB_PATH) -> None:
+        self.db_path = db_path
+        self._columns = _Columns()
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS filings (
+                    record_id TEXT PRIMARY KEY,
+                    company_key TEXT NOT NULL,
+                    company_name TEXT NOT NULL,
+                    period INTEGER NOT NULL,
+                    months INTEGER NOT NULL,
+                    currency TEXT NOT NULL,
+                    recorded_at REAL NOT NULL,
+                    UNIQUE (company_key, period, months)
+                );
+                CREATE TABLE IF NOT EXISTS line_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    record_id TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    label TEXT NOT NULL,
+                    value REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS line_items_record ON line_items (record_id);
+                -- Line items deleted by a replaced filing, so readers drop them too
+                CREATE TABLE IF NOT EXISTS removals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    first_item INTEGER NOT NULL,
+                    last_item INTEGER NOT NULL
+                );
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection for one transaction, committed on success and then closed."""
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            connection.row_factory = sqlite3.Row
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, record_id: str, company_name: str,
+               final_data: Dict[str, Any]) -> Optional[int]:
+        """
+        Store the line items of an extracted P&L, replacing an earlier filing of the
+        record or of the same company and period.
+
+        Args:
+            record_id (str): The record identifier
+            company_name (str): Company that filed the report
+            final_data (Dict[str, Any]): The extracted data in the financial_report schema
+
+        Returns:
+            Optional[int]: Number of line items stored, or None when the company or
+                period could not be identified
+        """
+        key = company_key(company_name or "")
+        period = parse_period(final_data.get("period", ""), final_data.get("year"))
+        if not key or period is None:
+            logger.info("Not recording the history of record %s: unknown company or period",
+                        record_id)
+            return None
+
+        currency_text = final_data.get("currency") or ""
+        currency = next((code for pattern, code in CURRENCY_PATTERNS
+                         if pattern.search(currency_text)), "")
+        scale = next((SCALES[label] for pattern, label in SCALE_PATTERNS
+                      if pattern.search(currency_text)), 1.0)
+        items: Dict[str, Tuple[str, float]] = {}
+        for section in final_data.get("sections") or []:
+            for field in section.get("fields") or []:
+                label, value = str(field.get("label", "")), field.get("value")
+                if not label or not isinstance(value, (int, float)):
+                    continue
+                factor = 1.0 if PER_SHARE_PATTERN.search(label) else scale
+                # The first row wins, so a company column read later does not replace it
+                items.setdefault(normalize_label(label), (label, float(value) * factor))
+
+        with self._connect() as connection:
+            replaced = connection.execute(
+                "SELECT record_id FROM filings WHERE record_id = ? "
+                "OR (company_key = ? AND period = ? AND months = ?)",
+                (record_id, key, period[0], period[1])
+            ).fetchall()
+            if replaced:
+                ids = [row["record_id"] for row in replaced]
+                marks = ", ".join("?" for _ in ids)
+                # The line items of a filing are inserted together, so their ids are adjacent
+                connection.execute(
+                    "INSERT INTO removals (first_item, last_item) SELECT MIN(id), MAX(id) "
+                    f"FROM line_items WHERE record_id IN ({marks}) GROUP BY record_id", ids
+                )
+                connection.execute(f"DELETE FROM filings WHERE record_id IN ({marks})", ids)
+                connection.execute(f"DELETE FROM line_items WHERE record_id IN ({marks})", ids)
+            connection.execute(
+                "INSERT INTO filings (record_id, company_key, company_name, period, months, "
+                "currency, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record_id, key, company_name, period[0], period[1], currency, time.time())
+            )
+            connection.executemany(
+                "INSERT INTO line_items (record_id, item, label, value) VALUES (?, ?, ?, ?)",
+                [(record_id, item, label, value) for item, (label, value) in items.items()]
+            )
+        logger.info("Recorded %d line items of %s for %s", len(items), company_name,
+                    format_period(period[0]))
+        return len(items)
+
+    def _refresh(self) -> _Columns:
+        """
+        Return the columns, with the filings recorded by any process since the last query.
+
+        Callers hold the lock while they read the columns.
+        """
+        with self._connect() as connection:
+            columns = self._columns
+            # Read the removals and the new line items from one snapshot
+            connection.execute("BEGIN")
+            removals = connection.execute(
+                "SELECT id, first_item, last_item FROM removals WHERE id > ? ORDER BY id",
+                (columns.last_removal,)
+            ).fetchall()
+            cursor = connection.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(
+                "SELECT line_items.id, line_items.record_id, line_items.item, "
+                "line_items.value, filings.company_key, filings.company_name, "
+                "filings.period, filings.months, filings.currency "
+                "FROM line_items JOIN filings ON filings.record_id = line_items.record_id "
+                "WHERE line_items.id > ? ORDER BY line_items.id",
+                (columns.last_id,)
+            ).fetchall()
+            if removals:
+                columns.remove([(row["first_item"], row["last_item"]) for row in removals])
+                columns.last_removal = removals[-1]["id"]
+            columns.append(rows)
+            return columns
+
+    def _select(self, columns: _Columns, company: str, item: str,
+                months: int) -> Optional[np.ndarray]:
+        company_code = columns.companies.get(company_key(company))
+        item_code = columns.items.get(normalize_label(item))
+        if company_code is None or item_code is None:
+            return None
+        selected = np.flatnonzero((columns.company == company_code)
+                                  & (columns.item == item_code) & (columns.months == months))
+        return selected[np.argsort(columns.period[selected], kind="stable")]
+
+    def series(self, company: str, item: str, months: int = 3) -> Optional[Dict[str, Any]]:
+        """
+        Return the time series of a line item of a company.
+
+        Args:
+            company (str): Company name, in any case and with or without "PLC"
+            item (str): Canonical line item or a row label, e.g. "revenue" or "Turnover"
+            months (int): Length of the periods, 3 for quarters
+
+        Returns:
+            Optional[Dict[str, Any]]: The "company_name", "item" and "points" (each with
+                "period", "value", "currency" and "record_id"), oldest first, or None if
+                the company or item is unknown
+        """
+        with self._lock:
+            columns = self._refresh()
+            selected = self._select(columns, company, item, months)
+            if selected is None:
+                return None
+            currencies = list(columns.currencies)
+            return {
+                "company_name": columns.company_names[columns.companies[company_key(company)]],
+                "item": normalize_label(item),
+                "points": [
+                    {"period": format_period(int(period)), "value": float(value),
+                     "currency": currencies[currency], "record_id": columns.record[index]}
+                    for index, period, value, currency in zip(
+                        selected.tolist(), columns.period[selected], columns.value[selected],
+                        columns.currency[selected].tolist())
+                ],
+            }
+
+    def quarter_changes(self, company: str, item: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the quarter-over-quarter changes of a line item of a company.
+
+        Args:
+            company (str): Company name, in any case and with or without "PLC"
+            item (str): Canonical line item or a row label
+
+        Returns:
+            Optional[Dict[str, Any]]: The "company_name", "item" and "changes" (each with
+                "period", "value", "previous", "change" and "change_pct"), for quarters
+                that directly follow a recorded quarter in the same currency, or None if
+                the company or item is unknown
+        """
+        with self._lock:
+            columns = self._refresh()
+            selected = self._select(columns, company, item, 3)
+            if selected is None:
+                return None
+            periods, values = columns.period[selected], columns.value[selected]
+            currencies = columns.currency[selected]
+            following = np.flatnonzero((np.diff(periods) == 3)
+                                       & (currencies[1:] == currencies[:-1])) + 1
+            current, previous = values[following], values[following - 1]
+            change = current - previous
+            with np.errstate(divide="ignore", invalid="ignore"):
+                change_pct = np.where(previous != 0, change / np.abs(previous) * 100, np.nan)
+            return {
+                "company_name": columns.company_names[columns.companies[company_key(company)]],
+                "item": normalize_label(item),
+                "changes": [
+                    {"period": format_period(int(period)), "value": float(value),
+                     "previous": float(before), "change": float(delta),
+                     "change_pct": None if np.isnan(pct) else round(float(pct), 2)}
+                    for period, value, before, delta, pct in zip(
+                        periods[following], current, previous, change, change_pct)
+                ],
+            }
+
+    def peers(self, item: str, period: str, months: int = 3, currency: str = "LKR",
+              company: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Aggregate a line item across every company that filed for a period.
+
+        Args:
+            item (str): Canonical line item or a row label
+            period (str): Month the period ends in, as "YYYY-MM"
+            months (int): Length of the period, 3 for quarters
+            currency (str): Only filings in this currency
+            company (Optional[str]): Company to place among its peers
+
+        Returns:
+            Dict[str, Any]: "count", "sum", "mean", "median", "p25", "p75", "min" and
+                "max" of the item, plus the company's "value" and "percentile" when
+                `company` is given and filed for the period
+
+        Raises:
+            ValueError: If the period is not formatted as "YYYY-MM"
+        """
+        try:
+            period_key = _parse_period_key(period)
+        except ValueError as e:
+            raise ValueError("period must be formatted as YYYY-MM") from e
+
+        with self._lock:
+            columns = self._refresh()
+            result: Dict[str, Any] = {"item": normalize_label(item), "period": period,
+                                      "months": months, "currency": currency, "count": 0}
+            item_code = columns.items.get(result["item"])
+            currency_code = columns.currencies.get(currency)
+            if item_code is None or currency_code is None:
+                return result
+            mask = ((columns.item == item_code) & (columns.period == period_key)
+                    & (columns.months == months) & (columns.currency == currency_code))
+            values = columns.value[mask]
+            if not values.size:
+                return result
+
+            p25, median, p75 = np.percentile(values, [25, 50, 75])
+            result.update({
+                "count": int(values.size), "sum": float(values.sum()),
+                "mean": float(values.mean()), "median": float(median),
+                "p25": float(p25), "p75": float(p75),
+                "min": float(values.min()), "max": float(values.max()),
+            })
+            company_code = columns.companies.get(company_key(company)) if company else None
+            if company_code is not None:
+                own = columns.value[mask & (columns.company == company_code)]
+                if own.size:
+                    result["value"] = float(own[0])
+                    result["percentile"] = round(float((values <= own[0]).mean() * 100), 1)
+            return result
+
+_pnl_history: Optional[PnLHistory] = None  # pylint: disable=invalid-name
+_pnl_history_lock = threading.Lock()
+
+def get_pnl_history() -> PnLHistory:
+    """Return the process-wide P&L history, creating its database on first use."""
+    global _pnl_history  # pylint: disable=global-statement
+    with _pnl_history_lock:
+        if _pnl_history is None:
+            _pnl_history = PnLHistory()
+        return _pnl_history
@@ -0,0 +1,193 @@
+"""
+P&L Validation Module
+This module checks extracted P&L data for arithmetic consistency before it is turned into
+a report, working on the sections/fields structure of the financial_report schema:
+- Subtotal rows equal the rows above them
+- Gross profit equals revenue plus cost of sales
+- Profit for the period equals profit before tax plus income tax
+Each failed check names the sections holding the inconsistent rows, so that only those
+sections need to be read again.
+Example:
+    verdict = validate_pnl(final_data)
+    if not verdict["valid"]:
+        sections_to_read_again = verdict["failed_sections"]
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+
+# Bump whenever the checks change, to invalidate cached validations
+VALIDATOR_VERSION = "1"
+
+PNL_VALIDATION_ENABLED = os.getenv("PNL_VALIDATION_ENABLED", "true").lower() == "true"
+# Failed sections read again per report; the rest are reported as they are
+PNL_VALIDATION_MAX_REQUERIES = int(os.getenv("PNL_VALIDATION_MAX_REQUERIES", "2"))
+
+SUBTOTAL_LABEL_PATTERN = re.compile(
+    r"^(?:gross profit|total\b|net\b|profit|loss|results? from operating|operating profit)",
+    re.IGNORECASE
+)
+# Per-share figures are often bold but are never the sum of the rows above them
+PER_SHARE_PATTERN = re.compile(r"per share|\beps\b", re.IGNORECASE)
+
+# (result, first term, second term) of the identities every P&L satisfies
+IDENTITIES: List[Tuple[str, re.Pattern, re.Pattern, re.Pattern]] = [
+    (
+        "gross_profit",
+        re.compile(r"^gross (?:profit|loss)", re.IGNORECASE),
+        re.compile(r"^(?:revenue|turnover)\b", re.IGNORECASE),
+        re.compile(r"^cost of (?:sales|revenue)", re.IGNORECASE),
+    ),
+    (
+        "profit_for_the_period",
+        re.compile(r"^(?:profit|loss)(?:/\(?loss\)?)? for the (?:period|quarter|year)",
+                   re.IGNORECASE),
+        re.compile(r"^(?:profit|loss)(?:/\(?loss\)?)? before (?:income )?tax", re.IGNORECASE),
+        re.compile(r"income tax|tax expense|taxation", re.IGNORECASE),
+    ),
+]
+
+def reconciles(expected: float, actual: float) -> bool:
+    """Return True if two amounts agree up to rounding of the individual rows."""
+    return abs(expected - actual) <= max(2.0, abs(expected) * 0.001)
+
+def _is_subtotal(field: Dict[str, Any], any_bold: bool) -> bool:
+    if PER_SHARE_PATTERN.search(field["label"]):
+        return False
+    return bool(field["bold"]) if any_bold else bool(SUBTOTAL_LABEL_PATTERN.match(field["label"]))
+
+def check_subtotals(fields: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Check that subtotal rows equal the rows above them.
+
+    Subtotals are the bold rows, or rows labelled like one ("Gross profit", "Total
+    ...") when nothing is bold. Walking up from a subtotal, rows are added until the sum
+    matches. A subtotal that matched stands for the rows it covers, so "Profit before
+    tax" can equal "Results from operating activities" plus "Net finance costs" without
+    counting the finance rows twice.
+
+    Args:
+        fields (List[Dict[str, Any]]): Fields with "label", "value" and "bold", in order
+
+    Returns:
+        List[Dict[str, Any]]: For each subtotal checked, its "index" in fields, "label"
+            and whether it "reconciled"
+    """
+    any_bold = any(field["bold"] for field in fields)
+    starts: Dict[int, int] = {}
+    results = []
+    for index, field in enumerate(fields):
+        if index < 2 or not _is_subtotal(field, any_bold):
+            continue
+        total, terms, position = 0.0, 0, index - 1
+        reconciled = False
+        while position >= 0:
+            total += fields[position]["value"]
+            terms += 1
+            position = starts.get(position, position) - 1
+            # A single row above is a repeated figure, not a sum
+            if terms >= 2 and reconciles(field["value"], total):
+                starts[index] = position + 1
+                reconciled = True
+                break
+        results.append({"index": index, "label": field["label"], "reconciled": reconciled})
+    return results
+
+def _find(fields: List[Dict[str, Any]], pattern: re.Pattern, after: int = -1) -> Optional[int]:
+    return next((index for index, field in enumerate(fields)
+                 if index > after and pattern.search(field["label"])), None)
+
+def check_identities(fields: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Check the P&L identities whose rows are all present.
+
+    Costs and taxes are accepted both as negative amounts and as positive amounts that
+    are subtracted, since statements use either convention.
+
+    Returns:
+        List[Dict[str, Any]]: For each identity checked, its "check" name, the "indexes"
+            of its rows, the "expected" and "actual" result and whether it "reconciled"
+    """
+    results = []
+    for name, result_pattern, first_pattern, second_pattern in IDENTITIES:
+        first = _find(fields, first_pattern)
+        second = _find(fields, second_pattern, after=first) if first is not None else None
+        result = _find(fields, result_pattern, after=second) if second is not None else None
+        if result is None:
+            continue
+        first_value, second_value = fields[first]["value"], fields[second]["value"]
+        actual = fields[result]["value"]
+        candidates = (first_value + second_value, first_value - abs(second_value))
+        expected = next((value for value in candidates if reconciles(value, actual)),
+                        candidates[0])
+        results.append({
+            "check": name,
+            "indexes": [first, second, result],
+            "expected": expected,
+            "actual": actual,
+            "reconciled": reconciles(expected, actual),
+        })
+    return results
+
+def validate_pnl(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate the arithmetic of extracted P&L data.
+
+    Args:
+        data (Dict[str, Any]): Data in the financial_report schema
+
+    Returns:
+        Dict[str, Any]: The verdict, with "valid", the "checks" run (each with its
+            "check", "label", "section" and "passed") and the titles of the
+            "failed_sections", in statement order
+    """
+    fields: List[Dict[str, Any]] = []
+    sections: List[str] = []
+    for section in data.get("sections") or []:
+        for field in section.get("fields") or []:
+            if isinstance(field.get("value"), (int, float)):
+                fields.append({"label": str(field.get("label", "")), "value": field["value"],
+                               "bold": bool(field.get("bold"))})
+                sections.append(section.get("title", ""))
+
+    checks = [
+        {"check": "subtotal", "label": result["label"], "section": sections[result["index"]],
+         "passed": result["reconciled"]}
+        for result in check_subtotals(fields)
+    ]
+    failed_sections = [check["section"] for check in checks if not check["passed"]]
+    for result in check_identities(fields):
+        result_index = result["indexes"][-1]
+        checks.append({
+            "check": result["check"],
+            "label": fields[result_index]["label"],
+            "section": sections[result_index],
+            "passed": result["reconciled"],
+            "expected": result["expected"],
+            "actual": result["actual"],
+        })
+        if not result["reconciled"]:
+            failed_sections.extend(sections[index] for index in result["indexes"])
+
+    ordered = [title for title in dict.fromkeys(sections) if title in failed_sections]
+    return {
+        "valid": not ordered,
+        "checks": checks,
+        "failed_sections": ordered,
+    }
+
+def failed_checks(verdict: Dict[str, Any], section: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Return the checks of a verdict that failed, optionally only for one section."""
+    return [check for check in verdict["checks"]
+            if not check["passed"] and (section is None or check["section"] == section)]
+
+def replace_section_fields(data: Dict[str, Any], title: str,
+                           fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Return a copy of the data with the fields of the first section titled `title` replaced."""
+    sections = list(data.get("sections") or [])
+    for position, section in enumerate(sections):
+        if section.get("title") == title:
+            sections[position] = {**section, "fields": fields}
+            break
+    return {**data, "sections": sections}
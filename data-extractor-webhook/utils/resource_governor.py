@@ -0,0 +1,288 @@
+"""
+Resource Governor Module
+
+This module limits how much memory the rendering and pdfplumber stages use at once,
+so a burst of filings queues instead of getting the container OOM-killed:
+- Each job estimates its memory before it starts: from the page sizes and render DPI
+  for pdftoppm, and from the page count, page sizes and document size for pdfplumber
+- A job is admitted while the estimates of the admitted jobs fit in the memory budget,
+  otherwise it waits in a first-come, first-served queue
+- A job larger than the whole budget is admitted alone rather than rejected
+
+Reservations are kept in a JSON file guarded by an fcntl lock, so the budget is shared by
+every gunicorn worker and job thread on the host. Reservations of a process that died
+are dropped, so a crashed worker never holds memory it no longer uses. The budget is
+MEMORY_BUDGET_MB, or half of the container memory limit when that is not set.
+
+Example:
+    with resource_governor.admit("image_extraction", estimate_render_bytes(pages, 4)):
+        ...
+"""
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+import tempfile
+import threading
+
+from utils.metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT, ADMISSIONS, ADMITTED_BYTES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Memory the governor falls back to when neither a budget nor a container limit is known
+DEFAULT_MEMORY_BUDGET_MB = 2048
+
+RESOURCE_GOVERNOR_ENABLED = os.getenv("RESOURCE_GOVERNOR_ENABLED", "true").lower() == "true"
+RESOURCE_GOVERNOR_DIR = os.getenv(
+    "RESOURCE_GOVERNOR_DIR", os.path.join(tempfile.gettempdir(), "pnl-resource-governor")
+)
+# How long a job waits for memory before it fails
+ADMISSION_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_TIMEOUT_SECONDS", "600"))
+# Longest pause between checks for memory released by other processes
+ADMISSION_POLL_SECONDS = 0.5
+
+# pdftoppm holds the page bitmap while it renders and encodes it, plus its own baseline
+RENDER_BYTES_PER_PIXEL = 4
+RENDER_PROCESS_BYTES = 32 * MB
+# pdfplumber's parsed objects of a dense A4 statement page, released when it is closed
+PDFPLUMBER_PAGE_BYTES = int(float(os.getenv("PDFPLUMBER_PAGE_MB", "4")) * MB)
+# The parsed document (cross-reference table, fonts, page tree) per byte of PDF
+PDFPLUMBER_BYTES_PER_PDF_BYTE = 4
+# A spawned text extraction worker, with Python and pdfplumber imported
+EXTRACTION_WORKER_BYTES = 48 * MB
+A4_AREA_PT = 595 * 842
+
+class AdmissionTimeout(TimeoutError):
+    """Raised when a job waits longer than the admission timeout for memory."""
+
+def container_memory_limit() -> Optional[int]:
+    """Return the memory limit of the container's cgroup in bytes, or None if unlimited."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path, "r", encoding="utf-8") as limit_file:
+                value = limit_file.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "unlimited" as a number close to the largest 64-bit value
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+        return None
+    return None
+
+def default_memory_budget() -> int:
+    """Return MEMORY_BUDGET_MB, or half of the container limit, in bytes."""
+    configured = os.getenv("MEMORY_BUDGET_MB")
+    if configured:
+        return int(float(configured) * MB)
+    limit = container_memory_limit()
+    return limit // 2 if limit else DEFAULT_MEMORY_BUDGET_MB * MB
+
+def estimate_render_bytes(pages: Sequence[Tuple[float, float, int]], threads: int) -> int:
+    """
+    Estimate the peak memory of rendering pages with pdftoppm.
+
+    Args:
+        pages (Sequence[Tuple[float, float, int]]): Width and height in points and the
+            render DPI of each page
+        threads (int): Pages rendered at the same time
+
+    Returns:
+        int: Estimated bytes
+    """
+    if not pages:
+        return 0
+    pixels = sorted((width * dpi / 72) * (height * dpi / 72) for width, height, dpi in pages)
+    concurrent = max(1, min(threads, len(pixels)))
+    return int(sum(RENDER_PROCESS_BYTES + RENDER_BYTES_PER_PIXEL * pixel_count
+                   for pixel_count in pixels[-concurrent:]))
+
+def estimate_text_bytes(page_sizes: Sequence[Tuple[float, float]], pdf_bytes: int,
+                        workers: int = 1) -> int:
+    """
+    Estimate the peak memory of extracting text with pdfplumber, one page at a time.
+
+    Args:
+        page_sizes (Sequence[Tuple[float, float]]): Width and height in points of the
+            pages, or empty when they are not known yet (A4 is assumed)
+        pdf_bytes (int): Size of the PDF
+        workers (int): Processes extracting pages in parallel; 1 for the calling process
+
+    Returns:
+        int: Estimated bytes
+    """
+    largest_area = max((width * height for width, height in page_sizes), default=A4_AREA_PT)
+    per_process = (PDFPLUMBER_BYTES_PER_PDF_BYTE * pdf_bytes
+                   + PDFPLUMBER_PAGE_BYTES * max(1.0, largest_area / A4_AREA_PT))
+    if workers <= 1:
+        return int(per_process)
+    # The calling process keeps the document open while the workers parse their own copies
+    return int(PDFPLUMBER_BYTES_PER_PDF_BYTE * pdf_bytes
+               + workers * (EXTRACTION_WORKER_BYTES + per_process))
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ResourceGovernor:
+    """Admission control of memory-hungry jobs against a budget shared across processes."""
+
+    def __init__(self, budget_bytes: Optional[int] = None,
+                 state_dir: str = RESOURCE_GOVERNOR_DIR,
+                 timeout: float = ADMISSION_TIMEOUT_SECONDS,
+                 enabled: bool = RESOURCE_GOVERNOR_ENABLED) -> None:
+        self.budget_bytes = budget_bytes if budget_bytes is not None else default_memory_budget()
+        self.timeout = timeout
+        self.enabled = enabled
+        self.state_dir = state_dir
+        self._state_path = os.path.join(state_dir, "reservations.json")
+        self._lock_path = os.path.join(state_dir, "reservations.lock")
+        # Wakes this process's waiters as soon as one of its jobs releases memory
+        self._released = threading.Condition()
+        os.makedirs(state_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked_state(self) -> Iterator[List[Dict[str, Any]]]:
+        """Hold the cross-process lock and yield the reservations, saving changes to them."""
+        handle = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                with open(self._state_path, "r", encoding="utf-8") as state_file:
+                    reservations = json.load(state_file)
+            except (OSError, ValueError):
+                reservations = []
+            state = [dict(entry) for entry in reservations if _process_alive(entry["pid"])]
+            yield state
+            if state != reservations:
+                temporary_path = f"{self._state_path}.{os.getpid()}.tmp"
+                with open(temporary_path, "w", encoding="utf-8") as state_file:
+                    json.dump(state, state_file)
+                os.replace(temporary_path, self._state_path)
+        finally:
+            os.close(handle)
+
+    def _try_admit(self, entry: Dict[str, Any]) -> bool:
+        """Queue the entry if it is new and admit it if it is first in line and fits."""
+        with self._locked_state() as state:
+            current = next((other for other in state if other["id"] == entry["id"]), None)
+            if current is None:
+                current = dict(entry)
+                state.append(current)
+            if current["admitted"]:
+                return True
+            admitted_bytes = sum(other["bytes"] for other in state if other["admitted"])
+            first_waiter = next(other for other in state if not other["admitted"])
+            fits = admitted_bytes + current["bytes"] <= self.budget_bytes
+            if first_waiter["id"] == current["id"] and (fits or admitted_bytes == 0):
+                current["admitted"] = True
+                return True
+            return False
+
+    def _remove(self, entry_id: str) -> None:
+        with self._locked_state() as state:
+            state[:] = [entry for entry in state if entry["id"] != entry_id]
+        with self._released:
+            self._released.notify_all()
+
+    @contextmanager
+    def admit(self, stage: str, estimated_bytes: int,
+              timeout: Optional[float] = None) -> Iterator[float]:
+        """
+        Wait until a job's estimated memory fits in the budget, and hold it for the job.
+
+        Args:
+            stage (str): Stage the job belongs to, for logs and metrics
+            estimated_bytes (int): Estimated peak memory of the job
+            timeout (Optional[float]): Seconds to wait for memory; the governor's timeout
+                when None, a single attempt when 0
+
+        Yields:
+            float: Seconds the job waited in the queue
+
+        Raises:
+            AdmissionTimeout: If the memory did not become available within the timeout
+        """
+        if not self.enabled:
+            yield 0.0
+            return
+
+        estimated_bytes = max(0, int(estimated_bytes))
+        if estimated_bytes > self.budget_bytes:
+            logger.warning("%s needs an estimated %d MB, more than the %d MB budget; "
+                           "it will run alone", stage, estimated_bytes // MB,
+                           self.budget_bytes // MB)
+        entry = {"id": uuid.uuid4().hex, "pid": os.getpid(), "stage": stage,
+                 "bytes": estimated_bytes, "admitted": False, "queued_at": time.time()}
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        poll = 0.01
+        queued = False
+        try:
+            while not self._try_admit(entry):
+                waited = time.monotonic() - started
+                if waited >= timeout:
+                    ADMISSIONS.labels(stage, "timed_out").inc()
+                    raise AdmissionTimeout(
+                        f"{stage} waited {waited:.0f}s for {estimated_bytes // MB} MB of the "
+                        f"{self.budget_bytes // MB} MB memory budget"
+                    )
+                if not queued:
+                    queued = True
+                    ADMISSION_QUEUE_DEPTH.labels(stage).inc()
+                    logger.info("Queued %s for %d MB of memory", stage, estimated_bytes // MB)
+                with self._released:
+                    self._released.wait(min(poll, timeout - waited))
+                poll = min(poll * 2, ADMISSION_POLL_SECONDS)
+        except BaseException:
+            self._remove(entry["id"])
+            raise
+        finally:
+            if queued:
+                ADMISSION_QUEUE_DEPTH.labels(stage).dec()
+
+        waited = time.monotonic() - started
+        ADMISSIONS.labels(stage, "queued" if queued else "immediate").inc()
+        ADMISSION_WAIT.labels(stage).observe(waited)
+        ADMITTED_BYTES.labels(stage).inc(estimated_bytes)
+        try:
+            yield waited
+        finally:
+            ADMITTED_BYTES.labels(stage).dec(estimated_bytes)
+            self._remove(entry["id"])
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Return the budget and the admitted and queued jobs of every process.
+
+        Returns:
+            Dict[str, Any]: "enabled", "budget_bytes", "admitted_bytes", "queued_bytes",
+                and the "admitted" and "queued" jobs with their stage, pid and bytes
+        """
+        with self._locked_state() as state:
+            entries = list(state)
+        jobs = {
+            key: [{name: entry[name] for name in ("stage", "pid", "bytes", "queued_at")}
+                  for entry in entries if entry["admitted"] == admitted]
+            for key, admitted in (("admitted", True), ("queued", False))
+        }
+        return {
+            "enabled": self.enabled,
+            "budget_bytes": self.budget_bytes,
+            "admitted_bytes": sum(job["bytes"] for job in jobs["admitted"]),
+            "queued_bytes": sum(job["bytes"] for job in jobs["queued"]),
+            **jobs,
+        }
+
+resource_governor = ResourceGovernor()
@@ -0,0 +1,179 @@
+"""
+Single-Flight Module
+
+This module makes sure concurrent requests for the same work run it only once:
+- Within a process, callers of the same key wait for the first caller and share its
+  result or error
+- Across gunicorn workers, an fcntl lock file per key serializes the callers, and the
+  result of the first caller is written next to it for the callers that waited
+
+Results shared across processes must be JSON-serializable. Locks are released by the
+operating system when a process dies, so a crashed worker never blocks a key.
+
+Example:
+    result, shared = single_flight.do(f"record:{record_id}", run_pipeline)
+
+    with single_flight.lock(f"pdf:{document.sha256}"):
+        ...
+"""
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_DIR = os.getenv(
+    "SINGLE_FLIGHT_DIR", os.path.join(tempfile.gettempdir(), "pnl-single-flight")
+)
+# How long a finished result is offered to callers from other processes
+SINGLE_FLIGHT_RESULT_TTL = int(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "600"))
+
+class _Call:
+    """An in-flight call whose outcome is shared with duplicate callers."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """In-process and cross-process coalescing of calls with the same key."""
+
+    def __init__(self, lock_dir: str = SINGLE_FLIGHT_DIR,
+                 result_ttl: int = SINGLE_FLIGHT_RESULT_TTL) -> None:
+        self.lock_dir = lock_dir
+        self.result_ttl = result_ttl
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.lock_dir, f"{digest}{suffix}")
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[bool]:
+        """
+        Hold the cross-process lock of a key.
+
+        Yields:
+            bool: True if another holder had to be waited for
+        """
+        path = self._path(key, ".lock")
+        waited = False
+        while True:
+            handle = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                waited = True
+                logger.info("Waiting for in-flight work on %s", key)
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            # The previous holder may have removed the file while we waited for it
+            try:
+                if os.fstat(handle).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(handle)
+
+        try:
+            yield waited
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            os.close(handle)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn once for all concurrent callers with the same key.
+
+        Args:
+            key (str): Identity of the work, e.g. "record:<id>"
+            fn (Callable[[], Any]): The work; its result must be JSON-serializable
+
+        Returns:
+            Tuple[Any, bool]: The result, and whether it came from another caller
+
+        Raises:
+            Any error raised by fn, also for callers in the same process that waited for it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            logger.info("Attaching to in-flight work on %s", key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        shared = False
+        try:
+            started = time.time()
+            with self.lock(key) as waited:
+                result = self._read_result(key, started) if waited else None
+                if result is not None:
+                    shared = True
+                else:
+                    result = fn()
+                    self._write_result(key, result)
+            call.result = result
+            return result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _read_result(self, key: str, since: float) -> Any:
+        """Return the result written by another process after `since`, if any."""
+        path = self._path(key, ".json")
+        try:
+            if os.path.getmtime(path) < since:
+                return None
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _write_result(self, key: str, result: Any) -> None:
+        """Offer a result to callers in other processes that are waiting on the key."""
+        try:
+            handle, tmp_path = tempfile.mkstemp(dir=self.lock_dir, suffix=".tmp")
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                json.dump(result, file)
+            os.replace(tmp_path, self._path(key, ".json"))
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Failed to store single-flight result for %s: %s", key, e)
+        self._prune_results()
+
+    def _prune_results(self) -> None:
+        """Remove results that are too old to be offered to anyone."""
+        cutoff = time.time() - self.result_ttl
+        try:
+            with os.scandir(self.lock_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith((".json", ".tmp")) and \
+                            entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        except OSError:
+            pass
+
+single_flight = SingleFlight()
@@ -0,0 +1,53 @@
+"""
+Worker Start-up Module
+This module lists the heavy dependencies that the server imports on first use rather than
+at import (openai, reportlab, the Supabase SDK and pdfplumber), and preloads them on
+demand. Under gunicorn, the master process calls preload_heavy_modules() before forking,
+so every worker starts with them already in memory and none pays for them on its first
+request. Without the preload, a worker only imports what its requests use.
+"""
+
+from typing import Dict, Tuple
+import time
+import logging
+import importlib
+
+from utils.token_count import count_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES: Tuple[str, ...] = (
+    "openai",
+    "reportlab.platypus",
+    "supabase",
+    "pdfplumber",
+)
+
+def preload_heavy_modules() -> Dict[str, float]:
+    """
+    Import the heavy dependencies and load the tokenizer ahead of the first request.
+
+    Clients are not created here: the OpenAI and Supabase clients hold connections that
+    must not be shared between forked workers, so each worker creates its own on first use.
+
+    Returns:
+        Dict[str, float]: Seconds spent per module; modules that are not installed are skipped
+    """
+    timings: Dict[str, float] = {}
+    for name in HEAVY_MODULES:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Skipping preload of %s: %s", name, e)
+            continue
+        timings[name] = round(time.perf_counter() - started, 4)
+
+    # The first count loads the tiktoken encoding, when tiktoken is installed
+    started = time.perf_counter()
+    count_tokens("preload")
+    timings["tokenizer"] = round(time.perf_counter() - started, 4)
+
+    logger.info("Preloaded heavy modules in %.2fs: %s", sum(timings.values()), timings)
+    return timings
@@ -0,0 +1,187 @@
+"""
+Statement Image Preparation Module
+This module shrinks statement page images to what the vision model needs to read
+the table:
+- Locates the statement table from pdfplumber word and line bounding boxes, or only
+  the part of it down to a given section
+- Plans a pdftoppm render of only that region, in grayscale, at the resolution that fits
+  it to the model's 512px tile grid, so pdftoppm writes the final JPEG itself
+Tile counts are reported next to that of the full page, which is known from the page size
+without rendering it.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import math
+
+from utils.page_ranker import NUMBER_PATTERN, STATEMENT_HEADER_PATTERN
+
+BBox = Tuple[float, float, float, float]
+
+# Statement rows carry at least a current and a comparative amount
+MIN_AMOUNTS_PER_ROW = 2
+# Space kept above the first row for the title and column headers, in PDF points
+HEADER_ALLOWANCE_PT = 90
+CROP_MARGIN_PT = 12
+LINE_TOLERANCE_PT = 3
+# Leading characters of a row label compared when looking for the rows of a section
+SECTION_LABEL_PREFIX = 24
+
+# gpt-4o (detail "high") bills images per 512px tile
+VISION_TILE_PX = 512
+# Shrink images by up to this fraction to save a row or column of tiles
+TILE_SNAP_TOLERANCE = 0.1
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "80"))
+
+def _text_lines(words: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Group pdfplumber words into lines with their text and bounding box."""
+    lines: List[Dict[str, Any]] = []
+    for word in sorted(words, key=lambda item: (item["top"], item["x0"])):
+        if lines and abs(word["top"] - lines[-1]["top"]) <= LINE_TOLERANCE_PT:
+            line = lines[-1]
+            line["text"] += " " + word["text"]
+            line["x0"] = min(line["x0"], word["x0"])
+            line["x1"] = max(line["x1"], word["x1"])
+            line["bottom"] = max(line["bottom"], word["bottom"])
+        else:
+            lines.append({key: word[key] for key in ("text", "x0", "x1", "top", "bottom")})
+    return lines
+
+def find_statement_bbox(page: Any) -> Optional[BBox]:
+    """
+    Locate the statement table on a page.
+
+    The table spans the rows carrying amounts, extended up to the statement title
+    (or a fixed allowance for the column headers) and across any ruling lines drawn
+    alongside the rows.
+
+    Args:
+        page (pdfplumber.page.Page): The page to inspect
+
+    Returns:
+        Optional[BBox]: (x0, top, x1, bottom) in PDF points, or None if the page has
+            no rows with amounts
+    """
+    lines = _text_lines(page.extract_words(keep_blank_chars=False, use_text_flow=False))
+    rows = [line for line in lines
+            if len(NUMBER_PATTERN.findall(line["text"])) >= MIN_AMOUNTS_PER_ROW]
+    if not rows:
+        return None
+
+    top, bottom = rows[0]["top"], rows[-1]["bottom"]
+    headers = [line["top"] for line in lines
+               if line["top"] < top and STATEMENT_HEADER_PATTERN.search(line["text"].lower())]
+    top = headers[-1] if headers else max(0.0, top - HEADER_ALLOWANCE_PT)
+
+    region = [line for line in lines if top <= line["top"] <= bottom]
+    x0 = min(line["x0"] for line in region)
+    x1 = max(line["x1"] for line in region)
+    for ruling in list(page.lines) + list(page.rects):
+        if ruling["bottom"] >= top and ruling["top"] <= bottom:
+            x0, x1 = min(x0, ruling["x0"]), max(x1, ruling["x1"])
+
+    # Never cut through a line of text at the top or bottom edge
+    top, bottom = top - CROP_MARGIN_PT, bottom + CROP_MARGIN_PT
+    for line in lines:
+        if line["top"] < top < line["bottom"]:
+            top = line["top"] - 1
+        if line["top"] < bottom < line["bottom"]:
+            bottom = line["bottom"] + 1
+
+    return (
+        max(0.0, x0 - CROP_MARGIN_PT),
+        max(0.0, top),
+        min(float(page.width), x1 + CROP_MARGIN_PT),
+        min(float(page.height), bottom),
+    )
+
+def _normalize_label(text: str) -> str:
+    return " ".join(text.lower().split())[:SECTION_LABEL_PREFIX]
+
+def find_section_bbox(page: Any, labels: List[str]) -> Optional[BBox]:
+    """
+    Locate the statement table from its column headings down to the last row of a section.
+
+    Args:
+        page (pdfplumber.page.Page): The page to inspect
+        labels (List[str]): Labels of the rows of the section
+
+    Returns:
+        Optional[BBox]: (x0, top, x1, bottom) in PDF points; the whole table when no row
+            of the section is found, or None if the page has no rows with amounts
+    """
+    bbox = find_statement_bbox(page)
+    if bbox is None:
+        return None
+    wanted = [_normalize_label(label) for label in labels if label.strip()]
+    lines = _text_lines(page.extract_words(keep_blank_chars=False, use_text_flow=False))
+    bottoms = [line["bottom"] for line in lines
+               if bbox[1] <= line["top"] <= bbox[3]
+               and any(_normalize_label(line["text"]).startswith(label) for label in wanted)]
+    if not bottoms:
+        return bbox
+    return bbox[0], bbox[1], bbox[2], min(bbox[3], max(bottoms) + CROP_MARGIN_PT)
+
+def _snap_to_tiles(width: int, height: int) -> Tuple[int, int]:
+    """Shrink a size slightly when that saves a row or column of vision tiles."""
+    scale = 1.0
+    for side in (width, height):
+        overshoot = side % VISION_TILE_PX
+        if side > VISION_TILE_PX and 0 < overshoot <= side * TILE_SNAP_TOLERANCE:
+            scale = min(scale, (side - overshoot) / side)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def vision_tiles(width: int, height: int) -> int:
+    """Return the number of 512px tiles the vision model bills for an image."""
+    return math.ceil(width / VISION_TILE_PX) * math.ceil(height / VISION_TILE_PX)
+
+def plan_statement_render(
+    bbox: Optional[BBox],
+    page_size: Tuple[float, float],
+    dpi: int,
+    short_side_px: int,
+    max_side_px: int
+) -> Dict[str, Any]:
+    """
+    Plan how pdftoppm renders a page's statement region straight to its final size.
+
+    The crop keeps the resolution the model would see the table at on the full page,
+    so legibility is unchanged while the image covers fewer tiles. Instead of rendering
+    the page and resizing the crop, the region is rendered at the resolution that
+    already gives its final size, so no image has to be decoded and encoded again.
+
+    Args:
+        bbox (Optional[BBox]): Statement region in PDF points, or None to keep the page
+        page_size (Tuple[float, float]): Page width and height in PDF points
+        dpi (int): DPI the full page would be rendered at
+        short_side_px (int): Target size of the shortest image side in pixels
+        max_side_px (int): Upper bound for the longest image side in pixels
+
+    Returns:
+        Dict[str, Any]: "resolution" (horizontal and vertical DPI) and "region" (x, y,
+            width and height in pixels at that resolution) for pdftoppm, and "stats"
+            with the tile count and size next to the tile count of the full page
+    """
+    page_width, page_height = page_size
+    x0, top, x1, bottom = bbox if bbox is not None else (0.0, 0.0, page_width, page_height)
+    region_width_pt, region_height_pt = max(1.0, x1 - x0), max(1.0, bottom - top)
+    ratio = dpi / 72
+    original_size = (round(page_width * ratio), round(page_height * ratio))
+
+    cropped_width, cropped_height = region_width_pt * ratio, region_height_pt * ratio
+    fit = min(1.0, short_side_px / min(cropped_width, cropped_height),
+              max_side_px / max(cropped_width, cropped_height))
+    width, height = _snap_to_tiles(round(cropped_width * fit), round(cropped_height * fit))
+    resolution_x = width * 72 / region_width_pt
+    resolution_y = height * 72 / region_height_pt
+
+    return {
+        "resolution": (resolution_x, resolution_y),
+        "region": (round(x0 * resolution_x / 72), round(top * resolution_y / 72), width, height),
+        "stats": {
+            "cropped": bbox is not None,
+            "original_tiles": vision_tiles(*original_size),
+            "prepared_tiles": vision_tiles(width, height),
+            "size": [width, height],
+        },
+    }
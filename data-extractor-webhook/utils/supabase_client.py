@@ -1,12 +1,18 @@
 """
 Module for initializing and managing Supabase client connection.
+The client is created on first use rather than at import, so server workers start without
+importing the Supabase SDK or connecting, and a missing configuration only fails the
+operations that need the database or storage.
 """
 
 import os
-from typing import Optional
-from supabase import Client, create_client
+import threading
+from typing import TYPE_CHECKING, Optional
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from supabase import Client
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -14,9 +20,27 @@ load_dotenv()
 SUPABASE_URL: Optional[str] = os.getenv("SUPABASE_URL")
 SUPABASE_KEY: Optional[str] = os.getenv("SUPABASE_KEY")
 
-# Validate environment variables
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Missing required environment variables: SUPABASE_URL or SUPABASE_KEY")
+_client: Optional["Client"] = None  # pylint: disable=invalid-name
+_client_lock = threading.Lock()
+
+def get_supabase() -> "Client":
+    """
+    Return the process-wide Supabase client, creating it on first use.
+
+    Returns:
+        Client: The Supabase client
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    Raises:
+        ValueError: If SUPABASE_URL or SUPABASE_KEY is missing
+    """
+    global _client  # pylint: disable=global-statement
+    with _client_lock:
+        if _client is None:
+            # Validate environment variables
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                raise ValueError(
+                    "Missing required environment variables: SUPABASE_URL or SUPABASE_KEY"
+                )
+            from supabase import create_client  # pylint: disable=import-outside-toplevel
+            _client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        return _client
@@ -0,0 +1,57 @@
+"""
+Token Counting Module
+This module estimates how many model tokens a piece of text costs, locally and without
+calling the OpenAI API. It uses tiktoken, which is a dependency of the service. Should
+tiktoken be missing or unable to load its encoding, it falls back to a pessimistic
+characters-per-token heuristic, so token budgets are overestimated rather than exceeded.
+"""
+
+from functools import lru_cache
+from typing import Any, Optional
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TOKEN_MODEL = "gpt-4o"
+# Average characters per token for English financial text with the o200k encoding
+CHARS_PER_TOKEN = 4
+# Used without tiktoken: statement pages are mostly amounts, which split into tokens of at
+# most three digits, so prose's four characters per token would undercount them
+FALLBACK_CHARS_PER_TOKEN = 3
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> Optional[Any]:
+    """Return the tiktoken encoding for TOKEN_MODEL, or None if tiktoken is unavailable."""
+    try:
+        import tiktoken  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        logger.warning("tiktoken is not installed, estimating token counts from text length")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(TOKEN_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # pylint: disable=broad-except
+        # The encoding is downloaded on first use, which fails on hosts without access
+        logger.warning("Failed to load the tiktoken encoding, estimating token counts "
+                       "from text length: %s", e)
+        return None
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens in a text for TOKEN_MODEL.
+
+    Args:
+        text (str): The text to measure
+
+    Returns:
+        int: Exact token count with tiktoken, otherwise a pessimistic estimate
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // FALLBACK_CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
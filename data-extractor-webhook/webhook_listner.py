@@ -1,118 +1,304 @@
 """
 Webhook listener for processing CSE reports and generating PnL statements.
 This module handles incoming webhooks, processes PDF reports, and updates the database with results.
+Reports are processed inside the request by default; with WEBHOOK_MODE=async they are queued
+for background workers and their progress is exposed through the /jobs endpoints.
+The text of every processed report is indexed and can be searched through /search.
 """
 
-import json
+import os
+import time
 import logging
-from typing import Tuple
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from flask import Flask, request, jsonify
 from flask.wrappers import Response
 
-from utils.extract_pdf_text_from_url import extract_pdf_text_from_url
-from utils.extract_page_images_from_pdf import extract_page_images_from_pdf
-from utils.create_pnl_pdf_report import create_pnl_pdf_report
-# pylint: disable=import-error
-from utils.supabase_client import supabase
-
-from agents.extract_consolidated_income_statement import extract_consolidated_income_statement
-from agents.pnl_data_extractor import pnl_data_extractor
+from report_pipeline import PIPELINE_ERRORS, run_report_pipeline, update_record_status
+from agents.runtime import runtime
+from utils.artifact_cache import artifact_cache
+from utils.job_queue import JobQueue, get_job_store
+from utils.metrics import render_metrics
+from utils.page_index import get_page_index
+from utils.pnl_history import get_pnl_history
+from utils.resource_governor import resource_governor
+from utils.single_flight import single_flight
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 'sync' processes reports inside the request, 'async' queues them for background workers
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync")
+
 app = Flask(__name__)
 
-def update_record_status(record_id: str, status: str, pl_report_url: str = None) -> None:
-    """
-    Update the status and PL report URL in the database.
-    
-    Args:
-        record_id (str): The record identifier
-        status (str): Status to update ('success' or 'error')
-        pl_report_url (str, optional): URL of the generated PL report
-    """
+def _process_job(record_id: str, cse_report_url: str,
+                 on_stage: Callable[[str, str], None]) -> Dict[str, Any]:
+    """Run the pipeline for a queued job, marking the record as failed on any error."""
     try:
-        update_data = {'status': status}
-        if pl_report_url:
-            update_data['pl_report'] = pl_report_url
+        result, _ = single_flight.do(
+            f"record:{record_id}",
+            lambda: run_report_pipeline(record_id, cse_report_url, on_stage, get_job_store())
+        )
+        return result
+    except Exception:
+        update_record_status(record_id, 'error')
+        raise
+
+_job_queue: Optional[JobQueue] = None  # pylint: disable=invalid-name
+_job_queue_lock = threading.Lock()
 
-        supabase.table('table').update(update_data).eq('id', record_id).execute()
-    except (ValueError, TypeError, ConnectionError) as e:
-        logger.error("Failed to update record status: %s", e)
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, creating the job database on first use."""
+    global _job_queue  # pylint: disable=global-statement
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(_process_job, get_job_store())
+        return _job_queue
+
+def recover_jobs() -> int:
+    """Queue the async jobs of server processes that died, in this process."""
+    if WEBHOOK_MODE != "async":
+        return 0
+    return get_job_queue().recover()
 
 @app.route('/webhook', methods=['POST'])
 def process_cse_report() -> Tuple[Response, int]:
     """
     Process incoming CSE reports and generate PnL statements.
-    
+
     Returns:
         tuple: JSON response and HTTP status code
     """
-    try:
-        webhook_data = request.json
-        record_id = webhook_data['record']['id']
-        cse_report_url = webhook_data['record']['cse_report']
-
-        logger.info("Processing CSE report for record ID: %s", record_id)
-
-        # Extract PDF text
-        pdf_text_result = extract_pdf_text_from_url(cse_report_url)
+    webhook_data = request.get_json(silent=True) or {}
+    record = webhook_data.get('record') or {}
+    record_id = record.get('id')
+    cse_report_url = record.get('cse_report')
 
-        # Process consolidated income statement
-        relevant_pages = json.loads(extract_consolidated_income_statement(pdf_text_result))
-
-        if not relevant_pages or relevant_pages.get("status") != "relevant":
-            logger.info("No relevant pages found for record ID: %s", record_id)
-            update_record_status(record_id, 'error')
-            return jsonify({"status": "not_relevant", "message": "No relevant pages found"}), 200
-
-        # Extract images from relevant pages
-        page_numbers = relevant_pages.get("page_numbers")
-        company_name = relevant_pages.get("company_name")
+    if not record_id or not cse_report_url:
+        return jsonify({
+            "status": "error",
+            "message": "Payload must contain record.id and record.cse_report"
+        }), 400
 
-        consolidate_statement_snapshots = extract_page_images_from_pdf(
-            cse_report_url,
-            page_numbers
-        )
+    if WEBHOOK_MODE == "async":
+        queued = get_job_queue().enqueue(record_id, cse_report_url)
+        return jsonify({
+            "status": "queued",
+            "message": "PnL report generation queued" if queued else
+                       "PnL report generation already in progress",
+            "job_url": f"/jobs/{record_id}"
+        }), 202
 
-        # Extract relevant content
-        extracted_content = [
-            item["content"] for item in pdf_text_result['data']
-            if item["page_number"] in page_numbers
-        ]
-
-        # Generate final report
-        final_data = json.loads(pnl_data_extractor(
-            consolidate_statement_snapshots,
-            extracted_content
-        ))
-
-        report_filename = "output-report.pdf"
-        uploaded_url = create_pnl_pdf_report(
-            final_data,
-            report_filename,
-            company_name
+    try:
+        # Retried or duplicate webhooks for a record share the result of the first one
+        result, _ = single_flight.do(
+            f"record:{record_id}",
+            lambda: run_report_pipeline(record_id, cse_report_url, checkpoints=get_job_store())
         )
 
-        # Update record with success status
-        update_record_status(record_id, 'success', uploaded_url)
+        if result["status"] == "not_relevant":
+            return jsonify({"status": "not_relevant", "message": "No relevant pages found"}), 200
 
         return jsonify({
             "status": "success",
-            "message": "PnL report generated successfully"
+            "message": "PnL report generated successfully",
+            "page_selection": result.get("page_selection"),
+            "validation": result.get("validation")
         }), 200
 
-    except (json.JSONDecodeError, ValueError, IOError, ConnectionError) as e:
+    except PIPELINE_ERRORS as e:
         logger.error("Error processing webhook: %s", str(e))
-        if 'record_id' in locals():
-            update_record_status(record_id, 'error')
+        update_record_status(record_id, 'error')
         return jsonify({
             "status": "error",
             "message": "Failed to process report"
         }), 500
 
+@app.route('/jobs', methods=['GET'])
+def list_jobs() -> Tuple[Response, int]:
+    """
+    List the most recently updated jobs.
+
+    Query parameters:
+        status (str, optional): Only return jobs with this status
+        limit (int, optional): Maximum number of jobs to return (default 50)
+
+    Returns:
+        tuple: JSON response and HTTP status code
+    """
+    status = request.args.get('status')
+    limit = request.args.get('limit', default=50, type=int)
+    return jsonify({"jobs": get_job_store().list(status=status, limit=limit)}), 200
+
+@app.route('/jobs/<record_id>', methods=['GET'])
+def get_job(record_id: str) -> Tuple[Response, int]:
+    """
+    Report the status and per-stage progress of a queued job.
+
+    Returns:
+        tuple: JSON response and HTTP status code
+    """
+    job = get_job_store().get(record_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/search', methods=['GET'])
+def search_pages() -> Tuple[Response, int]:
+    """
+    Search the text of every indexed report page.
+
+    Query parameters:
+        q (str): Words to search for; every word must appear on the page
+        phrase (bool, optional): Match the words as one phrase (default false)
+        company (str, optional): Only reports whose company name contains this text
+        period (str, optional): Only reports whose period contains this text
+        year (str, optional): Only reports of this year
+        limit (int, optional): Maximum number of hits to return (default 20, at most 100)
+
+    Returns:
+        tuple: JSON response with ranked hits and their snippets, and HTTP status code
+    """
+    started = time.perf_counter()
+    try:
+        hits = get_page_index().search(
+            request.args.get('q', ''),
+            company=request.args.get('company'),
+            period=request.args.get('period'),
+            year=request.args.get('year'),
+            phrase=request.args.get('phrase', '').lower() in ('1', 'true', 'yes'),
+            limit=request.args.get('limit', default=20, type=int)
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({
+        "hits": hits,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }), 200
+
+@app.route('/history/<company>/series', methods=['GET'])
+def get_history_series(company: str) -> Tuple[Response, int]:
+    """
+    Return the recorded values of a line item of a company, oldest period first.
+
+    Query parameters:
+        item (str): Canonical line item or row label, e.g. "revenue" or "Turnover"
+        months (int, optional): Length of the periods (default 3 for quarters)
+
+    Returns:
+        tuple: JSON response and HTTP status code
+    """
+    item = request.args.get('item', '')
+    if not item:
+        return jsonify({"status": "error", "message": "item is required"}), 400
+    started = time.perf_counter()
+    series = get_pnl_history().series(company, item,
+                                      months=request.args.get('months', default=3, type=int))
+    if series is None:
+        return jsonify({"status": "error", "message": "Company or item not found"}), 404
+    series["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(series), 200
+
+@app.route('/history/<company>/qoq', methods=['GET'])
+def get_history_qoq(company: str) -> Tuple[Response, int]:
+    """
+    Return the quarter-over-quarter changes of a line item of a company.
+
+    Query parameters:
+        item (str): Canonical line item or row label
+
+    Returns:
+        tuple: JSON response and HTTP status code
+    """
+    item = request.args.get('item', '')
+    if not item:
+        return jsonify({"status": "error", "message": "item is required"}), 400
+    started = time.perf_counter()
+    changes = get_pnl_history().quarter_changes(company, item)
+    if changes is None:
+        return jsonify({"status": "error", "message": "Company or item not found"}), 404
+    changes["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(changes), 200
+
+@app.route('/history/peers', methods=['GET'])
+def get_history_peers() -> Tuple[Response, int]:
+    """
+    Aggregate a line item across every company that filed for a period.
+
+    Query parameters:
+        item (str): Canonical line item or row label
+        period (str): Month the period ends in, as YYYY-MM
+        months (int, optional): Length of the period (default 3 for quarters)
+        currency (str, optional): Only filings in this currency (default LKR)
+        company (str, optional): Company to place among its peers
+
+    Returns:
+        tuple: JSON response with the count, mean, median, quartiles and range, and
+            HTTP status code
+    """
+    item = request.args.get('item', '')
+    if not item:
+        return jsonify({"status": "error", "message": "item is required"}), 400
+    started = time.perf_counter()
+    try:
+        peers = get_pnl_history().peers(
+            item,
+            request.args.get('period', ''),
+            months=request.args.get('months', default=3, type=int),
+            currency=request.args.get('currency', 'LKR').upper(),
+            company=request.args.get('company')
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    peers["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(peers), 200
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats() -> Tuple[Response, int]:
+    """
+    Report artifact cache hit and miss counters for this server process.
+
+    Returns:
+        tuple: JSON response and HTTP status code
+    """
+    return jsonify(artifact_cache.stats()), 200
+
+@app.route('/resources', methods=['GET'])
+def get_resources() -> Tuple[Response, int]:
+    """
+    Report the memory budget and the rendering and extraction jobs admitted or queued
+    against it, across every server process on the host.
+
+    Returns:
+        tuple: JSON response and HTTP status code
+    """
+    return jsonify(resource_governor.snapshot()), 200
+
+@app.route('/agents/usage', methods=['GET'])
+def get_agent_usage() -> Tuple[Response, int]:
+    """
+    Report accumulated OpenAI calls, retries, latency and token usage per agent
+    for this server process.
+
+    Returns:
+        tuple: JSON response and HTTP status code
+    """
+    return jsonify(runtime.usage_stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics() -> Response:
+    """
+    Expose pipeline, OpenAI and worker metrics in the Prometheus text format.
+
+    Returns:
+        Response: The metrics exposition
+    """
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
+    recover_jobs()
     app.run()